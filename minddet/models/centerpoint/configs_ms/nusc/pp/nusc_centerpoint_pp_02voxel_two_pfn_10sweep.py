@@ -1,7 +1,7 @@
 import itertools
 import logging
 
-from det3d_ms.utils.config_tool import get_downsample_factor
+from det3d_ms.utils.config_tool import get_downsample_factor, get_output_shape
 
 tasks = [
     dict(num_class=1, class_names=["car"]),
@@ -19,6 +19,15 @@ target_assigner = dict(
     tasks=tasks,
 )
 
+voxel_generator = dict(
+    range=[-51.2, -51.2, -5.0, 51.2, 51.2, 3.0],
+    voxel_size=[0.2, 0.2, 8],
+    max_points_in_voxel=20,
+    max_voxel_num=[30000, 60000],
+    # reuse the voxelization buffers of the worker across samples
+    workspace=True,
+)
+
 
 # model settings
 model = dict(
@@ -32,7 +41,12 @@ model = dict(
         voxel_size=(0.2, 0.2, 8),
         pc_range=(-51.2, -51.2, -5.0, 51.2, 51.2, 3.0),
     ),
-    backbone=dict(type="PointPillarsScatter", ds_factor=1),
+    # ny, nx of the pseudo image, the voxel grid of voxel_generator
+    backbone=dict(
+        type="PointPillarsScatter",
+        ds_factor=1,
+        output_shape=get_output_shape(voxel_generator),
+    ),
     neck=dict(
         type="RPN",
         layer_nums=[3, 5, 5],
@@ -143,13 +157,6 @@ val_preprocessor = dict(
     shuffle_points=False,
 )
 
-voxel_generator = dict(
-    range=[-51.2, -51.2, -5.0, 51.2, 51.2, 3.0],
-    voxel_size=[0.2, 0.2, 8],
-    max_points_in_voxel=20,
-    max_voxel_num=[30000, 60000],
-)
-
 train_pipeline = [
     dict(type="LoadPointCloudFromFile", dataset=dataset_type),
     dict(type="LoadPointCloudAnnotations", with_bbox=True),
@@ -1,16 +1,23 @@
 import numba
 import numpy as np
 from det3d_ms.core.bbox.geometry import (
+    points_count_convex_polygon_3d_bev,
     points_count_convex_polygon_3d_jit,
+    points_in_convex_polygon_3d_bev,
     points_in_convex_polygon_3d_jit,
 )
 
 
-def points_count_rbbox(points, rbbox, z_axis=2, origin=(0.5, 0.5, 0.5)):
+def points_count_rbbox(points, rbbox, z_axis=2, origin=(0.5, 0.5, 0.5), engine="bev"):
+    """Number of points in every box, engine "bev" only tests the points of
+    the BEV cells under a box, "dense" tests all points against all boxes.
+    """
     rbbox_corners = center_to_corner_box3d(
         rbbox[:, :3], rbbox[:, 3:6], rbbox[:, -1], origin=origin, axis=z_axis
     )
     surfaces = corner_to_surfaces_3d(rbbox_corners)
+    if engine == "bev":
+        return points_count_convex_polygon_3d_bev(points[:, :3], surfaces)
     return points_count_convex_polygon_3d_jit(points[:, :3], surfaces)
 
 
@@ -315,11 +322,16 @@ def box_lidar_to_camera(data, r_rect, velo2cam):
     return np.concatenate([xyz, l, h, w, r], axis=1)
 
 
-def points_in_rbbox(points, rbbox, z_axis=2, origin=(0.5, 0.5, 0.5)):
+def points_in_rbbox(points, rbbox, z_axis=2, origin=(0.5, 0.5, 0.5), engine="bev"):
+    """[num_points, num_boxes] bool mask of the points in every box, see
+    points_count_rbbox for engine.
+    """
     rbbox_corners = center_to_corner_box3d(
         rbbox[:, :3], rbbox[:, 3:6], rbbox[:, -1], origin=origin, axis=z_axis
     )
     surfaces = corner_to_surfaces_3d(rbbox_corners)
+    if engine == "bev":
+        return points_in_convex_polygon_3d_bev(points[:, :3], surfaces)
     indices = points_in_convex_polygon_3d_jit(points[:, :3], surfaces)
     return indices
 
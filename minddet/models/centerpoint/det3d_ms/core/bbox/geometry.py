@@ -273,6 +273,138 @@ def _points_in_convex_polygon_3d_jit(
     return ret
 
 
+@numba.njit
+def bev_bin_points(points, cell_size=1.0, max_cells=1024):
+    """Sort points into a BEV grid covering their x, y range.
+
+    Returns (grid, order, cell_start), grid is (x0, y0, cell_size, nx, ny) and
+    the points of cell c are order[cell_start[c]:cell_start[c + 1]], cells are
+    numbered y major so a row of cells is one contiguous range.
+    """
+    num_points = points.shape[0]
+    x0 = points[:, 0].min()
+    y0 = points[:, 1].min()
+    # coarser cells for far outliers, keeps the grid at most max_cells wide
+    cell_size = max(
+        cell_size,
+        (points[:, 0].max() - x0) / max_cells,
+        (points[:, 1].max() - y0) / max_cells,
+    )
+    nx = int((points[:, 0].max() - x0) / cell_size) + 1
+    ny = int((points[:, 1].max() - y0) / cell_size) + 1
+    cell = np.empty(num_points, dtype=np.int64)
+    cell_start = np.zeros(nx * ny + 1, dtype=np.int64)
+    for i in range(num_points):
+        cx = min(int((points[i, 0] - x0) / cell_size), nx - 1)
+        cy = min(int((points[i, 1] - y0) / cell_size), ny - 1)
+        cell[i] = cy * nx + cx
+        cell_start[cell[i] + 1] += 1
+    for c in range(nx * ny):
+        cell_start[c + 1] += cell_start[c]
+    fill = cell_start[:-1].copy()
+    order = np.empty(num_points, dtype=np.int64)
+    for i in range(num_points):
+        order[fill[cell[i]]] = i
+        fill[cell[i]] += 1
+    return (x0, y0, cell_size, nx, ny), order, cell_start
+
+
+@numba.njit
+def _bev_cell_range(rect, grid, pad=1e-2):
+    # cells overlapping rect, padded to cover the rounding of the plane test
+    x0, y0, cell_size, nx, ny = grid
+    ix0 = int(np.floor((rect[0] - pad - x0) / cell_size))
+    iy0 = int(np.floor((rect[1] - pad - y0) / cell_size))
+    ix1 = int(np.floor((rect[2] + pad - x0) / cell_size))
+    iy1 = int(np.floor((rect[3] + pad - y0) / cell_size))
+    return max(ix0, 0), max(iy0, 0), min(ix1, nx - 1), min(iy1, ny - 1)
+
+
+@numba.njit
+def _point_in_surfaces(points, i, normal_vec, d, j):
+    for k in range(normal_vec.shape[1]):
+        sign = (
+            points[i, 0] * normal_vec[j, k, 0]
+            + points[i, 1] * normal_vec[j, k, 1]
+            + points[i, 2] * normal_vec[j, k, 2]
+            + d[j, k]
+        )
+        if sign >= 0:
+            return False
+    return True
+
+
+@numba.njit(parallel=True)
+def _points_count_convex_polygon_3d_bev(
+    points, normal_vec, d, rects, grid, order, cell_start
+):
+    nx = grid[3]
+    num_polygons = normal_vec.shape[0]
+    ret = np.zeros((num_polygons,), dtype=np.int64)
+    for j in numba.prange(num_polygons):
+        ix0, iy0, ix1, iy1 = _bev_cell_range(rects[j], grid)
+        count = 0
+        for iy in range(iy0, iy1 + 1):
+            if ix0 > ix1:
+                break
+            for idx in range(cell_start[iy * nx + ix0], cell_start[iy * nx + ix1 + 1]):
+                if _point_in_surfaces(points, order[idx], normal_vec, d, j):
+                    count += 1
+        ret[j] = count
+    return ret
+
+
+@numba.njit(parallel=True)
+def _points_in_convex_polygon_3d_bev(
+    points, normal_vec, d, rects, grid, order, cell_start
+):
+    nx = grid[3]
+    num_polygons = normal_vec.shape[0]
+    ret = np.zeros((points.shape[0], num_polygons), dtype=np.bool_)
+    for j in numba.prange(num_polygons):
+        ix0, iy0, ix1, iy1 = _bev_cell_range(rects[j], grid)
+        for iy in range(iy0, iy1 + 1):
+            if ix0 > ix1:
+                break
+            for idx in range(cell_start[iy * nx + ix0], cell_start[iy * nx + ix1 + 1]):
+                i = order[idx]
+                ret[i, j] = _point_in_surfaces(points, i, normal_vec, d, j)
+    return ret
+
+
+def points_count_convex_polygon_3d_bev(points, polygon_surfaces, cell_size=1.0):
+    """points_count_convex_polygon_3d_jit which only tests the points binned
+    into the BEV cells under each polygon's standup rectangle, in parallel
+    over polygons. Same results, polygons must use all their surfaces.
+    """
+    num_polygons = polygon_surfaces.shape[0]
+    if points.shape[0] == 0 or num_polygons == 0:
+        return np.zeros((num_polygons,), dtype=np.int64)
+    normal_vec, d = surface_equ_3d_jitv2(polygon_surfaces[:, :, :3, :])
+    corners = polygon_surfaces.reshape(num_polygons, -1, 3)[:, :, :2]
+    rects = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    grid, order, cell_start = bev_bin_points(points, cell_size)
+    return _points_count_convex_polygon_3d_bev(
+        points, normal_vec, d, rects, grid, order, cell_start
+    )
+
+
+def points_in_convex_polygon_3d_bev(points, polygon_surfaces, cell_size=1.0):
+    """points_in_convex_polygon_3d_jit on the BEV binned points, see
+    points_count_convex_polygon_3d_bev.
+    """
+    num_polygons = polygon_surfaces.shape[0]
+    if points.shape[0] == 0 or num_polygons == 0:
+        return np.zeros((points.shape[0], num_polygons), dtype=np.bool_)
+    normal_vec, d = surface_equ_3d_jitv2(polygon_surfaces[:, :, :3, :])
+    corners = polygon_surfaces.reshape(num_polygons, -1, 3)[:, :, :2]
+    rects = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    grid, order, cell_start = bev_bin_points(points, cell_size)
+    return _points_in_convex_polygon_3d_bev(
+        points, normal_vec, d, rects, grid, order, cell_start
+    )
+
+
 # @numba.jit
 def points_in_convex_polygon_jit(points, polygon, clockwise=True):
     """check points is in 2d convex polygons. True when point in polygon
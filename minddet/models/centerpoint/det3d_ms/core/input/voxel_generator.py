@@ -1,9 +1,27 @@
 import numpy as np
-from det3d_ms.ops.point_cloud.point_cloud_ops import points_to_voxel
+from det3d_ms.ops.point_cloud.point_cloud_ops import (
+    VoxelWorkspace,
+    points_to_voxel,
+    points_to_voxel_sorted,
+)
+
+VOXEL_ENGINES = {
+    "dense": points_to_voxel,
+    "sort": points_to_voxel_sorted,
+}
 
 
 class VoxelGenerator:
-    def __init__(self, voxel_size, point_cloud_range, max_num_points, max_voxels=20000):
+    def __init__(
+        self,
+        voxel_size,
+        point_cloud_range,
+        max_num_points,
+        max_voxels=20000,
+        engine="dense",
+        workspace=False,
+    ):
+        assert engine in VOXEL_ENGINES, "unknown voxel engine {}".format(engine)
         point_cloud_range = np.array(point_cloud_range, dtype=np.float32)
         # [0, -40, -3, 70.4, 40, 1]
         voxel_size = np.array(voxel_size, dtype=np.float32)
@@ -15,12 +33,29 @@ class VoxelGenerator:
         self._max_num_points = max_num_points
         self._max_voxels = max_voxels
         self._grid_size = grid_size
+        self._engine = engine
+        # reuse the output buffers and the voxel grid across calls
+        self._workspace = (
+            VoxelWorkspace(voxel_size, point_cloud_range, max_num_points)
+            if workspace
+            else None
+        )
 
-    def generate(self, points, max_voxels=-1):
+    def generate(self, points, max_voxels=-1, engine=None, copy=False):
+        """Voxelize points.
+
+        With a workspace the results are views that the next call overwrites
+        unless copy is True. Without one fresh arrays are always returned.
+        """
         if max_voxels == -1:
             max_voxels = self._max_voxels
+        if engine is None:
+            engine = self._engine
+
+        if self._workspace is not None:
+            return self._workspace.generate(points, max_voxels, engine, copy=copy)
 
-        return points_to_voxel(
+        return VOXEL_ENGINES[engine](
             points,
             self._voxel_size,
             self._point_cloud_range,
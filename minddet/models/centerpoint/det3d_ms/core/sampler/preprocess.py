@@ -47,6 +47,87 @@ class BatchSampler:
         return [self._sampled_list[i] for i in indices]
         # return np.random.choice(self._sampled_list, num)
 
+    def sample_indices(self, num):
+        return self._sample(num).copy()
+
+
+class DBInfoTable:
+    """db_infos of one or more classes as a struct of arrays.
+
+    Row i is db_infos[i], offsets is -1 for objects stored in their own file and
+    rot_transforms the yaw added by the sampler's per object rotation.
+    """
+
+    columns = [
+        "names",
+        "boxes",
+        "num_points",
+        "difficulty",
+        "group_ids",
+        "paths",
+        "offsets",
+        "rot_transforms",
+    ]
+
+    def __init__(
+        self,
+        names,
+        boxes,
+        num_points,
+        difficulty,
+        group_ids,
+        paths,
+        offsets,
+        rot_transforms=None,
+    ):
+        self.names = names
+        self.boxes = boxes
+        self.num_points = num_points
+        self.difficulty = difficulty
+        self.group_ids = group_ids
+        # bytes, a single buffer instead of one str object per row
+        self.paths = paths
+        self.offsets = offsets
+        if rot_transforms is None:
+            rot_transforms = np.zeros(len(names), dtype=boxes.dtype)
+        self.rot_transforms = rot_transforms
+
+    @classmethod
+    def from_infos(cls, infos):
+        if len(infos) == 0:
+            boxes = np.zeros((0, 0), dtype=np.float32)
+        else:
+            boxes = np.stack([info["box3d_lidar"] for info in infos], axis=0)
+        return cls(
+            names=np.array([info["name"] for info in infos], dtype=np.str_),
+            boxes=boxes,
+            num_points=np.array(
+                [info["num_points_in_gt"] for info in infos], dtype=np.int64
+            ),
+            difficulty=np.array([info["difficulty"] for info in infos], dtype=np.int64),
+            group_ids=np.array([info["group_id"] for info in infos], dtype=np.int64),
+            paths=np.array([info["path"].encode() for info in infos], dtype=np.bytes_),
+            offsets=np.array(
+                [info.get("offset", -1) for info in infos], dtype=np.int64
+            ),
+        )
+
+    @classmethod
+    def concatenate(cls, tables):
+        tables = [t for t in tables if len(t) > 0] or tables[:1]
+        return cls(
+            *[
+                np.concatenate([getattr(t, name) for t in tables], axis=0)
+                for name in cls.columns
+            ]
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def select(self, index):
+        return DBInfoTable(*[getattr(self, name)[index] for name in self.columns])
+
 
 class DataBasePreprocessing:
     def __call__(self, db_infos):
@@ -65,11 +146,9 @@ class DBFilterByDifficulty(DataBasePreprocessing):
     def _preprocess(self, db_infos):
         new_db_infos = {}
         for key, dinfos in db_infos.items():
-            new_db_infos[key] = [
-                info
-                for info in dinfos
-                if info["difficulty"] not in self._removed_difficulties
-            ]
+            new_db_infos[key] = dinfos.select(
+                np.logical_not(np.isin(dinfos.difficulty, self._removed_difficulties))
+            )
         return new_db_infos
 
 
@@ -81,11 +160,9 @@ class DBFilterByMinNumPoint(DataBasePreprocessing):
     def _preprocess(self, db_infos):
         for name, min_num in self._min_gt_point_dict.items():
             if min_num > 0:
-                filtered_infos = []
-                for info in db_infos[name]:
-                    if info["num_points_in_gt"] >= min_num:
-                        filtered_infos.append(info)
-                db_infos[name] = filtered_infos
+                db_infos[name] = db_infos[name].select(
+                    db_infos[name].num_points >= min_num
+                )
         return db_infos
 
 
@@ -809,6 +886,117 @@ def box_collision_test(boxes, qboxes, clockwise=True):
     return ret
 
 
+@numba.jit(nopython=True)
+def _box_pair_collide(box, qbox, clockwise):
+    # exact test of box_collision_test for one pair with overlapping standups
+    for k in range(4):
+        A = box[k]
+        B = box[(k + 1) % 4]
+        for lm in range(4):
+            C = qbox[lm]
+            D = qbox[(lm + 1) % 4]
+            acd = (D[1] - A[1]) * (C[0] - A[0]) > (C[1] - A[1]) * (D[0] - A[0])
+            bcd = (D[1] - B[1]) * (C[0] - B[0]) > (C[1] - B[1]) * (D[0] - B[0])
+            if acd != bcd:
+                abc = (C[1] - A[1]) * (B[0] - A[0]) > (B[1] - A[1]) * (C[0] - A[0])
+                abd = (D[1] - A[1]) * (B[0] - A[0]) > (B[1] - A[1]) * (D[0] - A[0])
+                if abc != abd:
+                    return True
+    for first, second in ((box, qbox), (qbox, box)):
+        # every corner of second inside first
+        inside = True
+        for lm in range(4):
+            for k in range(4):
+                vec = first[k] - first[(k + 1) % 4]
+                if clockwise:
+                    vec = -vec
+                cross = vec[1] * (first[k, 0] - second[lm, 0])
+                cross -= vec[0] * (first[k, 1] - second[lm, 1])
+                if cross >= 0:
+                    inside = False
+                    break
+            if not inside:
+                break
+        if inside:
+            return True
+    return False
+
+
+@numba.njit(parallel=True)
+def _sampled_collision_kernel(boxes, standup, order, sorted_xmin, max_width, start):
+    # rows are the boxes from start on, columns all boxes, candidates are the
+    # boxes whose xmin lies in the sweep window (xmin - max_width, xmax)
+    num_boxes = boxes.shape[0]
+    ret = np.zeros((num_boxes - start, num_boxes), dtype=np.bool_)
+    for r in numba.prange(num_boxes - start):
+        i = start + r
+        lo = np.searchsorted(sorted_xmin, standup[i, 0] - max_width, side="right")
+        hi = np.searchsorted(sorted_xmin, standup[i, 2], side="left")
+        for c in range(lo, hi):
+            j = order[c]
+            if j == i:
+                continue
+            iw = min(standup[i, 2], standup[j, 2]) - max(standup[i, 0], standup[j, 0])
+            if iw > 0:
+                ih = min(standup[i, 3], standup[j, 3]) - max(
+                    standup[i, 1], standup[j, 1]
+                )
+                if ih > 0:
+                    ret[r, j] = _box_pair_collide(boxes[i], boxes[j], True)
+    return ret
+
+
+@numba.jit(nopython=True)
+def _accept_sampled_kernel(coll, start, group_sizes):
+    # a group is dropped when a box of it collides with a box that is still
+    # alive, existing boxes always are, dropped groups no longer collide
+    num_boxes = coll.shape[1]
+    alive = np.ones(num_boxes, dtype=np.bool_)
+    valid = np.zeros(num_boxes - start, dtype=np.bool_)
+    row = 0
+    for size in group_sizes:
+        collide = False
+        for r in range(row, row + size):
+            for j in range(num_boxes):
+                if alive[j] and coll[r, j]:
+                    collide = True
+                    break
+            if collide:
+                break
+        for r in range(row, row + size):
+            valid[r] = not collide
+            alive[start + r] = not collide
+        row += size
+    return valid
+
+
+def sampled_box_collision_test(boxes, num_existing, group_sizes=None):
+    """Accept sampled boxes in order, the result box_collision_test(boxes, boxes)
+    gives in sample_class_v2 / sample_group.
+
+    boxes: [N + K, 4, 2] bev corners, the K sampled after the N existing ones.
+    group_sizes: sampled boxes accepted or dropped together, default one each.
+    Only the K sampled rows are tested, against candidates pruned by a sweep
+    over the sorted standup xmin, so the existing boxes are never tested
+    against each other.
+    Returns:
+        [K] bool, whether each sampled box is kept.
+    """
+    num_sampled = boxes.shape[0] - num_existing
+    if group_sizes is None:
+        group_sizes = np.ones(num_sampled, dtype=np.int64)
+    standup = box_np_ops.corner_to_standup_nd_jit(boxes)
+    order = np.argsort(standup[:, 0], kind="stable")
+    # padded so that rounding never moves an overlapping box out of the window
+    max_width = (standup[:, 2] - standup[:, 0]).max() * 1.001 + 1e-6
+    coll = _sampled_collision_kernel(
+        boxes, standup, order, standup[order, 0], max_width, num_existing
+    )
+    return _accept_sampled_kernel(
+        coll, num_existing, np.asarray(group_sizes, dtype=np.int64)
+    )
+
+
 def global_translate_(gt_boxes, points, noise_translate_std):
     """
     Apply global translation to gt_boxes and points.
@@ -834,6 +1022,79 @@ def global_translate_(gt_boxes, points, noise_translate_std):
     return gt_boxes, points
 
 
+def sample_global_transform(
+    rotation=np.pi / 4,
+    min_scale=0.95,
+    max_scale=1.05,
+    noise_translate_std=0,
+    probability=0.5,
+):
+    """Draw the parameters of random_flip_both, global_rotation,
+    global_scaling_v2 and global_translate_ in their order, so that the same
+    seed gives the same augmentation on either path."""
+    flip_x = np.random.choice(
+        [False, True], replace=False, p=[1 - probability, probability]
+    )
+    flip_y = np.random.choice(
+        [False, True], replace=False, p=[1 - probability, probability]
+    )
+    if not isinstance(rotation, list):
+        rotation = [-rotation, rotation]
+    angle = np.random.uniform(rotation[0], rotation[1])
+    scale = np.random.uniform(min_scale, max_scale)
+    if not isinstance(noise_translate_std, (list, tuple, np.ndarray)):
+        noise_translate_std = np.array(
+            [noise_translate_std, noise_translate_std, noise_translate_std]
+        )
+    translate = np.zeros(3)
+    if not all([e == 0 for e in noise_translate_std]):
+        translate = np.array(
+            [
+                np.random.normal(0, noise_translate_std[0]),
+                np.random.normal(0, noise_translate_std[1]),
+                np.random.normal(0, noise_translate_std[0]),
+            ]
+        )
+    return flip_x, flip_y, angle, scale, translate
+
+
+@numba.njit(parallel=True)
+def _affine_points_(points, mat, translate):
+    for i in numba.prange(points.shape[0]):
+        x = np.float64(points[i, 0])
+        y = np.float64(points[i, 1])
+        z = np.float64(points[i, 2])
+        for k in range(3):
+            points[i, k] = mat[k, 0] * x + mat[k, 1] * y + mat[k, 2] * z + translate[k]
+
+
+def global_transform_(gt_boxes, points, flip_x, flip_y, angle, scale, translate):
+    """Apply the augmentation of sample_global_transform as one affine transform
+    of the points and one of the boxes, in place."""
+    flip = np.diag([-1.0 if flip_y else 1.0, -1.0 if flip_x else 1.0, 1.0])
+    rot_sin = np.sin(angle)
+    rot_cos = np.cos(angle)
+    # the transpose of rotation_points_single_angle's rot_mat_T
+    rot = np.array([[rot_cos, rot_sin, 0], [-rot_sin, rot_cos, 0], [0, 0, 1]])
+    mat = scale * rot @ flip
+    _affine_points_(points, mat, translate)
+
+    gt_boxes[:, :3] = gt_boxes[:, :3] @ mat.T + translate
+    gt_boxes[:, 3:-1] *= scale
+    if gt_boxes.shape[1] > 7:
+        # velocity is already scaled above
+        gt_boxes[:, 6:8] = gt_boxes[:, 6:8] @ (rot @ flip)[:2, :2].T
+    # yaw: x flip r -> pi - r, y flip r -> 2 pi - r
+    yaw_sign = 1.0
+    yaw_offset = 0.0
+    if flip_x:
+        yaw_sign, yaw_offset = -yaw_sign, np.pi - yaw_offset
+    if flip_y:
+        yaw_sign, yaw_offset = -yaw_sign, 2 * np.pi - yaw_offset
+    gt_boxes[:, -1] = yaw_sign * gt_boxes[:, -1] + (yaw_offset + angle)
+    return gt_boxes, points
+
+
 if __name__ == "__main__":
     bboxes = np.array(
         [
@@ -1,6 +1,4 @@
-import copy
 import pathlib
-from functools import reduce
 
 import numpy as np
 from det3d_ms.core.bbox import box_np_ops
@@ -19,6 +17,11 @@ class DataBaseSamplerV2:
     ):
         for k, v in db_infos.items():
             logger.info(f"load {len(v)} {k} database infos")
+        # columnar once, workers then share a few arrays instead of the dict graph
+        db_infos = {
+            k: v if isinstance(v, prep.DBInfoTable) else prep.DBInfoTable.from_infos(v)
+            for k, v in db_infos.items()
+        }
 
         if db_prepor is not None:
             db_infos = db_prepor(db_infos)
@@ -44,29 +47,29 @@ class DataBaseSamplerV2:
                 self._sample_max_nums += list(group_info.values())
         else:
             for group_info in groups:
-                group_dict = {}
                 group_names = list(group_info.keys())
                 group_name = ", ".join(group_names)
                 self._sample_classes += group_names
                 self._sample_max_nums += list(group_info.values())
                 self._group_name_to_names.append((group_name, group_names))
-                # self._group_name_to_names[group_name] = group_names
-                for name in group_names:
-                    for item in db_infos[name]:
-                        gid = item["group_id"]
-                        if gid not in group_dict:
-                            group_dict[gid] = [item]
-                        else:
-                            group_dict[gid] += [item]
                 if group_name in self._group_db_infos:
                     raise ValueError("group must be unique")
-                group_data = list(group_dict.values())
-                self._group_db_infos[group_name] = group_data
+                table = prep.DBInfoTable.concatenate(
+                    [db_infos[name] for name in group_names]
+                )
+                # rows of every group id, groups in order of first appearance
+                _, first, inverse = np.unique(
+                    table.group_ids, return_index=True, return_inverse=True
+                )
+                rows = np.argsort(inverse, kind="stable")
+                splits = np.cumsum(np.bincount(inverse))[:-1]
+                group_rows = np.split(rows, splits)
+                group_data = [group_rows[i] for i in np.argsort(first)]
+                self._group_db_infos[group_name] = (table, group_data)
                 info_dict = {}
                 if len(group_info) > 1:
                     for group in group_data:
-                        names = [item["name"] for item in group]
-                        names = sorted(names)
+                        names = sorted(table.names[group])
                         group_name = ", ".join(names)
                         if group_name in info_dict:
                             info_dict[group_name] += 1
@@ -76,7 +79,10 @@ class DataBaseSamplerV2:
 
         self._sampler_dict = {}
         for k, v in self._group_db_infos.items():
-            self._sampler_dict[k] = prep.BatchSampler(v, k)
+            if self._use_group_sampling:
+                self._sampler_dict[k] = prep.BatchSampler(v[1], k)
+            else:
+                self._sampler_dict[k] = prep.BatchSampler(v, k)
         self._enable_global_rot = False
         if global_rot_range is not None:
             if not isinstance(global_rot_range, (list, tuple, np.ndarray)):
@@ -84,11 +90,23 @@ class DataBaseSamplerV2:
             if np.abs(global_rot_range[0] - global_rot_range[1]) >= 1e-3:
                 self._enable_global_rot = True
         self._global_rot_range = global_rot_range
+        # memory maps of the packed gt databases, opened on first use
+        self._packed_points = {}
 
     @property
     def use_group_sampling(self):
         return self._use_group_sampling
 
+    def load_points(self, root_path, path, offset, num_points, num_point_features):
+        path = str(pathlib.Path(root_path) / path.decode())
+        if offset < 0:
+            return np.fromfile(path, dtype=np.float32).reshape(-1, num_point_features)
+        if path not in self._packed_points:
+            self._packed_points[path] = np.memmap(
+                path, dtype=np.float32, mode="r"
+            ).reshape(-1, num_point_features)
+        return np.array(self._packed_points[path][offset : offset + num_points])
+
     def sample_all(
         self,
         root_path,
@@ -125,7 +143,6 @@ class DataBaseSamplerV2:
                 sampled_groups.append(group_name)
             total_group_ids = gt_group_ids
         sampled = []
-        sampled_gt_boxes = []
         avoid_coll_boxes = gt_boxes
 
         for class_name, sampled_num in zip(sampled_groups, sample_num_per_class):
@@ -139,53 +156,40 @@ class DataBaseSamplerV2:
                         class_name, sampled_num, avoid_coll_boxes
                     )
 
-                sampled += sampled_cls
                 if len(sampled_cls) > 0:
-                    if len(sampled_cls) == 1:
-                        sampled_gt_box = sampled_cls[0]["box3d_lidar"][np.newaxis, ...]
-                    else:
-                        sampled_gt_box = np.stack(
-                            [s["box3d_lidar"] for s in sampled_cls], axis=0
-                        )
-
-                    sampled_gt_boxes += [sampled_gt_box]
+                    sampled.append(sampled_cls)
                     avoid_coll_boxes = np.concatenate(
-                        [avoid_coll_boxes, sampled_gt_box], axis=0
+                        [avoid_coll_boxes, sampled_cls.boxes], axis=0
                     )
                     if self._use_group_sampling:
-                        if len(sampled_cls) == 1:
-                            sampled_group_ids = np.array(sampled_cls[0]["group_id"])[
-                                np.newaxis, ...
-                            ]
-                        else:
-                            sampled_group_ids = np.stack(
-                                [s["group_id"] for s in sampled_cls], axis=0
-                            )
                         total_group_ids = np.concatenate(
-                            [total_group_ids, sampled_group_ids], axis=0
+                            [total_group_ids, sampled_cls.group_ids], axis=0
                         )
 
         if len(sampled) > 0:
-            sampled_gt_boxes = np.concatenate(sampled_gt_boxes, axis=0)
+            sampled = prep.DBInfoTable.concatenate(sampled)
+            sampled_gt_boxes = sampled.boxes
 
             num_sampled = len(sampled)
             s_points_list = []
-            for info in sampled:
+            for i in range(num_sampled):
                 try:
-                    s_points = np.fromfile(
-                        str(pathlib.Path(root_path) / info["path"]), dtype=np.float32
-                    ).reshape(-1, num_point_features)
+                    s_points = self.load_points(
+                        root_path,
+                        sampled.paths[i],
+                        sampled.offsets[i],
+                        sampled.num_points[i],
+                        num_point_features,
+                    )
 
-                    if "rot_transform" in info:
-                        rot = info["rot_transform"]
+                    if self._enable_global_rot:
                         s_points[:, :3] = box_np_ops.rotation_points_single_angle(
-                            s_points[:, :4], rot, axis=2
+                            s_points[:, :3], sampled.rot_transforms[i], axis=2
                         )
-                    s_points[:, :3] += info["box3d_lidar"][:3]
+                    s_points[:, :3] += sampled.boxes[i, :3]
                     s_points_list.append(s_points)
-                    # print(pathlib.Path(info["path"]).stem)
                 except Exception:
-                    print(str(pathlib.Path(root_path) / info["path"]))
+                    print(str(pathlib.Path(root_path) / sampled.paths[i].decode()))
                     continue
             if random_crop:
                 s_points_list_new = []
@@ -206,14 +210,14 @@ class DataBaseSamplerV2:
                     s_points_list_new.append(s_points)
                 s_points_list = s_points_list_new
             ret = {
-                "gt_names": np.array([s["name"] for s in sampled]),
-                "difficulty": np.array([s["difficulty"] for s in sampled]),
+                "gt_names": sampled.names,
+                "difficulty": sampled.difficulty,
                 "gt_boxes": sampled_gt_boxes,
                 "points": np.concatenate(s_points_list, axis=0),
                 "gt_masks": np.ones((num_sampled,), dtype=np.bool_),
             }
             if self._use_group_sampling:
-                ret["group_ids"] = np.array([s["group_id"] for s in sampled])
+                ret["group_ids"] = sampled.group_ids
             else:
                 ret["group_ids"] = np.arange(
                     gt_boxes.shape[0], gt_boxes.shape[0] + len(sampled)
@@ -225,33 +229,36 @@ class DataBaseSamplerV2:
     def sample(self, name, num):
         if self._use_group_sampling:
             group_name = name
-            ret = self._sampler_dict[group_name].sample(num)
-            groups_num = [len(lm) for lm in ret]
-            return reduce(lambda x, y: x + y, ret), groups_num
+            table, _ = self._group_db_infos[group_name]
+            groups = self._sampler_dict[group_name].sample(num)
+            groups_num = [len(g) for g in groups]
+            rows = np.concatenate(groups) if groups else np.zeros(0, np.int64)
+            return table.select(rows), groups_num
         else:
-            ret = self._sampler_dict[name].sample(num)
-            return ret, np.ones((len(ret),), dtype=np.int64)
+            rows = self._sampler_dict[name].sample_indices(num)
+            return self.db_infos[name].select(rows), np.ones(
+                (len(rows),), dtype=np.int64
+            )
 
     def sample_v1(self, name, num):
         if isinstance(name, (list, tuple)):
-            group_name = ", ".join(name)
-            ret = self._sampler_dict[group_name].sample(num)
-            groups_num = [len(lm) for lm in ret]
-            return reduce(lambda x, y: x + y, ret), groups_num
-        else:
-            ret = self._sampler_dict[name].sample(num)
-            return ret, np.ones((len(ret),), dtype=np.int64)
+            name = ", ".join(name)
+        return self.sample(name, num)
 
     def sample_class_v2(self, name, num, gt_boxes):
-        sampled = self._sampler_dict[name].sample(num)
-        sampled = copy.deepcopy(sampled)
+        # select copies the rows, so they are updated in place below
+        sampled = self.db_infos[name].select(
+            self._sampler_dict[name].sample_indices(num)
+        )
         num_gt = gt_boxes.shape[0]
         num_sampled = len(sampled)
+        if num_sampled == 0:
+            return sampled
         gt_boxes_bv = box_np_ops.center_to_corner_box2d(
             gt_boxes[:, 0:2], gt_boxes[:, 3:5], gt_boxes[:, -1]
         )
 
-        sp_boxes = np.stack([i["box3d_lidar"] for i in sampled], axis=0)
+        sp_boxes = sampled.boxes
 
         valid_mask = np.zeros([gt_boxes.shape[0]], dtype=np.bool_)
         valid_mask = np.concatenate(
@@ -270,49 +277,31 @@ class DataBaseSamplerV2:
         )
 
         total_bv = np.concatenate([gt_boxes_bv, sp_boxes_bv], axis=0)
-        # coll_mat = collision_test_allbox(total_bv)
-        coll_mat = prep.box_collision_test(total_bv, total_bv)
-        diag = np.arange(total_bv.shape[0])
-        coll_mat[diag, diag] = False
-
-        valid_samples = []
-        for i in range(num_gt, num_gt + num_sampled):
-            if coll_mat[i].any():
-                coll_mat[i] = False
-                coll_mat[:, i] = False
-            else:
-                if self._enable_global_rot:
-                    sampled[i - num_gt]["box3d_lidar"][:2] = boxes[i, :2]
-                    sampled[i - num_gt]["box3d_lidar"][-1] = boxes[i, -1]
-                    sampled[i - num_gt]["rot_transform"] = (
-                        boxes[i, -1] - sp_boxes[i - num_gt, -1]
-                    )
-                valid_samples.append(sampled[i - num_gt])
-        return valid_samples
+        valid = prep.sampled_box_collision_test(total_bv, num_gt)
+        if self._enable_global_rot:
+            sampled.rot_transforms = sp_boxes_new[:, -1] - sp_boxes[:, -1]
+            sp_boxes[:, :2] = sp_boxes_new[:, :2]
+            sp_boxes[:, -1] = sp_boxes_new[:, -1]
+        return sampled.select(valid)
 
     def sample_group(self, name, num, gt_boxes, gt_group_ids):
         sampled, group_num = self.sample(name, num)
-        sampled = copy.deepcopy(sampled)
         # rewrite sampled group id to avoid duplicated with gt group ids
-        gid_map = {}
         max_gt_gid = np.max(gt_group_ids)
-        sampled_gid = max_gt_gid + 1
-        for s in sampled:
-            gid = s["group_id"]
-            if gid in gid_map:
-                s["group_id"] = gid_map[gid]
-            else:
-                gid_map[gid] = sampled_gid
-                s["group_id"] = sampled_gid
-                sampled_gid += 1
+        _, first, inverse = np.unique(
+            sampled.group_ids, return_index=True, return_inverse=True
+        )
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first)] = np.arange(len(first))
+        sampled.group_ids = max_gt_gid + 1 + rank[inverse]
 
         num_gt = gt_boxes.shape[0]
         gt_boxes_bv = box_np_ops.center_to_corner_box2d(
             gt_boxes[:, 0:2], gt_boxes[:, 3:5], gt_boxes[:, -1]
         )
 
-        sp_boxes = np.stack([i["box3d_lidar"] for i in sampled], axis=0)
-        sp_group_ids = np.stack([i["group_id"] for i in sampled], axis=0)
+        sp_boxes = sampled.boxes
+        sp_group_ids = sampled.group_ids
         valid_mask = np.zeros([gt_boxes.shape[0]], dtype=np.bool_)
         valid_mask = np.concatenate(
             [valid_mask, np.ones([sp_boxes.shape[0]], dtype=np.bool_)], axis=0
@@ -336,29 +325,9 @@ class DataBaseSamplerV2:
             sp_boxes_new[:, 0:2], sp_boxes_new[:, 3:5], sp_boxes_new[:, -1]
         )
         total_bv = np.concatenate([gt_boxes_bv, sp_boxes_bv], axis=0)
-        # coll_mat = collision_test_allbox(total_bv)
-        coll_mat = prep.box_collision_test(total_bv, total_bv)
-        diag = np.arange(total_bv.shape[0])
-        coll_mat[diag, diag] = False
-        valid_samples = []
-        idx = num_gt
-        for num in group_num:
-            if coll_mat[idx : idx + num].any():
-                coll_mat[idx : idx + num] = False
-                coll_mat[:, idx : idx + num] = False
-            else:
-                for i in range(num):
-                    if self._enable_global_rot:
-                        sampled[idx - num_gt + i]["box3d_lidar"][:2] = boxes[
-                            idx + i, :2
-                        ]
-                        sampled[idx - num_gt + i]["box3d_lidar"][-1] = boxes[
-                            idx + i, -1
-                        ]
-                        sampled[idx - num_gt + i]["rot_transform"] = (
-                            boxes[idx + i, -1] - sp_boxes[idx + i - num_gt, -1]
-                        )
-
-                    valid_samples.append(sampled[idx - num_gt + i])
-            idx += num
-        return valid_samples
+        valid = prep.sampled_box_collision_test(total_bv, num_gt, group_num)
+        if self._enable_global_rot:
+            sampled.rot_transforms = sp_boxes_new[:, -1] - sp_boxes[:, -1]
+            sp_boxes[:, :2] = sp_boxes_new[:, :2]
+            sp_boxes[:, -1] = sp_boxes_new[:, -1]
+        return sampled.select(valid)
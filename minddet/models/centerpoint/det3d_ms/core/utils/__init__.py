@@ -1,10 +1,11 @@
 # from .center_utils import *
 # from .circle_nms_jit import *
 # from .misc import *
-from . import center_utils, circle_nms_jit, misc
+from . import center_utils, circle_nms_jit, misc, rotate_nms_jit
 
 __all__ = [
     center_utils,
     circle_nms_jit,
     misc,
+    rotate_nms_jit,
 ]
@@ -7,6 +7,9 @@
 
 from __future__ import absolute_import, division, print_function
 
+from functools import lru_cache
+
+import numba
 import numpy as np
 import torch
 
@@ -33,7 +36,8 @@ def gaussian_radius(det_size, min_overlap=0.5):
     c3 = (min_overlap - 1) * width * height
     sq3 = np.sqrt(b3**2 - 4 * a3 * c3)
     r3 = (b3 + sq3) / 2
-    return min(r1, r2, r3)
+    # elementwise, so det_size may also be a pair of arrays
+    return np.minimum(np.minimum(r1, r2), r3)
 
 
 def gaussian2D(shape, sigma=1):
@@ -45,9 +49,18 @@ def gaussian2D(shape, sigma=1):
     return h
 
 
-def draw_umich_gaussian(heatmap, center, radius, k=1):
+@lru_cache(maxsize=None)
+def gaussian_kernel(radius):
+    """gaussian2D of draw_umich_gaussian, built once per radius and read-only."""
     diameter = 2 * radius + 1
     gaussian = gaussian2D((diameter, diameter), sigma=diameter / 6)
+    gaussian.setflags(write=False)
+    return gaussian
+
+
+def draw_umich_gaussian(heatmap, center, radius, k=1):
+    radius = int(radius)
+    gaussian = gaussian_kernel(radius)
 
     x, y = int(center[0]), int(center[1])
 
@@ -65,6 +78,54 @@ def draw_umich_gaussian(heatmap, center, radius, k=1):
     return heatmap
 
 
+@lru_cache(maxsize=None)
+def gaussian_kernels(max_radius):
+    """The gaussian_kernel of every radius up to max_radius, kernels[r] holds
+    the one of radius r in its top left (2r + 1, 2r + 1) corner."""
+    diameter = 2 * max_radius + 1
+    kernels = np.zeros((max_radius + 1, diameter, diameter), dtype=np.float64)
+    for radius in range(max_radius + 1):
+        kernels[radius, : 2 * radius + 1, : 2 * radius + 1] = gaussian_kernel(radius)
+    kernels.setflags(write=False)
+    return kernels
+
+
+@numba.njit
+def _draw_gaussians(heatmaps, cls_ids, centers, radii, kernels):
+    height, width = heatmaps.shape[1:]
+    for i in range(cls_ids.shape[0]):
+        heatmap = heatmaps[cls_ids[i]]
+        gaussian = kernels[radii[i]]
+        radius = radii[i]
+        x, y = int(centers[i, 0]), int(centers[i, 1])
+        left, right = min(x, radius), min(width - x, radius + 1)
+        top, bottom = min(y, radius), min(height - y, radius + 1)
+        for dy in range(-top, bottom):
+            for dx in range(-left, right):
+                value = gaussian[radius + dy, radius + dx]
+                if value > heatmap[y + dy, x + dx]:
+                    heatmap[y + dy, x + dx] = value
+
+
+def draw_umich_gaussian_batch(heatmaps, cls_ids, centers, radii):
+    """draw_umich_gaussian of every box, heatmaps: (C, H, W), centers: (N, 2).
+
+    The boxes are drawn in one numba loop, the same values as drawing them one
+    by one, centers are expected inside the heatmap.
+    """
+    if len(radii) == 0:
+        return heatmaps
+    radii = np.asarray(radii, dtype=np.int64)
+    _draw_gaussians(
+        heatmaps,
+        np.asarray(cls_ids, dtype=np.int64),
+        np.asarray(centers),
+        radii,
+        gaussian_kernels(int(radii.max())),
+    )
+    return heatmaps
+
+
 def _gather_feat(feat, ind, mask=None):
     dim = feat.size(2)
     ind = ind.unsqueeze(2).expand(ind.size(0), ind.size(1), dim)
@@ -1,26 +1,24 @@
-from mindspore import ops
-from mindspore.common import dtype as mstype
+import numba
+import numpy as np
 
 
-# @numba.jit(nopython=True)
+@numba.jit(nopython=True)
 def circle_nms(dets, thresh):
+    """Greedy NMS on the squared center distance, dets: (N, 3) of x, y, score.
+
+    Returns the kept indices, highest score first.
+    """
     x1 = dets[:, 0]
     y1 = dets[:, 1]
     scores = dets[:, 2]
-    print(scores, scores.shape)
-    scores = ops.Cast()(scores, mstype.float16)
-    order = ops.Cast()(
-        ops.Sort()(scores.view(-1))[0], mstype.int32
-    )  # [::-1] scores.argsort()[::-1].astype(np.int32)  # highest->lowest
+    # highest->lowest, ties in index order as circle_nms_matrix and CircleNMS
+    order = np.argsort(-scores, kind="stable").astype(np.int32)
     ndets = dets.shape[0]
-    suppressed = ops.Zeros()((ndets), mstype.int32)  # np.zeros((ndets), dtype=np.int32)
-    print("suppressed:", suppressed.shape)
+    suppressed = np.zeros((ndets), dtype=np.int32)
     keep = []
     for _i in range(ndets):
         i = order[_i]  # start with highest score box
-        if suppressed[i] == ops.ZerosLike()(
-            suppressed[i]
-        ):  # if any box have enough iou with this, remove it
+        if suppressed[i] == 1:  # if any box have enough iou with this, remove it
             continue
         keep.append(i)
         for _j in range(_i + 1, ndets):
@@ -34,3 +32,23 @@ def circle_nms(dets, thresh):
             if dist <= thresh:
                 suppressed[j] = 1
     return keep
+
+
+def circle_nms_matrix(dets, thresh):
+    """circle_nms on the pairwise distance matrix, the NumPy form of CircleNMS.
+
+    keep[j] is set while no kept box before j in score order is close to it,
+    iterated until keep no longer changes, which is the greedy result.
+    """
+    order = np.argsort(-dets[:, 2], kind="stable")
+    x1 = dets[order, 0]
+    y1 = dets[order, 1]
+    dist = (x1[:, None] - x1[None, :]) ** 2 + (y1[:, None] - y1[None, :]) ** 2
+    close = np.triu(dist <= thresh, 1).astype(np.float32)
+    keep = np.ones(len(order), dtype=np.float32)
+    while True:
+        new_keep = (keep @ close == 0).astype(np.float32)
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+    return order[keep > 0]
@@ -0,0 +1,220 @@
+"""Rotated BEV NMS in numba, a port of boxes_iou_nms_cpu in
+det3d_ms/ops/iou-bev-nms-org.cpp that runs without the prebuilt nms_fast.so.
+
+Boxes are [x, y, z, dx, dy, dz, heading] rows sorted by score, the greedy
+result, the zero area removal and the ``overlap / union >= thresh`` rule are
+those of the C++ kernel.
+"""
+import math
+
+import numba
+import numpy as np
+
+EPS = 1e-8
+# check_in_box2d accepts corners up to MARGIN outside the box in its own frame,
+# the standup boxes are padded by MARGIN * sqrt(2) so no such pair is pruned
+MARGIN = 1e-2
+STANDUP_PAD = 1.5e-2
+
+
+@numba.njit
+def _cross(p1x, p1y, p2x, p2y, p0x, p0y):
+    return (p1x - p0x) * (p2y - p0y) - (p2x - p0x) * (p1y - p0y)
+
+
+@numba.njit
+def _box_corners(boxes):
+    """[N, 5, 2] corners of the rotated boxes, the first one repeated last."""
+    corners = np.empty((boxes.shape[0], 5, 2), dtype=np.float64)
+    signs = ((-1.0, -1.0), (1.0, -1.0), (1.0, 1.0), (-1.0, 1.0))
+    for n in range(boxes.shape[0]):
+        angle_cos = math.cos(boxes[n, 6])
+        angle_sin = math.sin(boxes[n, 6])
+        for k in range(4):
+            dx = signs[k][0] * boxes[n, 3] / 2
+            dy = signs[k][1] * boxes[n, 4] / 2
+            corners[n, k, 0] = dx * angle_cos - dy * angle_sin + boxes[n, 0]
+            corners[n, k, 1] = dx * angle_sin + dy * angle_cos + boxes[n, 1]
+        corners[n, 4] = corners[n, 0]
+    return corners
+
+
+@numba.njit
+def _standup_boxes(corners):
+    """[N, 4] x1, y1, x2, y2 of the padded axis aligned hulls of the boxes."""
+    standup = np.empty((corners.shape[0], 4), dtype=np.float64)
+    for n in range(corners.shape[0]):
+        standup[n, 0] = corners[n, :4, 0].min() - STANDUP_PAD
+        standup[n, 1] = corners[n, :4, 1].min() - STANDUP_PAD
+        standup[n, 2] = corners[n, :4, 0].max() + STANDUP_PAD
+        standup[n, 3] = corners[n, :4, 1].max() + STANDUP_PAD
+    return standup
+
+
+@numba.njit
+def _in_box(box, px, py):
+    angle_cos = math.cos(-box[6])
+    angle_sin = math.sin(-box[6])
+    rot_x = (px - box[0]) * angle_cos - (py - box[1]) * angle_sin
+    rot_y = (px - box[0]) * angle_sin + (py - box[1]) * angle_cos
+    return abs(rot_x) < box[3] / 2 + MARGIN and abs(rot_y) < box[4] / 2 + MARGIN
+
+
+@numba.njit
+def _intersection(p1, p0, q1, q0, out):
+    """Write the crossing of the segments p0p1 and q0q1 to out, False if none."""
+    if not (
+        min(p0[0], p1[0]) <= max(q0[0], q1[0])
+        and min(q0[0], q1[0]) <= max(p0[0], p1[0])
+        and min(p0[1], p1[1]) <= max(q0[1], q1[1])
+        and min(q0[1], q1[1]) <= max(p0[1], p1[1])
+    ):
+        return False
+    s1 = _cross(q0[0], q0[1], p1[0], p1[1], p0[0], p0[1])
+    s2 = _cross(p1[0], p1[1], q1[0], q1[1], p0[0], p0[1])
+    s3 = _cross(p0[0], p0[1], q1[0], q1[1], q0[0], q0[1])
+    s4 = _cross(q1[0], q1[1], p1[0], p1[1], q0[0], q0[1])
+    if not (s1 * s2 > 0 and s3 * s4 > 0):
+        return False
+    s5 = _cross(q1[0], q1[1], p1[0], p1[1], p0[0], p0[1])
+    if abs(s5 - s1) > EPS:
+        out[0] = (s5 * q0[0] - s1 * q1[0]) / (s5 - s1)
+        out[1] = (s5 * q0[1] - s1 * q1[1]) / (s5 - s1)
+    else:
+        a0 = p0[1] - p1[1]
+        b0 = p1[0] - p0[0]
+        c0 = p0[0] * p1[1] - p1[0] * p0[1]
+        a1 = q0[1] - q1[1]
+        b1 = q1[0] - q0[0]
+        c1 = q0[0] * q1[1] - q1[0] * q0[1]
+        d = a0 * b1 - a1 * b0
+        out[0] = (b0 * c1 - b1 * c0) / d
+        out[1] = (a1 * c0 - a0 * c1) / d
+    return True
+
+
+@numba.njit
+def box_overlap(box_a, box_b, corners_a, corners_b, points):
+    """Intersection area of two rotated boxes, points is a [16, 3] buffer of the
+    x, y and angle of the polygon vertices."""
+    cnt = 0
+    for i in range(4):
+        for j in range(4):
+            if _intersection(
+                corners_a[i + 1],
+                corners_a[i],
+                corners_b[j + 1],
+                corners_b[j],
+                points[cnt],
+            ):
+                cnt += 1
+    for k in range(4):
+        if _in_box(box_a, corners_b[k, 0], corners_b[k, 1]):
+            points[cnt, :2] = corners_b[k]
+            cnt += 1
+        if _in_box(box_b, corners_a[k, 0], corners_a[k, 1]):
+            points[cnt, :2] = corners_a[k]
+            cnt += 1
+    if cnt == 0:
+        return 0.0
+
+    center_x = 0.0
+    center_y = 0.0
+    for k in range(cnt):
+        center_x += points[k, 0]
+        center_y += points[k, 1]
+    center_x /= cnt
+    center_y /= cnt
+    # sort the polygon by angle around its center, the bubble sort of the kernel
+    for k in range(cnt):
+        points[k, 2] = math.atan2(points[k, 1] - center_y, points[k, 0] - center_x)
+    for j in range(cnt - 1):
+        for i in range(cnt - j - 1):
+            if points[i, 2] > points[i + 1, 2]:
+                for c in range(3):
+                    points[i, c], points[i + 1, c] = points[i + 1, c], points[i, c]
+
+    area = 0.0
+    for k in range(cnt - 1):
+        area += _cross(
+            points[k, 0],
+            points[k, 1],
+            points[k + 1, 0],
+            points[k + 1, 1],
+            points[0, 0],
+            points[0, 1],
+        )
+    return abs(area) / 2.0
+
+
+@numba.njit
+def _rotate_nms_set(boxes, num_valid, thresh, max_keep, prune, keep):
+    """Greedy NMS of the first num_valid boxes, kept indices go to keep."""
+    corners = _box_corners(boxes[:num_valid])
+    standup = _standup_boxes(corners)
+    areas = boxes[:num_valid, 3].astype(np.float64) * boxes[:num_valid, 4]
+    removed = areas == 0
+    # a pair without overlap is only suppressed by a threshold <= 0
+    prune = prune and thresh > 0
+    points = np.empty((16, 3), dtype=np.float64)
+    num_out = 0
+    for i in range(num_valid):
+        if removed[i]:
+            continue
+        keep[num_out] = i
+        num_out += 1
+        if num_out == max_keep:
+            break
+        for j in range(i + 1, num_valid):
+            if removed[j]:
+                continue
+            if prune and (
+                standup[j, 0] > standup[i, 2]
+                or standup[j, 2] < standup[i, 0]
+                or standup[j, 1] > standup[i, 3]
+                or standup[j, 3] < standup[i, 1]
+            ):
+                continue
+            s_overlap = box_overlap(boxes[i], boxes[j], corners[i], corners[j], points)
+            if s_overlap / (areas[i] + areas[j] - s_overlap) >= thresh:
+                removed[j] = True
+    return num_out
+
+
+@numba.njit
+def rotate_nms(boxes, thresh, max_keep=-1, prune=True):
+    """Greedy rotated BEV NMS on boxes [N, >=7] sorted by score.
+
+    Returns keep [N] int32, the indices of the kept boxes followed by zeros,
+    and num_out, the number of kept boxes. Pairs whose standup boxes do not
+    touch have no overlap and are skipped with prune, the loop stops once
+    max_keep boxes are kept when max_keep > 0.
+    """
+    keep = np.zeros(boxes.shape[0], dtype=np.int32)
+    num_out = _rotate_nms_set(boxes, boxes.shape[0], thresh, max_keep, prune, keep)
+    return keep, num_out
+
+
+@numba.njit(parallel=True)
+def rotate_nms_batch(boxes, num_valid, thresh, max_keep=-1, prune=True):
+    """rotate_nms of every box set of boxes [num_sets, N, >=7], e.g. the tasks
+    of all samples, in one call and in parallel over the sets.
+
+    Only the first num_valid[s] boxes of set s take part and thresh holds one
+    threshold per set. A box is only compared to the boxes of its own set,
+    which is the same as offsetting every set far away from the others.
+    Returns keep [num_sets, N] int32 and num_out [num_sets] int32.
+    """
+    num_sets = boxes.shape[0]
+    keep = np.zeros((num_sets, boxes.shape[1]), dtype=np.int32)
+    num_out = np.zeros(num_sets, dtype=np.int32)
+    for s in numba.prange(num_sets):
+        num_out[s] = _rotate_nms_set(
+            boxes[s],
+            min(max(num_valid[s], 0), boxes.shape[1]),
+            thresh[s],
+            max_keep,
+            prune,
+            keep[s],
+        )
+    return keep, num_out
@@ -24,6 +24,7 @@ class PointCloudDataset:
         pipeline=None,
         test_mode=False,
         class_names=None,
+        profile=None,
         **kwrags
     ):
         self._info_path = info_path
@@ -37,7 +38,7 @@ class PointCloudDataset:
         if pipeline is None:
             self.pipeline = None
         else:
-            self.pipeline = Compose(pipeline)
+            self.pipeline = Compose(pipeline, profile=profile)
 
     def __getitem__(self, index):
         """This function is used for preprocess.
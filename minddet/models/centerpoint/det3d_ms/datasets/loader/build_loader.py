@@ -1,4 +1,8 @@
+import json
+import os
 import platform
+import threading
+import time
 
 import mindspore.dataset as ds
 import numpy as np
@@ -12,12 +16,219 @@ if platform.system() != "Windows":
     resource.setrlimit(resource.RLIMIT_NOFILE, (4096, rlimit[1]))
 
 
+TRAIN_COLUMNS = [
+    "voxels",
+    "coordinates",
+    "num_points",
+    "num_voxels",
+    "shape",
+    "hm",
+    "anno_box",
+    "ind",
+    "mask",
+    "cat",
+]
+TEST_COLUMNS = ["voxels", "coordinates", "num_points", "num_voxels", "shape", "token"]
+VOXEL_COLUMNS = ["voxels", "coordinates", "num_points", "num_voxels"]
+
+
+def mindrecord_files(mindrecord_dir):
+    """Resolve a directory written by tools_ms/create_mindrecord.py to its shard
+    files, any other path is returned unchanged."""
+    manifest_path = os.path.join(mindrecord_dir, "manifest.json")
+    if not os.path.isdir(mindrecord_dir) or not os.path.exists(manifest_path):
+        return mindrecord_dir
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    missing = [s["file"] for s in manifest["shards"] if not s["complete"]]
+    if missing:
+        raise ValueError(
+            "{} has unfinished shards {}, rerun create_mindrecord.py".format(
+                mindrecord_dir, missing
+            )
+        )
+    return [os.path.join(mindrecord_dir, s["file"]) for s in manifest["shards"]]
+
+
+def to_column(value):
+    """Stack per task lists and widen dtypes MindRecord can not store, uint8
+    arrays such as the token are kept and written to MindRecord as bytes."""
+    value = np.asarray(value)
+    if value.dtype not in (np.float32, np.float64, np.int32, np.int64, np.uint8):
+        value = value.astype(np.float32 if value.dtype.kind == "f" else np.int32)
+    return value
+
+
+def mindrecord_layout(mindrecord_dir):
+    """Voxel layout of a directory written by create_mindrecord.py --compact,
+    None for the padded float32 layout."""
+    manifest_path = os.path.join(str(mindrecord_dir), "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f).get("layout")
+
+
 def collate_kitti(coordinates, batchInfo):
-    coors = []
+    # the batch index goes in front of the coordinates of every sample
+    coors = np.empty(
+        (len(coordinates),)
+        + coordinates[0].shape[:-1]
+        + (coordinates[0].shape[-1] + 1,),
+        dtype=coordinates[0].dtype,
+    )
     for i, coor in enumerate(coordinates):
-        coor_pad = np.pad(coor, ((0, 0), (1, 0)), mode="constant", constant_values=i)
-        coors.append(coor_pad)
-    return (coors,)
+        coors[i, ..., 0] = i
+        coors[i, ..., 1:] = coor
+    return (list(coors),)
+
+
+class StreamingSource(object):
+    """Random access source of ds.GeneratorDataset running the dataset pipeline,
+    and with it the augmentations, in the worker processes.
+
+    Only the filled voxels are returned so that they are all that goes through
+    shared memory, VoxelCollate pads them back to num_voxels. voxel_dtype, e.g.
+    "float16", halves the bytes of the voxels on the way.
+    """
+
+    def __init__(self, dataset, voxel_dtype=None):
+        self.dataset = dataset
+        self.columns = TEST_COLUMNS if dataset.test_mode else TRAIN_COLUMNS
+        self.voxel_dtype = voxel_dtype
+        self._pid = None
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        if self._pid != os.getpid():
+            # forked workers inherit one numpy state, reseed to get a different
+            # augmentation in every worker and epoch
+            self._pid = os.getpid()
+            np.random.seed(None)
+        data = [to_column(value) for value in self.dataset[idx]]
+        # voxels are filled from the front, the padding has no points
+        num_filled = np.count_nonzero(data[2])
+        data[0] = data[0][:num_filled]
+        data[1] = data[1][:num_filled]
+        data[2] = data[2][:num_filled]
+        if self.voxel_dtype is not None:
+            data[0] = data[0].astype(self.voxel_dtype)
+        return tuple(data)
+
+
+class VoxelCollate(object):
+    """per_batch_map of the voxel columns stored at their filled length, by the
+    streaming loader and by create_mindrecord.py --compact.
+
+    The voxels of the batch are decoded (layout gives the voxel_dtype and
+    voxel_shape of raw bytes columns) and written into one preallocated float32
+    array, the coordinates into one array with the batch index in front. A batch
+    is padded to num_voxels, or with voxel_buckets to the smallest bucket that
+    holds its largest sample, every bucket is one more input shape of the graph.
+    The rate batches are produced at is reported every log_interval batches,
+    it is bounded by the training step when the workers keep up.
+    """
+
+    def __init__(self, batch_size, log_interval=50, voxel_buckets=None, layout=None):
+        self.batch_size = batch_size
+        self.log_interval = log_interval
+        self.voxel_buckets = sorted(voxel_buckets) if voxel_buckets else []
+        self.layout = layout
+        self._lock = threading.Lock()
+        self._count = 0
+        self._start = None
+
+    def _tick(self):
+        with self._lock:
+            now = time.time()
+            if self._start is None:
+                self._start = now
+                return
+            self._count += 1
+            if self._count == self.log_interval:
+                steps_per_sec = self._count / (now - self._start)
+                print(
+                    "voxel loader: {:.2f} steps/s, {:.1f} samples/s".format(
+                        steps_per_sec, steps_per_sec * self.batch_size
+                    ),
+                    flush=True,
+                )
+                self._count = 0
+                self._start = now
+
+    def _decode(self, voxels):
+        if self.layout is None or voxels.dtype != np.uint8:
+            return voxels
+        return np.frombuffer(voxels, dtype=self.layout["voxel_dtype"]).reshape(
+            [-1] + self.layout["voxel_shape"]
+        )
+
+    def _padded_size(self, num_filled, num_voxels):
+        for bucket in self.voxel_buckets:
+            if num_filled <= bucket <= num_voxels:
+                return bucket
+        return num_voxels
+
+    def __call__(self, voxels, coordinates, num_points, num_voxels, batchInfo):
+        voxels = [self._decode(v) for v in voxels]
+        batch_size = len(voxels)
+        size = self._padded_size(max(v.shape[0] for v in voxels), int(num_voxels[0][0]))
+        batch_voxels = np.zeros(
+            (batch_size, size) + voxels[0].shape[1:], dtype=np.float32
+        )
+        batch_coors = np.zeros(
+            (batch_size, size, coordinates[0].shape[-1] + 1),
+            dtype=coordinates[0].dtype,
+        )
+        batch_num_points = np.zeros((batch_size, size), dtype=num_points[0].dtype)
+        for i in range(batch_size):
+            num_filled = voxels[i].shape[0]
+            batch_voxels[i, :num_filled] = voxels[i]
+            batch_coors[i, :, 0] = i
+            batch_coors[i, :num_filled, 1:] = coordinates[i]
+            batch_num_points[i, :num_filled] = num_points[i]
+        batch_num_voxels = [
+            np.full_like(n, size) if size != int(n[0]) else n for n in num_voxels
+        ]
+        self._tick()
+        return (
+            list(batch_voxels),
+            list(batch_coors),
+            list(batch_num_points),
+            batch_num_voxels,
+        )
+
+
+def build_streaming_dataloader(
+    dataset, batch_size, num_workers, num_devices=None, rank_id=None, **kwargs
+):
+    """Run the pipeline online instead of reading pre-processed MindRecord."""
+    test_mode = dataset.test_mode
+    source = StreamingSource(dataset, voxel_dtype=kwargs.get("voxel_dtype", None))
+    dataset = ds.GeneratorDataset(
+        source,
+        column_names=source.columns,
+        shuffle=not test_mode,
+        num_parallel_workers=num_workers,
+        python_multiprocessing=True,
+        max_rowsize=kwargs.get("max_rowsize", 32),
+        num_shards=num_devices,
+        shard_id=rank_id,
+    )
+    return dataset.batch(
+        batch_size=batch_size,
+        per_batch_map=VoxelCollate(
+            batch_size,
+            kwargs.get("log_interval", 50),
+            voxel_buckets=kwargs.get("voxel_buckets", None),
+        ),
+        input_columns=VOXEL_COLUMNS,
+        output_columns=VOXEL_COLUMNS,
+        num_parallel_workers=3,
+        drop_remainder=not test_mode,
+    )
 
 
 def build_dataloader(
@@ -31,6 +242,28 @@ def build_dataloader(
     **kwargs
 ):
     num_workers = workers_per_gpu
+    if kwargs.get("streaming", mindrecord_dir is None):
+        print("==========build streaming data loader==========")
+        return build_streaming_dataloader(
+            dataset,
+            batch_size,
+            num_workers,
+            num_devices=num_devices if dist else None,
+            rank_id=rank_id if dist else None,
+            **kwargs
+        )
+    layout = mindrecord_layout(mindrecord_dir)
+    if layout is not None:
+        collate = VoxelCollate(
+            batch_size,
+            kwargs.get("log_interval", 50),
+            voxel_buckets=kwargs.get("voxel_buckets", None),
+            layout=layout,
+        )
+        collate_columns = VOXEL_COLUMNS
+    else:
+        collate, collate_columns = collate_kitti, ["coordinates"]
+    mindrecord_dir = mindrecord_files(mindrecord_dir)
     print("=====" * 50, num_workers, flush=True)
     if dataset.test_mode:
         print("==========build test dataloader==========")
@@ -41,20 +274,14 @@ def build_dataloader(
             num_parallel_workers=8,
             num_shards=num_devices,
             shard_id=rank_id,
-            columns_list=[
-                "voxels",
-                "coordinates",
-                "num_points",
-                "num_voxels",
-                "shape",
-                "token",
-            ],
+            columns_list=TEST_COLUMNS,
         )
 
         data_loader = dataset.batch(
             batch_size=batch_size,
-            per_batch_map=collate_kitti,
-            input_columns=["coordinates"],
+            per_batch_map=collate,
+            input_columns=collate_columns,
+            output_columns=collate_columns,
             num_parallel_workers=num_workers,
             drop_remainder=False,
         )
@@ -74,18 +301,7 @@ def build_dataloader(
                 num_parallel_workers=8,
                 num_shards=num_devices,
                 shard_id=rank_id,
-                columns_list=[
-                    "voxels",
-                    "coordinates",
-                    "num_points",
-                    "num_voxels",
-                    "shape",
-                    "hm",
-                    "anno_box",
-                    "ind",
-                    "mask",
-                    "cat",
-                ],
+                columns_list=TRAIN_COLUMNS,
             )
         else:
             print("==========build train non-distributed data loader==========")
@@ -95,24 +311,14 @@ def build_dataloader(
                 num_parallel_workers=8,
                 num_shards=num_devices,
                 shard_id=rank_id,
-                columns_list=[
-                    "voxels",
-                    "coordinates",
-                    "num_points",
-                    "num_voxels",
-                    "shape",
-                    "hm",
-                    "anno_box",
-                    "ind",
-                    "mask",
-                    "cat",
-                ],
+                columns_list=TRAIN_COLUMNS,
             )
 
         data_loader = dataset.batch(
             batch_size=batch_size,
-            per_batch_map=collate_kitti,
-            input_columns=["coordinates"],
+            per_batch_map=collate,
+            input_columns=collate_columns,
+            output_columns=collate_columns,
             num_parallel_workers=3,
             drop_remainder=True,
         )  # , python_multiprocessing=True)
@@ -22,6 +22,11 @@ from det3d_ms.datasets.nuscenes.nusc_common import (
     general_to_detection,
 )
 from det3d_ms.datasets.registry import DATASETS
+from det3d_ms.datasets.utils.info_store import InfoStore
+from det3d_ms.datasets.utils.voxel_cache import CACHE_COLUMNS, VoxelCache
+
+# test samples carry their token as this many zero padded bytes
+TOKEN_LENGTH = 32
 
 
 @DATASETS.register_module
@@ -42,8 +47,17 @@ class NuScenesDataset(PointCloudDataset):
         **kwargs,
     ):
         self.load_interval = load_interval
+        # decode the infos one sample at a time from an indexed store, see
+        # InfoStore, the index is written next to info_path or to info_index_dir
+        self.lazy_infos = kwargs.get("lazy_infos", False)
+        self.info_index_dir = kwargs.get("info_index_dir", None)
         super(NuScenesDataset, self).__init__(
-            root_path, info_path, pipeline, test_mode=test_mode, class_names=class_names
+            root_path,
+            info_path,
+            pipeline,
+            test_mode=test_mode,
+            class_names=class_names,
+            profile=kwargs.get("profile", None),
         )
 
         self.nsweeps = nsweeps
@@ -67,12 +81,37 @@ class NuScenesDataset(PointCloudDataset):
         self.eval_version = "detection_cvpr_2019"
         self.device = context.get_context("device_target")
 
+        # opt-in cache of the voxelized test samples, e.g. dict(cache_dir=...)
+        voxel_cache = kwargs.get("voxel_cache", None)
+        self.voxel_cache = None
+        if voxel_cache is not None and self.test_mode:
+            if not all(
+                getattr(t, "deterministic", True) for t in self.pipeline.transforms
+            ):
+                raise ValueError(
+                    "voxel_cache needs a deterministic pipeline, "
+                    "set deterministic=True in LoadPointCloudFromFile"
+                )
+            self.voxel_cache = VoxelCache(
+                voxel_cache["cache_dir"],
+                dict(
+                    pipeline=pipeline,
+                    nsweeps=nsweeps,
+                    virtual=self.virtual,
+                    version=version,
+                ),
+            )
+
     def reset(self):
         self.logger.info(f"re-sample {self.frac} frames from full set")
         random.shuffle(self._nusc_infos_all)
         self._nusc_infos = self._nusc_infos_all[: self.frac]
 
     def load_infos(self, info_path):
+        if self.lazy_infos:
+            self._load_info_store(info_path)
+            return
+
         with open(self._info_path, "rb") as f:
             _nusc_infos_all = pickle.load(f)
 
@@ -119,6 +158,29 @@ class NuScenesDataset(PointCloudDataset):
             else:
                 self._nusc_infos = _nusc_infos_all
 
+    def _load_info_store(self, info_path):
+        store = InfoStore(info_path, index_dir=self.info_index_dir)
+        store = store.select(np.arange(0, len(store), self.load_interval))
+
+        if not self.test_mode:  # if training
+            self.frac = int(len(store) * 0.25)
+
+            # same class balanced resampling as load_infos, on presence bitmaps
+            presence = store.presence(self._class_names)
+            cls_counts = presence.sum(axis=0)
+            cls_dist = cls_counts / max(cls_counts.sum(), 1)
+            frac = 1.0 / len(self._class_names)
+            sampled = [
+                np.random.choice(
+                    np.flatnonzero(presence[:, j]),
+                    int(cls_counts[j] * (frac / cls_dist[j])),
+                )
+                for j in range(len(self._class_names))
+            ]
+            store = store.select(np.concatenate(sampled))
+
+        self._nusc_infos = store
+
     def __len__(self):
         if not hasattr(self, "_nusc_infos"):
             self.load_infos(self._info_path)
@@ -185,18 +247,20 @@ class NuScenesDataset(PointCloudDataset):
         return data
 
     def __getitem__(self, idx):
-        data = self.get_sensor_data(idx)
-
         if self.test_mode:
-            return (
-                data["voxels"],
-                data["coordinates"],
-                data["num_points"],
-                data["num_voxels"],
-                data["shape"],
-                [ord(i) for i in data["metadata"]["token"]],
-            )
+            token = self._nusc_infos[idx]["token"]
+            columns = None
+            if self.voxel_cache is not None:
+                columns = self.voxel_cache.get(token)
+            if columns is None:
+                data = self.get_sensor_data(idx)
+                columns = [data[name] for name in CACHE_COLUMNS]
+                if self.voxel_cache is not None:
+                    self.voxel_cache.put(token, columns)
+            token = np.frombuffer(token.encode().ljust(TOKEN_LENGTH, b"\0"), np.uint8)
+            return tuple(columns) + (token,)
         else:
+            data = self.get_sensor_data(idx)
             return (
                 data["voxels"],
                 data["coordinates"],
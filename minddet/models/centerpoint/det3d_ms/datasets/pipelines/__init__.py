@@ -2,6 +2,7 @@ from .compose import Compose
 from .formating import Reformat
 from .loading import LoadPointCloudAnnotations, LoadPointCloudFromFile
 from .preprocess import Preprocess, Voxelization
+from .profiler import PipelineProfiler
 from .test_aug import DoubleFlip
 
 __all__ = [
@@ -12,4 +13,5 @@ __all__ = [
     "Preprocess",
     "Voxelization",
     "DoubleFlip",
+    "PipelineProfiler",
 ]
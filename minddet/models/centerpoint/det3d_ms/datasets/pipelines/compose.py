@@ -3,11 +3,12 @@ import collections
 from det3d_ms.utils import build_from_cfg
 
 from ..registry import PIPELINES
+from .profiler import PipelineProfiler
 
 
 @PIPELINES.register_module
 class Compose(object):
-    def __init__(self, transforms):
+    def __init__(self, transforms, profile=None):
         assert isinstance(transforms, collections.abc.Sequence)
         self.transforms = []
         for transform in transforms:
@@ -20,14 +21,28 @@ class Compose(object):
                 self.transforms.append(transform)
             else:
                 raise TypeError("transform must be callable or a dict")
+        # opt-in per stage timing, see profiler.py
+        self.profiler = PipelineProfiler(**profile) if profile else None
 
     def __call__(self, res, info):
+        if self.profiler is not None:
+            return self._profiled_call(res, info)
         for t in self.transforms:
             res, info = t(res, info)
             if res is None:
                 return None
         return res, info
 
+    def _profiled_call(self, res, info):
+        self.profiler.start()
+        for t in self.transforms:
+            res, info = t(res, info)
+            self.profiler.record(getattr(t, "__name__", type(t).__name__), res)
+            if res is None:
+                break
+        self.profiler.end_sample()
+        return None if res is None else (res, info)
+
     def __repr__(self):
         format_string = self.__class__.__name__ + "("
         for t in self.transforms:
@@ -42,7 +42,7 @@ class Reformat(object):
 
             if self.double_flip:
                 # y axis
-                yflip_points = res["lidar"]["yflip_points"]
+                yflip_points = res["lidar"].get("yflip_points", None)
                 yflip_voxels = res["lidar"]["yflip_voxels"]
                 yflip_data_bundle = dict(
                     metadata=meta,
@@ -55,7 +55,7 @@ class Reformat(object):
                 )
 
                 # x axis
-                xflip_points = res["lidar"]["xflip_points"]
+                xflip_points = res["lidar"].get("xflip_points", None)
                 xflip_voxels = res["lidar"]["xflip_voxels"]
                 xflip_data_bundle = dict(
                     metadata=meta,
@@ -67,7 +67,7 @@ class Reformat(object):
                     coordinates=xflip_voxels["coordinates"],
                 )
                 # double axis flip
-                double_flip_points = res["lidar"]["double_flip_points"]
+                double_flip_points = res["lidar"].get("double_flip_points", None)
                 double_flip_voxels = res["lidar"]["double_flip_voxels"]
                 double_flip_data_bundle = dict(
                     metadata=meta,
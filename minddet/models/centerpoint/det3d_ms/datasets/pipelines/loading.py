@@ -1,8 +1,17 @@
+import hashlib
 import os
 import pickle
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
 from pathlib import Path
 
 import numpy as np
+from det3d_ms.ops.point_cloud.point_cloud_ops import (
+    count_not_close_jit,
+    transform_sweep,
+)
 
 from ..registry import PIPELINES
 
@@ -53,6 +62,12 @@ def read_file(path, tries=2, num_point_feature=4, virtual=False):
     return points
 
 
+def read_file_mmap(path, num_point_feature=4):
+    """Memory-map a nuScenes ``.bin`` file as a read-only (N, num_point_feature) view."""
+    points = np.memmap(path, dtype=np.float32, mode="r")
+    return points.reshape(-1, 5)[:, :num_point_feature]
+
+
 def remove_close(points, radius: float) -> None:
     """
     Removes point too close within a certain radius from origin.
@@ -65,19 +80,171 @@ def remove_close(points, radius: float) -> None:
     return points
 
 
-def read_sweep(sweep, virtual=False):
+def _remove_shm_dir(path, pid):
+    if os.getpid() == pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class SweepCache(object):
+    """Byte-budgeted LRU cache of close-filtered sweep points in sensor frame.
+
+    Consecutive nuScenes keyframes share most of their sweeps, so the decoded and
+    close-filtered points are kept keyed by ``lidar_path`` and only the per-sample
+    transform is applied on a hit. With ``shm_dir`` (e.g. a directory under
+    ``/dev/shm``) every decoded sweep is also published there as a ``.npy`` file
+    that all worker processes memory-map, so a sweep is decoded once per host.
+    The byte budget applies per process; files a process published are removed
+    when it evicts them, so a run uses up to ``max_bytes`` times the number of
+    worker processes of ``shm_dir``. The files go to a subdirectory of
+    ``shm_dir`` made for the cache, which the process that built the cache
+    removes when the cache is freed or the process exits.
+    """
+
+    def __init__(self, max_bytes=1 << 30, shm_dir=None, num_point_feature=4):
+        self.max_bytes = max_bytes
+        self.shm_dir = shm_dir
+        self.num_point_feature = num_point_feature
+        self.min_distance = 1.0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._published = set()
+        self._nbytes = 0
+
+        if shm_dir is not None:
+            os.makedirs(shm_dir, exist_ok=True)
+            # workers are forked from, or unpickle, the builder and share the
+            # subdirectory, only the builder removes it
+            self.shm_dir = tempfile.mkdtemp(prefix="sweeps_", dir=shm_dir)
+            weakref.finalize(self, _remove_shm_dir, self.shm_dir, os.getpid())
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, lidar_path):
+        lidar_path = str(lidar_path)
+        points = self._entries.get(lidar_path)
+        if points is not None:
+            self._entries.move_to_end(lidar_path)
+            self.hits += 1
+            return points
+
+        points = self._load_shared(lidar_path)
+        if points is None:
+            self.misses += 1
+            points = read_file_mmap(lidar_path, self.num_point_feature)
+            points = points[
+                ~(
+                    (np.abs(points[:, 0]) < self.min_distance)
+                    & (np.abs(points[:, 1]) < self.min_distance)
+                )
+            ]
+            points = self._publish(lidar_path, points)
+        else:
+            self.hits += 1
+
+        self._insert(lidar_path, points)
+        return points
+
+    def _shared_path(self, lidar_path):
+        name = hashlib.md5(lidar_path.encode()).hexdigest()
+        return os.path.join(self.shm_dir, name + ".npy")
+
+    def _load_shared(self, lidar_path):
+        if self.shm_dir is None:
+            return None
+        try:
+            return np.load(self._shared_path(lidar_path), mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _publish(self, lidar_path, points):
+        if self.shm_dir is None or points.nbytes > self.max_bytes:
+            return points
+        path = self._shared_path(lidar_path)
+        tmp_path = "{}.{}.tmp".format(path[:-4], os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.save(f, points)
+        # atomic, readers never see a partially written file
+        os.replace(tmp_path, path)
+        self._published.add(lidar_path)
+        return np.load(path, mmap_mode="r")
+
+    def _insert(self, lidar_path, points):
+        if points.nbytes > self.max_bytes:
+            return
+        self._entries[lidar_path] = points
+        self._nbytes += points.nbytes
+        while self._nbytes > self.max_bytes:
+            old_path, old_points = self._entries.popitem(last=False)
+            self._nbytes -= old_points.nbytes
+            if old_path in self._published:
+                self._published.remove(old_path)
+                try:
+                    os.remove(self._shared_path(old_path))
+                except FileNotFoundError:
+                    pass
+
+
+def read_sweep(sweep, virtual=False, cache=None):
     min_distance = 1.0
-    points_sweep = read_file(str(sweep["lidar_path"]), virtual=virtual).T
-    points_sweep = remove_close(points_sweep, min_distance)
+    if cache is not None and not virtual:
+        # cached points are already close-filtered
+        points_sweep = cache.get(sweep["lidar_path"])
+        min_distance = 0.0
+    else:
+        points_sweep = read_file(str(sweep["lidar_path"]), virtual=virtual)
+    points_sweep = transform_sweep(
+        points_sweep, sweep["transform_matrix"], sweep["time_lag"], min_distance
+    )
 
-    nbr_points = points_sweep.shape[1]
-    if sweep["transform_matrix"] is not None:
-        points_sweep[:3, :] = sweep["transform_matrix"].dot(
-            np.vstack((points_sweep[:3, :], np.ones(nbr_points)))
-        )[:3, :]
-    curr_times = sweep["time_lag"] * np.ones((1, points_sweep.shape[1]))
+    return points_sweep[:, :-1], points_sweep[:, -1:]
 
-    return points_sweep.T, curr_times.T
+
+def read_sweeps_into_buffer(
+    lidar_path, sweeps, num_point_feature=4, min_distance=1.0, cache=None
+):
+    """Aggregate a key frame and its sweeps into one (N, num_point_feature + 1) buffer.
+
+    Every ``.bin`` is memory-mapped and the close-point filter, the sweep transform
+    and the time lag column are written straight into a single preallocated
+    float32 array, so a sample costs one copy of the cloud instead of one per step.
+    With a ``SweepCache`` the sweeps come already close-filtered from the cache.
+    """
+    key_points = read_file_mmap(lidar_path, num_point_feature)
+    if cache is not None:
+        sweep_points = [cache.get(sweep["lidar_path"]) for sweep in sweeps]
+        num_sweep_points = [p.shape[0] for p in sweep_points]
+        min_distance = 0.0
+    else:
+        sweep_points = [
+            read_file_mmap(str(sweep["lidar_path"]), num_point_feature)
+            for sweep in sweeps
+        ]
+        num_sweep_points = [count_not_close_jit(p, min_distance) for p in sweep_points]
+    num_total = key_points.shape[0] + sum(num_sweep_points)
+
+    combined = np.empty((num_total, num_point_feature + 1), dtype=np.float32)
+    start = key_points.shape[0]
+    combined[:start, :num_point_feature] = key_points
+    combined[:start, num_point_feature] = 0
+
+    for sweep, points, num_points in zip(sweeps, sweep_points, num_sweep_points):
+        end = start + num_points
+        transform_sweep(
+            points,
+            sweep["transform_matrix"],
+            sweep["time_lag"],
+            min_distance,
+            out=combined[start:end],
+        )
+        start = end
+
+    return combined
 
 
 def read_single_waymo(obj):
@@ -100,18 +267,12 @@ def read_single_waymo_sweep(sweep):
 
     # normalize intensity
     points_feature[:, 0] = np.tanh(points_feature[:, 0])
-    points_sweep = np.concatenate([points_xyz, points_feature], axis=-1).T  # 5 x N
-
-    nbr_points = points_sweep.shape[1]
+    points_sweep = np.concatenate([points_xyz, points_feature], axis=-1)
+    points_sweep = transform_sweep(
+        points_sweep, sweep["transform_matrix"], sweep["time_lag"]
+    )
 
-    if sweep["transform_matrix"] is not None:
-        points_sweep[:3, :] = sweep["transform_matrix"].dot(
-            np.vstack((points_sweep[:3, :], np.ones(nbr_points)))
-        )[:3, :]
-
-    curr_times = sweep["time_lag"] * np.ones((1, points_sweep.shape[1]))
-
-    return points_sweep.T, curr_times.T
+    return points_sweep[:, :-1], points_sweep[:, -1:]
 
 
 def get_obj(path):
@@ -126,6 +287,16 @@ class LoadPointCloudFromFile(object):
         self.type = dataset
         self.random_select = kwargs.get("random_select", False)
         self.npoints = kwargs.get("npoints", 16834)
+        # sweeps in info order instead of a random permutation in val mode
+        self.deterministic = kwargs.get("deterministic", False)
+        # memory-map the sweep files and aggregate them into a single buffer
+        self.use_mmap = kwargs.get("use_mmap", False)
+        # opt-in LRU cache of decoded sweeps, e.g. dict(max_bytes=2 << 30),
+        # with shm_dir it takes up to max_bytes of it per worker
+        sweep_cache = kwargs.get("sweep_cache", None)
+        self.sweep_cache = (
+            SweepCache(**sweep_cache) if sweep_cache is not None else None
+        )
 
     def __call__(self, res, info):
         res["type"] = self.type
@@ -134,10 +305,6 @@ class LoadPointCloudFromFile(object):
             nsweeps = res["lidar"]["nsweeps"]
 
             lidar_path = Path(info["lidar_path"])
-            points = read_file(str(lidar_path), virtual=res["virtual"])
-
-            sweep_points_list = [points]
-            sweep_times_list = [np.zeros((points.shape[0], 1))]
 
             assert (nsweeps - 1) == len(
                 info["sweeps"]
@@ -145,18 +312,44 @@ class LoadPointCloudFromFile(object):
                 nsweeps, len(info["sweeps"])
             )
 
-            for i in np.random.choice(len(info["sweeps"]), nsweeps - 1, replace=False):
-                sweep = info["sweeps"][i]
-                points_sweep, times_sweep = read_sweep(sweep, virtual=res["virtual"])
-                sweep_points_list.append(points_sweep)
-                sweep_times_list.append(times_sweep)
+            if self.deterministic and res["mode"] == "val":
+                sweeps = list(info["sweeps"])
+            else:
+                sweeps = [
+                    info["sweeps"][i]
+                    for i in np.random.choice(
+                        len(info["sweeps"]), nsweeps - 1, replace=False
+                    )
+                ]
+
+            if self.use_mmap and not res["virtual"]:
+                combined = read_sweeps_into_buffer(
+                    str(lidar_path), sweeps, cache=self.sweep_cache
+                )
 
-            points = np.concatenate(sweep_points_list, axis=0)
-            times = np.concatenate(sweep_times_list, axis=0).astype(points.dtype)
+                # points and times are views into combined
+                res["lidar"]["points"] = combined[:, :-1]
+                res["lidar"]["times"] = combined[:, -1:]
+                res["lidar"]["combined"] = combined
+            else:
+                points = read_file(str(lidar_path), virtual=res["virtual"])
 
-            res["lidar"]["points"] = points
-            res["lidar"]["times"] = times
-            res["lidar"]["combined"] = np.hstack([points, times])
+                sweep_points_list = [points]
+                sweep_times_list = [np.zeros((points.shape[0], 1))]
+
+                for sweep in sweeps:
+                    points_sweep, times_sweep = read_sweep(
+                        sweep, virtual=res["virtual"], cache=self.sweep_cache
+                    )
+                    sweep_points_list.append(points_sweep)
+                    sweep_times_list.append(times_sweep)
+
+                points = np.concatenate(sweep_points_list, axis=0)
+                times = np.concatenate(sweep_times_list, axis=0).astype(points.dtype)
+
+                res["lidar"]["points"] = points
+                res["lidar"]["times"] = times
+                res["lidar"]["combined"] = np.hstack([points, times])
 
         elif self.type == "WaymoDataset":
             path = info["path"]
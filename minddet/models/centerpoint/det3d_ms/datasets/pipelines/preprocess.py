@@ -3,7 +3,10 @@ from det3d_ms.builder import build_dbsampler
 from det3d_ms.core.bbox import box_np_ops
 from det3d_ms.core.input.voxel_generator import VoxelGenerator
 from det3d_ms.core.sampler import preprocess as prep
-from det3d_ms.core.utils.center_utils import draw_umich_gaussian, gaussian_radius
+from det3d_ms.core.utils.center_utils import (
+    draw_umich_gaussian_batch,
+    gaussian_radius,
+)
 
 from ..registry import PIPELINES
 
@@ -33,6 +36,7 @@ class Preprocess(object):
             self.global_rotation_noise = cfg.global_rot_noise
             self.global_scaling_noise = cfg.global_scale_noise
             self.global_translate_std = cfg.get("global_translate_std", 0)
+            self.fused_global_aug = cfg.get("fused_global_aug", False)
             self.class_names = cfg.class_names
             if cfg.db_sampler is not None:
                 self.db_sampler = build_dbsampler(cfg.db_sampler)
@@ -119,21 +123,33 @@ class Preprocess(object):
             )
             gt_dict["gt_classes"] = gt_classes
 
-            gt_dict["gt_boxes"], points = prep.random_flip_both(
-                gt_dict["gt_boxes"], points
-            )
+            if self.fused_global_aug:
+                # same parameters as below for a given seed, in one pass
+                gt_dict["gt_boxes"], points = prep.global_transform_(
+                    gt_dict["gt_boxes"],
+                    points,
+                    *prep.sample_global_transform(
+                        self.global_rotation_noise,
+                        *self.global_scaling_noise,
+                        noise_translate_std=self.global_translate_std,
+                    ),
+                )
+            else:
+                gt_dict["gt_boxes"], points = prep.random_flip_both(
+                    gt_dict["gt_boxes"], points
+                )
 
-            gt_dict["gt_boxes"], points = prep.global_rotation(
-                gt_dict["gt_boxes"], points, rotation=self.global_rotation_noise
-            )
-            gt_dict["gt_boxes"], points = prep.global_scaling_v2(
-                gt_dict["gt_boxes"], points, *self.global_scaling_noise
-            )
-            gt_dict["gt_boxes"], points = prep.global_translate_(
-                gt_dict["gt_boxes"],
-                points,
-                noise_translate_std=self.global_translate_std,
-            )
+                gt_dict["gt_boxes"], points = prep.global_rotation(
+                    gt_dict["gt_boxes"], points, rotation=self.global_rotation_noise
+                )
+                gt_dict["gt_boxes"], points = prep.global_scaling_v2(
+                    gt_dict["gt_boxes"], points, *self.global_scaling_noise
+                )
+                gt_dict["gt_boxes"], points = prep.global_translate_(
+                    gt_dict["gt_boxes"],
+                    points,
+                    noise_translate_std=self.global_translate_std,
+                )
         elif self.no_augmentation:
             gt_boxes_mask = np.array(
                 [n in self.class_names for n in gt_dict["gt_names"]], dtype=np.bool_
@@ -157,6 +173,44 @@ class Preprocess(object):
         return res, info
 
 
+def flip_points_copy(points, flip_x, flip_y):
+    points = points.copy()
+    if flip_x:
+        points[:, 0] = -points[:, 0]
+    if flip_y:
+        points[:, 1] = -points[:, 1]
+    return points
+
+
+def is_flip_symmetric(pc_range, flip_x, flip_y):
+    """Whether flipping the cloud maps the voxel grid onto itself."""
+    return (not flip_x or np.isclose(pc_range[0], -pc_range[3])) and (
+        not flip_y or np.isclose(pc_range[1], -pc_range[4])
+    )
+
+
+def mirror_voxels(voxels, coordinates, num_points, grid_size, flip_x, flip_y):
+    """Voxels of the flipped cloud, derived from the voxels of the original one.
+
+    On a symmetric range a flip only mirrors the zyx voxel coordinates, voxel
+    order and the points kept per voxel are unchanged, so the flipped voxels
+    are the original ones with mirrored coordinates and negated point x / y.
+    Points exactly on a voxel boundary may fall into the neighbouring voxel
+    compared with voxelizing the flipped cloud.
+    """
+    # filled voxels come first, the rest is zero padding
+    num_filled = np.count_nonzero(num_points)
+    voxels = voxels.copy()
+    coordinates = coordinates.copy()
+    if flip_x:
+        voxels[:num_filled, :, 0] *= -1
+        coordinates[:num_filled, 2] = grid_size[0] - 1 - coordinates[:num_filled, 2]
+    if flip_y:
+        voxels[:num_filled, :, 1] *= -1
+        coordinates[:num_filled, 1] = grid_size[1] - 1 - coordinates[:num_filled, 1]
+    return voxels, coordinates, num_points.copy()
+
+
 @PIPELINES.register_module
 class Voxelization(object):
     def __init__(self, **kwargs):
@@ -171,12 +225,19 @@ class Voxelization(object):
         )
 
         self.double_flip = cfg.get("double_flip", False)
+        # "dense" or "sort", see VoxelGenerator
+        self.engine = cfg.get("engine", "dense")
+        self.workspace = cfg.get("workspace", False)
+        # derive the flipped voxels of double_flip by mirroring voxel coordinates
+        self.mirror_flip = cfg.get("mirror_flip", False)
 
         self.voxel_generator = VoxelGenerator(
             voxel_size=self.voxel_size,
             point_cloud_range=self.range,
             max_num_points=self.max_points_in_voxel,
             max_voxels=self.max_voxel_num[0],
+            engine=self.engine,
+            workspace=self.workspace,
         )
 
     def __call__(self, res, info):
@@ -195,8 +256,14 @@ class Voxelization(object):
         else:
             max_voxels = self.max_voxel_num[1]
 
+        double_flip = self.double_flip and (res["mode"] != "train")
+
+        # with a workspace the results are views that stay valid until the next
+        # sample, voxelizing the flipped clouds would overwrite them.
         voxels, coordinates, num_points = self.voxel_generator.generate(
-            res["lidar"]["points"], max_voxels=max_voxels
+            res["lidar"]["points"],
+            max_voxels=max_voxels,
+            copy=double_flip and not self.mirror_flip,
         )
         num_voxels = np.array([voxels.shape[0]], dtype=np.int64)
 
@@ -210,59 +277,40 @@ class Voxelization(object):
             size=voxel_size,
         )
 
-        double_flip = self.double_flip and (res["mode"] != "train")
-
         if double_flip:
-            (
-                flip_voxels,
-                flip_coordinates,
-                flip_num_points,
-            ) = self.voxel_generator.generate(res["lidar"]["yflip_points"])
-            flip_num_voxels = np.array([flip_voxels.shape[0]], dtype=np.int64)
-
-            res["lidar"]["yflip_voxels"] = dict(
-                voxels=flip_voxels,
-                coordinates=flip_coordinates,
-                num_points=flip_num_points,
-                num_voxels=flip_num_voxels,
-                shape=grid_size,
-                range=pc_range,
-                size=voxel_size,
-            )
-
-            (
-                flip_voxels,
-                flip_coordinates,
-                flip_num_points,
-            ) = self.voxel_generator.generate(res["lidar"]["xflip_points"])
-            flip_num_voxels = np.array([flip_voxels.shape[0]], dtype=np.int64)
-
-            res["lidar"]["xflip_voxels"] = dict(
-                voxels=flip_voxels,
-                coordinates=flip_coordinates,
-                num_points=flip_num_points,
-                num_voxels=flip_num_voxels,
-                shape=grid_size,
-                range=pc_range,
-                size=voxel_size,
-            )
-
-            (
-                flip_voxels,
-                flip_coordinates,
-                flip_num_points,
-            ) = self.voxel_generator.generate(res["lidar"]["double_flip_points"])
-            flip_num_voxels = np.array([flip_voxels.shape[0]], dtype=np.int64)
-
-            res["lidar"]["double_flip_voxels"] = dict(
-                voxels=flip_voxels,
-                coordinates=flip_coordinates,
-                num_points=flip_num_points,
-                num_voxels=flip_num_voxels,
-                shape=grid_size,
-                range=pc_range,
-                size=voxel_size,
-            )
+            for name, flip_x, flip_y in [
+                ("yflip", False, True),
+                ("xflip", True, False),
+                ("double_flip", True, True),
+            ]:
+                if self.mirror_flip and is_flip_symmetric(pc_range, flip_x, flip_y):
+                    flip_voxels, flip_coordinates, flip_num_points = mirror_voxels(
+                        voxels, coordinates, num_points, grid_size, flip_x, flip_y
+                    )
+                else:
+                    flip_points = res["lidar"].get(name + "_points", None)
+                    if flip_points is None:
+                        flip_points = flip_points_copy(
+                            res["lidar"]["points"], flip_x, flip_y
+                        )
+                    (
+                        flip_voxels,
+                        flip_coordinates,
+                        flip_num_points,
+                    ) = self.voxel_generator.generate(
+                        flip_points, max_voxels=max_voxels, copy=True
+                    )
+                flip_num_voxels = np.array([flip_voxels.shape[0]], dtype=np.int64)
+
+                res["lidar"][name + "_voxels"] = dict(
+                    voxels=flip_voxels,
+                    coordinates=flip_coordinates,
+                    num_points=flip_num_points,
+                    num_voxels=flip_num_voxels,
+                    shape=grid_size,
+                    range=pc_range,
+                    size=voxel_size,
+                )
 
         return res, info
 
@@ -319,37 +367,25 @@ class AssignLabel(object):
 
             gt_dict = res["lidar"]["annotations"]
 
-            # reorganize the gt_dict by tasks
-            task_masks = []
+            # reorganize the gt_dict by tasks, boxes of a task are grouped by
+            # class and keep their order within a class
+            task_boxes = []
+            task_classes = []
+            task_names = []
             flag = 0
             for class_name in class_names_by_task:
-                task_masks.append(
-                    [
-                        np.where(
-                            gt_dict["gt_classes"] == class_name.index(i) + 1 + flag
-                        )
-                        for i in class_name
-                    ]
+                in_task = np.flatnonzero(
+                    (gt_dict["gt_classes"] > flag)
+                    & (gt_dict["gt_classes"] <= flag + len(class_name))
                 )
+                in_task = in_task[
+                    np.argsort(gt_dict["gt_classes"][in_task], kind="stable")
+                ]
+                task_boxes.append(gt_dict["gt_boxes"][in_task])
+                task_classes.append(gt_dict["gt_classes"][in_task] - flag)
+                task_names.append(gt_dict["gt_names"][in_task])
                 flag += len(class_name)
 
-            task_boxes = []
-            task_classes = []
-            task_names = []
-            flag2 = 0
-            for idx, mask in enumerate(task_masks):
-                task_box = []
-                task_class = []
-                task_name = []
-                for m in mask:
-                    task_box.append(gt_dict["gt_boxes"][m])
-                    task_class.append(gt_dict["gt_classes"][m] - flag2)
-                    task_name.append(gt_dict["gt_names"][m])
-                task_boxes.append(np.concatenate(task_box, axis=0))
-                task_classes.append(np.concatenate(task_class))
-                task_names.append(np.concatenate(task_name))
-                flag2 += len(mask)
-
             for task_box in task_boxes:
                 # limit rad to [-pi, pi]
                 task_box[:, -1] = box_np_ops.limit_period(
@@ -363,7 +399,12 @@ class AssignLabel(object):
 
             res["lidar"]["annotations"] = gt_dict
 
-            draw_gaussian = draw_umich_gaussian
+            if res["type"] == "NuScenesDataset":
+                rot_index = 8
+            elif res["type"] == "WaymoDataset":
+                rot_index = -1
+            else:
+                raise NotImplementedError("Only Support nuScene for Now!")
 
             hms, anno_boxs, inds, masks, cats = [], [], [], [], []
             max_class = max(
@@ -374,105 +415,58 @@ class AssignLabel(object):
                     (max_class, feature_map_size[1], feature_map_size[0]),
                     dtype=np.float32,
                 )
-
-                if res["type"] == "NuScenesDataset":
-                    # [reg, hei, dim, vx, vy, rots, rotc]
-                    anno_box = np.zeros((max_objs, 10), dtype=np.float32)
-                elif res["type"] == "WaymoDataset":
-                    anno_box = np.zeros((max_objs, 10), dtype=np.float32)
-                else:
-                    raise NotImplementedError("Only Support nuScene for Now!")
-
+                # [reg, hei, dim, vx, vy, rots, rotc]
+                anno_box = np.zeros((max_objs, 10), dtype=np.float32)
                 ind = np.zeros((max_objs), dtype=np.int64)
                 mask = np.zeros((max_objs), dtype=np.uint8)
                 cat = np.zeros((max_objs), dtype=np.int64)
 
-                num_objs = min(gt_dict["gt_boxes"][idx].shape[0], max_objs)
-
-                for k in range(num_objs):
-                    cls_id = gt_dict["gt_classes"][idx][k] - 1
+                boxes = gt_dict["gt_boxes"][idx][:max_objs]
+                cls_ids = gt_dict["gt_classes"][idx][:max_objs] - 1
 
-                    width, length, _ = (
-                        gt_dict["gt_boxes"][idx][k][3],
-                        gt_dict["gt_boxes"][idx][k][4],
-                        gt_dict["gt_boxes"][idx][k][5],
-                    )
-                    width, length = (
-                        width / voxel_size[0] / self.out_size_factor,
-                        length / voxel_size[1] / self.out_size_factor,
-                    )
-                    if width > 0 and length > 0:
-                        radius = gaussian_radius(
-                            (length, width), min_overlap=self.gaussian_overlap
-                        )
-                        radius = max(self._min_radius, int(radius))
+                width = boxes[:, 3] / voxel_size[0] / self.out_size_factor
+                length = boxes[:, 4] / voxel_size[1] / self.out_size_factor
+                radius = gaussian_radius(
+                    (length, width), min_overlap=self.gaussian_overlap
+                )
+                radius = np.maximum(self._min_radius, radius.astype(np.int64))
 
-                        # be really careful for the coordinate system of your box annotation.
-                        x, y, z = (
-                            gt_dict["gt_boxes"][idx][k][0],
-                            gt_dict["gt_boxes"][idx][k][1],
-                            gt_dict["gt_boxes"][idx][k][2],
-                        )
+                # be really careful for the coordinate system of your box annotation.
+                ct = np.stack(
+                    [
+                        (boxes[:, 0] - pc_range[0])
+                        / voxel_size[0]
+                        / self.out_size_factor,
+                        (boxes[:, 1] - pc_range[1])
+                        / voxel_size[1]
+                        / self.out_size_factor,
+                    ],
+                    axis=1,
+                ).astype(np.float32)
+                ct_int = ct.astype(np.int32)
+
+                # throw out not in range objects to avoid out of array area when creating the heatmap
+                keep = np.flatnonzero(
+                    (width > 0)
+                    & (length > 0)
+                    & (ct_int[:, 0] >= 0)
+                    & (ct_int[:, 0] < feature_map_size[0])
+                    & (ct_int[:, 1] >= 0)
+                    & (ct_int[:, 1] < feature_map_size[1])
+                )
 
-                        coor_x, coor_y = (x - pc_range[0]) / voxel_size[
-                            0
-                        ] / self.out_size_factor, (y - pc_range[1]) / voxel_size[
-                            1
-                        ] / self.out_size_factor
-
-                        ct = np.array([coor_x, coor_y], dtype=np.float32)
-                        ct_int = ct.astype(np.int32)
-
-                        # throw out not in range objects to avoid out of array area when creating the heatmap
-                        if not (
-                            0 <= ct_int[0] < feature_map_size[0]
-                            and 0 <= ct_int[1] < feature_map_size[1]
-                        ):
-                            continue
-
-                        draw_gaussian(hm[cls_id], ct, radius)
-
-                        new_idx = k
-                        x, y = ct_int[0], ct_int[1]
-
-                        cat[new_idx] = cls_id
-                        ind[new_idx] = y * feature_map_size[0] + x
-                        mask[new_idx] = 1
-
-                        if res["type"] == "NuScenesDataset":
-                            vx, vy = gt_dict["gt_boxes"][idx][k][6:8]
-                            rot = gt_dict["gt_boxes"][idx][k][8]
-                            anno_box[new_idx] = np.concatenate(
-                                (
-                                    ct - (x, y),
-                                    z,
-                                    np.log(gt_dict["gt_boxes"][idx][k][3:6]),
-                                    np.array(vx),
-                                    np.array(vy),
-                                    np.sin(rot),
-                                    np.cos(rot),
-                                ),
-                                axis=None,
-                            )
-                        elif res["type"] == "WaymoDataset":
-                            vx, vy = gt_dict["gt_boxes"][idx][k][6:8]
-                            rot = gt_dict["gt_boxes"][idx][k][-1]
-                            anno_box[new_idx] = np.concatenate(
-                                (
-                                    ct - (x, y),
-                                    z,
-                                    np.log(gt_dict["gt_boxes"][idx][k][3:6]),
-                                    np.array(vx),
-                                    np.array(vy),
-                                    np.sin(rot),
-                                    np.cos(rot),
-                                ),
-                                axis=None,
-                            )
-                        else:
-                            raise NotImplementedError(
-                                "Only Support Waymo and nuScene for Now"
-                            )
+                draw_umich_gaussian_batch(hm, cls_ids[keep], ct[keep], radius[keep])
+
+                boxes = boxes[keep]
+                cat[keep] = cls_ids[keep]
+                ind[keep] = ct_int[keep, 1] * feature_map_size[0] + ct_int[keep, 0]
+                mask[keep] = 1
+                anno_box[keep, 0:2] = ct[keep] - ct_int[keep]
+                anno_box[keep, 2] = boxes[:, 2]
+                anno_box[keep, 3:6] = np.log(boxes[:, 3:6])
+                anno_box[keep, 6:8] = boxes[:, 6:8]
+                anno_box[keep, 8] = np.sin(boxes[:, rot_index])
+                anno_box[keep, 9] = np.cos(boxes[:, rot_index])
 
                 hms.append(hm)
                 anno_boxs.append(anno_box)
@@ -0,0 +1,259 @@
+"""Per stage latency of the pipeline Compose, enabled with the profile option of
+the dataset config, e.g. profile=dict(out_dir="work_dirs/pipeline_profile").
+
+Every worker process keeps, per transform, the count, mean and a fixed size
+uniform sample (reservoir) of the wall time, the bytes allocated (with
+trace_memory=True) and the point, voxel and box counts, and writes their
+percentiles to pipeline_profile_<pid>.json in out_dir every dump_interval
+samples and on SIGUSR1. PipelineProfileMonitor prints these files with
+load_profiles / format_table at the end of an epoch and then calls
+reset_profiles, which starts a new epoch for all workers.
+"""
+import glob
+import json
+import os
+import random
+import signal
+import time
+import tracemalloc
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+QUANTITIES = ("ms", "bytes", "points", "voxels", "boxes")
+EPOCH_FILE = "pipeline_profile_epoch"
+
+
+def _num_rows(value):
+    return int(value.shape[0]) if hasattr(value, "shape") and value.ndim else -1
+
+
+def sample_counts(res):
+    """Points, filled voxels and gt boxes of res, -1 where not available yet."""
+    lidar = res.get("lidar", res)
+    points = _num_rows(lidar.get("points"))
+    voxels = lidar.get("voxels")
+    num_points = voxels.get("num_points") if isinstance(voxels, dict) else None
+    if num_points is None:
+        num_points = lidar.get("num_points")
+    voxels = -1 if num_points is None else int(np.count_nonzero(num_points))
+    annos = lidar.get("annotations")
+    boxes = -1
+    if isinstance(annos, dict):
+        # the loader stores "boxes", Preprocess renames them to "gt_boxes"
+        gt_boxes = annos.get("gt_boxes", annos.get("boxes"))
+        boxes = _num_rows(gt_boxes)
+    return dict(points=points, voxels=voxels, boxes=boxes)
+
+
+class Reservoir(object):
+    """Count, mean and a uniform sample of at most size of the added values."""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.count = 0
+        self.total = 0.0
+        self.values = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            # reservoir sampling, every value is kept with probability size / count
+            i = self.rng.randrange(self.count)
+            if i < self.size:
+                self.values[i] = value
+
+    def summary(self):
+        return dict(
+            count=self.count,
+            mean=self.total / self.count,
+            **{
+                "p{}".format(q): float(np.percentile(self.values, q))
+                for q in PERCENTILES
+            }
+        )
+
+
+class PipelineProfiler(object):
+    def __init__(
+        self, out_dir=None, trace_memory=False, dump_interval=200, reservoir_size=1024
+    ):
+        self.out_dir = out_dir
+        self.trace_memory = trace_memory
+        self.dump_interval = dump_interval
+        self.reservoir_size = reservoir_size
+        self._pid = None
+
+    def _start_process(self):
+        # forked workers inherit the records of the parent, start over
+        self._pid = os.getpid()
+        self._rng = random.Random(self._pid)
+        self._epoch_stat = None
+        self._epoch = self._read_epoch()
+        self.reset()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
+        except ValueError:
+            # not the main thread of the process, dumps only every dump_interval
+            pass
+
+    def reset(self):
+        self.records = {}
+        self.num_samples = 0
+
+    def _read_epoch(self):
+        if self.out_dir is None:
+            return 0
+        try:
+            with open(os.path.join(self.out_dir, EPOCH_FILE)) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _check_epoch(self):
+        """Clear the records once the monitor has printed the last epoch."""
+        try:
+            stat = os.stat(os.path.join(self.out_dir, EPOCH_FILE)).st_mtime_ns
+        except OSError:
+            return
+        if stat != self._epoch_stat:
+            self._epoch_stat = stat
+            epoch = self._read_epoch()
+            if epoch != self._epoch:
+                self._epoch = epoch
+                self.reset()
+
+    def start(self):
+        """Start a sample."""
+        if self._pid != os.getpid():
+            self._start_process()
+        if self.out_dir is not None:
+            self._check_epoch()
+        self._start_stage()
+
+    def _start_stage(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self._memory = tracemalloc.get_traced_memory()[0]
+        self._time = time.perf_counter()
+
+    def record(self, name, res):
+        """Close the stage name that ended with res and start the next one."""
+        seconds = time.perf_counter() - self._time
+        stage = self.records.get(name)
+        if stage is None:
+            stage = self.records[name] = {
+                key: Reservoir(self.reservoir_size, self._rng) for key in QUANTITIES
+            }
+        stage["ms"].add(seconds * 1000)
+        if self.trace_memory:
+            stage["bytes"].add(tracemalloc.get_traced_memory()[1] - self._memory)
+        if res is not None:
+            for key, value in sample_counts(res).items():
+                stage[key].add(value)
+        self._start_stage()
+
+    def end_sample(self):
+        self.num_samples += 1
+        if self.dump_interval and self.num_samples % self.dump_interval == 0:
+            self.dump()
+
+    def dump(self):
+        """Write the summary of this process to out_dir, or print it."""
+        if self._pid != os.getpid():
+            return
+        profile = dict(
+            pid=self._pid,
+            epoch=self._epoch,
+            num_samples=self.num_samples,
+            stages=summarize(self.records),
+        )
+        if self.out_dir is None:
+            print(format_table({self._pid: profile}), flush=True)
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, "pipeline_profile_{}.json".format(self._pid))
+        with open(path + ".tmp", "w") as f:
+            json.dump(profile, f)
+        os.replace(path + ".tmp", path)
+
+
+def summarize(records):
+    """Count, mean and percentiles of every recorded quantity of every stage."""
+    return {
+        name: {
+            key: reservoir.summary()
+            for key, reservoir in stage.items()
+            if reservoir.count
+        }
+        for name, stage in records.items()
+    }
+
+
+def load_profiles(out_dir):
+    """The dumps of the workers in out_dir for the current epoch, keyed by pid."""
+    epoch = PipelineProfiler(out_dir)._read_epoch()
+    profiles = {}
+    for path in sorted(glob.glob(os.path.join(out_dir, "pipeline_profile_*.json"))):
+        with open(path) as f:
+            profile = json.load(f)
+        if profile.get("epoch", 0) == epoch:
+            profiles[profile["pid"]] = profile
+    return profiles
+
+
+def reset_profiles(out_dir):
+    """Start a new epoch, workers clear their records at their next sample."""
+    epoch = PipelineProfiler(out_dir)._read_epoch() + 1
+    for path in glob.glob(os.path.join(out_dir, "pipeline_profile_*.json")):
+        os.remove(path)
+    with open(os.path.join(out_dir, EPOCH_FILE + ".tmp"), "w") as f:
+        f.write(str(epoch))
+    os.replace(
+        os.path.join(out_dir, EPOCH_FILE + ".tmp"), os.path.join(out_dir, EPOCH_FILE)
+    )
+
+
+def format_table(profiles):
+    """One block per worker with the time, memory and count percentiles."""
+    lines = []
+    for pid, profile in sorted(profiles.items()):
+        lines.append("worker {}: {} samples".format(pid, profile["num_samples"]))
+        lines.append(
+            "{:<28s}{:>9s}{:>9s}{:>9s}{:>9s}{:>11s}{:>9s}{:>8s}{:>7s}".format(
+                "stage",
+                "mean ms",
+                "p50 ms",
+                "p90 ms",
+                "p99 ms",
+                "p99 MB",
+                "points",
+                "voxels",
+                "boxes",
+            )
+        )
+        for name, stats in profile["stages"].items():
+            ms = stats["ms"]
+            megabytes = stats["bytes"]["p99"] / 2**20 if "bytes" in stats else -1
+            counts = [
+                stats[key]["p50"] if key in stats else -1
+                for key in ["points", "voxels", "boxes"]
+            ]
+            lines.append(
+                "{:<28s}{:9.2f}{:9.2f}{:9.2f}{:9.2f}{:11.1f}{:9.0f}{:8.0f}{:7.0f}".format(
+                    name,
+                    ms["mean"],
+                    ms["p50"],
+                    ms["p90"],
+                    ms["p99"],
+                    megabytes,
+                    *counts
+                )
+            )
+    return "\n".join(lines)
@@ -3,10 +3,15 @@ from ..registry import PIPELINES
 
 @PIPELINES.register_module
 class DoubleFlip(object):
-    def __init__(self):
-        pass
+    def __init__(self, copy_points=True):
+        # with copy_points=False the flipped clouds are not materialized, pair
+        # with Voxelization(mirror_flip=True) which mirrors the voxels instead
+        self.copy_points = copy_points
 
     def __call__(self, res, info):
+        if not self.copy_points:
+            return res, info
+
         # y flip
         points = res["lidar"]["points"].copy()
         points[:, 1] = -points[:, 1]
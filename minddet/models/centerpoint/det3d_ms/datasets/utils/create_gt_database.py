@@ -19,8 +19,13 @@ def create_groundtruth_database(
     dbinfo_path=None,
     relative_path=True,
     virtual=False,
+    packed=False,
     **kwargs,
 ):
+    """With packed the points of all objects of a class are appended to one
+    <class>.bin and db_info["offset"] is the row the object starts at, the
+    sampler then slices them out of a memory map instead of opening a file per
+    object."""
     pipeline = [
         {
             "type": "LoadPointCloudFromFile",
@@ -47,19 +52,16 @@ def create_groundtruth_database(
 
     root_path = Path(data_path)
 
+    suffix = "_virtual" if virtual else ""
+    if packed:
+        suffix += "_packed"
     if dataset_class_name in ["WAYMO", "NUSC"]:
         if db_path is None:
-            if virtual:
-                db_path = root_path / f"gt_database_{nsweeps}sweeps_withvelo_virtual"
-            else:
-                db_path = root_path / f"gt_database_{nsweeps}sweeps_withvelo"
+            db_path = root_path / f"gt_database_{nsweeps}sweeps_withvelo{suffix}"
         if dbinfo_path is None:
-            if virtual:
-                dbinfo_path = (
-                    root_path / f"dbinfos_train_{nsweeps}sweeps_withvelo_virtual.pkl"
-                )
-            else:
-                dbinfo_path = root_path / f"dbinfos_train_{nsweeps}sweeps_withvelo.pkl"
+            dbinfo_path = (
+                root_path / f"dbinfos_train_{nsweeps}sweeps_withvelo{suffix}.pkl"
+            )
     else:
         raise NotImplementedError()
 
@@ -67,6 +69,8 @@ def create_groundtruth_database(
 
     all_db_infos = {}
     group_counter = 0
+    packed_files = {}
+    packed_sizes = {}
 
     for index in tqdm(range(len(dataset))):
         image_idx = index
@@ -117,23 +121,33 @@ def create_groundtruth_database(
         point_indices = box_np_ops.points_in_rbbox(points, gt_boxes)
         for i in range(num_obj):
             if (used_classes is None) or names[i] in used_classes:
-                filename = f"{image_idx}_{names[i]}_{i}.bin"
-                dirpath = os.path.join(str(db_path), names[i])
-                os.makedirs(dirpath, exist_ok=True)
-
-                filepath = os.path.join(str(db_path), names[i], filename)
                 gt_points = points[point_indices[:, i]]
                 gt_points[:, :3] -= gt_boxes[i, :3]
-                with open(filepath, "w") as f:
-                    try:
-                        gt_points.tofile(f)
-                    except ValueError:
-                        print("process {} files".format(index))
-                        break
+                if packed:
+                    filename = f"{names[i]}.bin"
+                    filepath = os.path.join(str(db_path), filename)
+                    if names[i] not in packed_files:
+                        packed_files[names[i]] = open(filepath, "wb")
+                        packed_sizes[names[i]] = 0
+                    offset = packed_sizes[names[i]]
+                    gt_points.tofile(packed_files[names[i]])
+                    packed_sizes[names[i]] += gt_points.shape[0]
+                else:
+                    filename = os.path.join(names[i], f"{image_idx}_{names[i]}_{i}.bin")
+                    dirpath = os.path.join(str(db_path), names[i])
+                    os.makedirs(dirpath, exist_ok=True)
+
+                    filepath = os.path.join(str(db_path), filename)
+                    with open(filepath, "w") as f:
+                        try:
+                            gt_points.tofile(f)
+                        except ValueError:
+                            print("process {} files".format(index))
+                            break
 
             if (used_classes is None) or names[i] in used_classes:
                 if relative_path:
-                    db_dump_path = os.path.join(db_path.stem, names[i], filename)
+                    db_dump_path = os.path.join(db_path.stem, filename)
                 else:
                     db_dump_path = str(filepath)
 
@@ -154,6 +168,8 @@ def create_groundtruth_database(
                     group_dict[local_group_id] = group_counter
                     group_counter += 1
                 db_info["group_id"] = group_dict[local_group_id]
+                if packed:
+                    db_info["offset"] = offset
                 if "score" in annos:
                     db_info["score"] = annos["score"][i]
                 if names[i] in all_db_infos:
@@ -161,6 +177,9 @@ def create_groundtruth_database(
                 else:
                     all_db_infos[names[i]] = [db_info]
 
+    for f in packed_files.values():
+        f.close()
+
     print("dataset length: ", len(dataset))
     for k, v in all_db_infos.items():
         print(f"load {len(v)} {k} database infos")
@@ -0,0 +1,162 @@
+import fcntl
+import mmap
+import os
+import pickle
+import uuid
+
+import numpy as np
+
+
+def _index_path(info_path, index_dir=None):
+    stem = os.path.basename(os.path.splitext(info_path)[0])
+    index_dir = os.path.dirname(info_path) if index_dir is None else index_dir
+    return os.path.join(index_dir, stem + ".index.npz")
+
+
+def _source_stat(info_path):
+    stat = os.stat(info_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _load_index(index_path, info_path):
+    """The index of info_path, None if missing or built from an older pickle."""
+    if not os.path.exists(index_path):
+        return None
+    index = dict(np.load(index_path))
+    if "records" not in index or not np.array_equal(
+        index["source"], _source_stat(info_path)
+    ):
+        return None
+    return index
+
+
+def build_info_index(info_path, index_dir=None):
+    """Split an info pickle into one pickled record per sample.
+
+    Writes ``<stem>.<build id>.records``, the records back to back, and
+    ``<stem>.index.npz`` with the name of the records file, their offsets, the
+    tokens and the names of the classes present in every sample, next to
+    info_path or to index_dir. The index names its own records file and is
+    replaced last, so a reader never pairs a new index with old records.
+    Concurrent builders (ranks, workers) wait on a lock and reuse the index
+    the first one wrote.
+    """
+    index_path = _index_path(info_path, index_dir)
+    index_dir = os.path.dirname(index_path)
+    stem = os.path.basename(index_path)[: -len(".index.npz")]
+    with open(index_path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if _load_index(index_path, info_path) is not None:
+            # built by another process while this one waited
+            return
+        with open(info_path, "rb") as f:
+            infos = pickle.load(f)
+        if isinstance(infos, dict):
+            infos = [info for v in infos.values() for info in v]
+
+        class_names = sorted(
+            {name for info in infos for name in info.get("gt_names", [])}
+        )
+        class_ids = {name: i for i, name in enumerate(class_names)}
+        presence = np.zeros((len(infos), len(class_names)), dtype=np.bool_)
+        offsets = np.zeros(len(infos) + 1, dtype=np.int64)
+        records_name = "{}.{}.records".format(stem, uuid.uuid4().hex)
+        with open(os.path.join(index_dir, records_name), "wb") as f:
+            for i, info in enumerate(infos):
+                f.write(pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL))
+                offsets[i + 1] = f.tell()
+                presence[i, [class_ids[n] for n in info.get("gt_names", [])]] = True
+        tokens = np.array([info["token"] for info in infos])
+        tmp_path = "{}.tmp{}".format(index_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                records=np.array(records_name),
+                offsets=offsets,
+                tokens=tokens,
+                class_names=np.array(class_names),
+                presence=presence,
+                source=_source_stat(info_path),
+            )
+        stale = None
+        if os.path.exists(index_path):
+            with np.load(index_path) as old_index:
+                if "records" in old_index:
+                    stale = str(old_index["records"])
+        os.replace(tmp_path, index_path)
+        # the records of the replaced index, open mappings stay valid
+        if stale is not None and stale != records_name:
+            try:
+                os.remove(os.path.join(index_dir, stale))
+            except OSError:
+                pass
+
+
+class InfoStore(object):
+    """Sequence of the infos of an info pickle, decoded one sample at a time.
+
+    Only the index (offsets, tokens and per class presence bitmaps) is loaded,
+    the records are read from a memory-mapped file that all worker processes
+    share through the page cache. The index is built on first use and rebuilt
+    when the info pickle changes.
+    """
+
+    def __init__(self, info_path, index_dir=None, indices=None):
+        index_path = _index_path(info_path, index_dir)
+        index = _load_index(index_path, info_path)
+        if index is None:
+            build_info_index(info_path, index_dir)
+            index = _load_index(index_path, info_path)
+        self.records_path = os.path.join(
+            os.path.dirname(index_path), str(index["records"])
+        )
+        self.offsets = index["offsets"]
+        self.tokens_all = index["tokens"]
+        self.class_names = list(index["class_names"])
+        self.presence_all = index["presence"]
+        self.indices = (
+            np.arange(len(self.tokens_all)) if indices is None else np.asarray(indices)
+        )
+        self._records = None
+
+    def select(self, indices):
+        """A store of the samples indices, positions in this store."""
+        store = object.__new__(InfoStore)
+        store.__dict__.update(self.__dict__)
+        store.indices = self.indices[np.asarray(indices, dtype=np.int64)]
+        store._records = None
+        return store
+
+    @property
+    def tokens(self):
+        return self.tokens_all[self.indices]
+
+    def presence(self, class_names):
+        """[len(self), len(class_names)] bool, whether a sample has the class."""
+        presence = np.zeros((len(self), len(class_names)), dtype=np.bool_)
+        for j, name in enumerate(class_names):
+            if name in self.class_names:
+                presence[:, j] = self.presence_all[
+                    self.indices, self.class_names.index(name)
+                ]
+        return presence
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if self._records is None:
+            with open(self.records_path, "rb") as f:
+                self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        i = self.indices[idx]
+        return pickle.loads(self._records[self.offsets[i] : self.offsets[i + 1]])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getstate__(self):
+        # the mapping is reopened in the process the store is sent to
+        state = self.__dict__.copy()
+        state["_records"] = None
+        return state
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+CACHE_COLUMNS = ["voxels", "coordinates", "num_points", "num_voxels", "shape"]
+
+
+def config_hash(config):
+    return hashlib.md5(
+        json.dumps(config, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class VoxelCache(object):
+    """On-disk cache of the voxelized test samples.
+
+    Samples are stored under ``cache_dir/<hash of config>/<token>/`` with one
+    ``.npy`` file per column, so a changed pipeline or voxel config never reads
+    the samples of another one. Only the filled voxels are written, get
+    memory-maps them and pads back to num_voxels, which gives the arrays the
+    pipeline returned. The pipeline must be deterministic for the cache to be
+    valid, see LoadPointCloudFromFile(deterministic=True).
+    """
+
+    def __init__(self, cache_dir, config):
+        self.root = os.path.join(cache_dir, config_hash(config))
+        os.makedirs(self.root, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, token):
+        return os.path.join(self.root, token)
+
+    def get(self, token):
+        path = self._path(token)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        data = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+            for name in CACHE_COLUMNS
+        }
+        num_voxels = int(data["num_voxels"][0])
+        num_filled = data["voxels"].shape[0]
+        for name in ["voxels", "coordinates", "num_points"]:
+            value = np.zeros(
+                (num_voxels,) + data[name].shape[1:], dtype=data[name].dtype
+            )
+            value[:num_filled] = data[name]
+            data[name] = value
+        data["num_voxels"] = np.array(data["num_voxels"])
+        data["shape"] = np.array(data["shape"])
+        return [data[name] for name in CACHE_COLUMNS]
+
+    def put(self, token, columns):
+        """columns in CACHE_COLUMNS order, as returned by the pipeline."""
+        data = dict(zip(CACHE_COLUMNS, columns))
+        # voxels are filled from the front, the padding has no points
+        num_filled = np.count_nonzero(data["num_points"])
+        for name in ["voxels", "coordinates", "num_points"]:
+            data[name] = data[name][:num_filled]
+        # write to a private directory first, concurrent workers or an
+        # interrupted run never leave a partial sample behind
+        path = self._path(token)
+        tmp_path = "{}.tmp{}".format(path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, value in data.items():
+            np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(value))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another worker stored the sample first
+            shutil.rmtree(tmp_path, ignore_errors=True)
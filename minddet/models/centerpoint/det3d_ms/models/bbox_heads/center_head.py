@@ -11,7 +11,10 @@ import logging
 import mindspore.numpy as mnp
 import numpy as np
 from det3d_ms.models.losses.centernet_loss import FastFocalLoss, RegLoss
+from det3d_ms.ops.nms_circle import BatchCircleNMS, CircleNMS
 from det3d_ms.ops.nms_cpu import NMS
+from det3d_ms.ops.nms_numba import NMS as NumbaNMS
+from det3d_ms.ops.nms_numba import BatchNMS as NumbaBatchNMS
 from mindspore import Tensor, context, nn, ops
 from mindspore.common import dtype as mstype
 from mindspore.common.initializer import Constant
@@ -186,7 +189,14 @@ class CenterHead(nn.Cell):
         if self.device == "Ascend":
             self.nms_type = "cpu"
         self.nms = NMS()
+        self.numba_nms = NumbaNMS()
+        self.numba_batch_nms = NumbaBatchNMS()
+        self.circle_nms = CircleNMS()
+        self.batch_circle_nms = BatchCircleNMS()
         self.topK = ops.TopK()
+        self.stack0 = ops.Stack(axis=0)
+        self.stack1 = ops.Stack(axis=1)
+        self.gatherd = ops.GatherD()
         self.minimum = ops.Minimum()
         self.sigmoid = ops.Sigmoid()
 
@@ -272,6 +282,8 @@ class CenterHead(nn.Cell):
 
     def predict(self, example, preds_dicts, test_cfg, **kwargs):
         """decode, nms, then return the detection result. Additionally supports double flip testing"""
+        if test_cfg.get("batched_decode", False):
+            return self.predict_batched(example, preds_dicts, test_cfg)
         # get loss info
         rets = []
         metas = []
@@ -393,8 +405,205 @@ class CenterHead(nn.Cell):
 
         #     ret_list.append(ret)
 
+        if test_cfg.get("packed_output", False):
+            dets, counts = self.pack_predictions(rets, test_cfg)
+            return dets, counts, example["token"]
         return rets, example["token"]
 
+    def predict_batched(self, example, preds_dicts, test_cfg):
+        """predict with the tasks of all samples decoded together.
+
+        The heatmaps (padded to the largest task) and box regressions of all
+        tasks are stacked to [batch * tasks, H * W, C], so sigmoid, decode,
+        score and range masking, topK and the gathers run once instead of per
+        task and sample. Circle NMS and the numba rotated NMS run batched as
+        well, the nms_fast.so kernel takes one box set per call. Returns the same
+        per task, per sample lists as predict.
+        """
+        num_tasks = len(preds_dicts)
+        max_cls = max(self.num_classes)
+        batch, _, H, W = preds_dicts[0]["hm"].shape
+        num_sets = batch * num_tasks
+        dtype = preds_dicts[0]["hm"].dtype
+        post_center_range = generate_tensor(test_cfg["post_center_limit_range"], dtype)
+
+        # channels: reg 0:2, height 2:3, dim 3:6, rot 6:8, vel 8:10
+        box_keys = ["reg", "height", "dim", "rot"]
+        if "vel" in preds_dicts[0]:
+            box_keys.append("vel")
+        hms = []
+        regs = []
+        for preds_dict, num_cls in zip(preds_dicts, self.num_classes):
+            hm = preds_dict["hm"]
+            if num_cls < max_cls:
+                # padded classes never win the argmax
+                hm = self.concat1(
+                    [hm, mnp.full((batch, max_cls - num_cls, H, W), -1e4, dtype)]
+                )
+            hms.append(hm)
+            regs.append(self.concat1([preds_dict[key] for key in box_keys]))
+        # [batch, tasks, C, H, W] -> [batch * tasks, H * W, C]
+        batch_hm = self.sigmoid(self.stack1(hms)).reshape((num_sets, max_cls, H * W))
+        batch_hm = self.transpose(batch_hm, (0, 2, 1))
+        batch_reg = self.stack1(regs)
+        batch_reg = batch_reg.reshape((num_sets, batch_reg.shape[2], H * W))
+        batch_reg = self.transpose(batch_reg, (0, 2, 1))
+
+        labels, scores = self.argmax_with_value(batch_hm)
+
+        ys, xs = self.meshgrid((mnp.arange(0, H), mnp.arange(0, W)))
+        xs = self.cast(xs.reshape((1, H * W, 1)), dtype) + batch_reg[:, :, 0:1]
+        ys = self.cast(ys.reshape((1, H * W, 1)), dtype) + batch_reg[:, :, 1:2]
+        xs = (
+            xs * test_cfg["out_size_factor"] * test_cfg["voxel_size"][0]
+            + test_cfg["pc_range"][0]
+        )
+        ys = (
+            ys * test_cfg["out_size_factor"] * test_cfg["voxel_size"][1]
+            + test_cfg["pc_range"][1]
+        )
+        box_parts = [xs, ys, batch_reg[:, :, 2:3], self.exp(batch_reg[:, :, 3:6])]
+        if "vel" in preds_dicts[0]:
+            box_parts.append(batch_reg[:, :, 8:10])
+        box_parts.append(self.atan2(batch_reg[:, :, 6:7], batch_reg[:, :, 7:8]))
+        box_preds = self.concat2(box_parts)
+        box_dim = box_preds.shape[-1]
+
+        score_mask = scores > test_cfg["score_threshold"]
+        distance_mask = self.logical_and(
+            (box_preds[..., :3] >= post_center_range[:3]).all(-1),
+            (box_preds[..., :3] <= post_center_range[3:]).all(-1),
+        )
+        mask = self.logical_and(distance_mask, score_mask)
+        box_preds = self.cast(box_preds, mstype.float32)
+        scores = self.cast(scores, mstype.float32)
+        labels = self.cast(labels, mstype.int32)
+        scores = self.select(mask, scores, self.zeroslike(scores) - 1)
+        labels = self.select(mask, labels, self.zeroslike(labels) - 1)
+        box_preds = mnp.where(mask.expand_dims(-1), box_preds, 0.0)
+
+        scores_sorted, order = self.topK(scores, test_cfg["nms"]["nms_pre_max_size"])
+        boxes_sorted = self.gatherd(
+            box_preds, 1, mnp.tile(order.expand_dims(-1), (1, 1, box_dim))
+        )
+        labels_sorted = self.gatherd(labels, 1, order)
+        mask_num = self.cast(
+            self.gatherd(self.cast(mask, mstype.float32), 1, order).sum(-1),
+            mstype.int32,
+        )
+
+        nms_parts = [
+            boxes_sorted[..., 0:3],
+            boxes_sorted[..., 4:5],
+            boxes_sorted[..., 3:4],
+            boxes_sorted[..., 5:6],
+            -boxes_sorted[..., -1:] - np.pi / 2,
+        ]
+        if self.nms_type == "npu":
+            nms_parts.append(boxes_sorted[..., 6:7])
+        boxes_for_nms = self.concat2(nms_parts)
+        if "circular_nms" in test_cfg and test_cfg["circular_nms"]:
+            # min_radius is one squared center distance per task
+            min_radius = test_cfg["min_radius"]
+            if not isinstance(min_radius, (list, tuple)):
+                min_radius = [min_radius] * num_tasks
+            thresh = generate_tensor(
+                [float(r) for r in min_radius] * batch, mstype.float32
+            )
+            keep, num_out = self.batch_circle_nms(boxes_for_nms, thresh)
+        elif test_cfg["nms"].get("backend", "aot") == "numba":
+            thresh = generate_tensor(
+                [float(test_cfg["nms"]["nms_iou_threshold"])] * num_sets,
+                mstype.float32,
+            )
+            keep, num_out = self.numba_batch_nms(
+                boxes_for_nms, mask_num, thresh, test_cfg["nms"]["nms_post_max_size"]
+            )
+        else:
+            keeps = []
+            nums_out = []
+            for i in range(num_sets):
+                keep, num_out = self.rotate_nms(boxes_for_nms[i], test_cfg)
+                keeps.append(keep)
+                nums_out.append(num_out)
+            keep = self.stack0(keeps)
+            num_out = self.stack0(nums_out)
+
+        selected_boxes = self.gatherd(
+            boxes_sorted, 1, mnp.tile(keep.expand_dims(-1), (1, 1, box_dim))
+        )
+        selected_scores = self.gatherd(scores_sorted, 1, keep)
+        selected_labels = self.gatherd(labels_sorted, 1, keep)
+        num_selected = self.minimum(
+            self.minimum(num_out, mask_num), test_cfg["nms"]["nms_post_max_size"]
+        )
+
+        # sets are sample major, set i is task i % num_tasks of sample i // num_tasks
+        rets = []
+        for task_id in range(num_tasks):
+            task_rets = []
+            for i in range(task_id, num_sets, num_tasks):
+                task_rets.append(
+                    [
+                        selected_boxes[i],
+                        selected_scores[i],
+                        selected_labels[i],
+                        num_selected[i],
+                    ]
+                )
+            rets.append(task_rets)
+        if test_cfg.get("packed_output", False):
+            dets, counts = self.pack_predictions(rets, test_cfg)
+            return dets, counts, example["token"]
+        return rets, example["token"]
+
+    def pack_predictions(self, rets, test_cfg):
+        """Pack the per task, per sample predictions of predict into one tensor.
+
+        Returns dets [batch, tasks * nms_post_max_size, box_dim + 2], the boxes
+        followed by the score and the label (with the class offset of the task),
+        one block of nms_post_max_size rows per task, and counts [batch, tasks],
+        the number of valid leading rows of every block.
+        """
+        max_dets = test_cfg["nms"]["nms_post_max_size"]
+        dets = []
+        counts = []
+        label_offset = 0
+        for task_rets, num_cls in zip(rets, self.num_classes):
+            boxes = self.stack0([ret[0][:max_dets] for ret in task_rets])
+            scores = self.stack0([ret[1][:max_dets] for ret in task_rets])
+            labels = self.stack0([ret[2][:max_dets] for ret in task_rets])
+            num = self.stack0([ret[3] for ret in task_rets])
+            # the leading rows with a positive score are the detections
+            valid = self.logical_and(
+                mnp.arange(scores.shape[1]).reshape((1, -1)) < num.reshape((-1, 1)),
+                scores > 0,
+            )
+            counts.append(self.cast(valid, mstype.int32).sum(-1))
+            dets.append(
+                self.concat2(
+                    [
+                        self.cast(boxes, mstype.float32),
+                        self.cast(scores, mstype.float32).expand_dims(-1),
+                        self.cast(labels + label_offset, mstype.float32).expand_dims(
+                            -1
+                        ),
+                    ]
+                )
+            )
+            label_offset += num_cls
+        return self.concat1(dets), self.stack1(counts)
+
+    def rotate_nms(self, boxes, test_cfg):
+        """Rotated BEV NMS of boxes sorted by score with the backend of
+        test_cfg.nms, "aot" (nms_fast.so, the default) or "numba"."""
+        nms_cfg = test_cfg["nms"]
+        if nms_cfg.get("backend", "aot") == "numba":
+            return self.numba_nms(
+                boxes, nms_cfg["nms_iou_threshold"], nms_cfg["nms_post_max_size"]
+            )
+        return self.nms(boxes, nms_cfg["nms_iou_threshold"])
+
     def post_processing(
         self, batch_box_preds, batch_hm, test_cfg, post_center_range, task_id
     ):
@@ -440,9 +649,16 @@ class CenterHead(nn.Cell):
             mask_num = self.cast(
                 self.cast(mask, mstype.float32)[order].sum(), mstype.int32
             )
-            keep, num_out = self.nms(
-                boxes_for_nms_sorted, test_cfg["nms"]["nms_iou_threshold"]
-            )  # 0.003s
+            if "circular_nms" in test_cfg and test_cfg["circular_nms"]:
+                # min_radius is one squared center distance per task
+                min_radius = test_cfg["min_radius"]
+                if isinstance(min_radius, (list, tuple)):
+                    min_radius = min_radius[task_id]
+                keep, num_out = self.circle_nms(boxes_for_nms_sorted, min_radius)
+            else:
+                keep, num_out = self.rotate_nms(
+                    boxes_for_nms_sorted, test_cfg
+                )  # 0.003s
             boxes_sorted[:, -1] = -boxes_sorted[:, -1] - np.pi / 2
             selected_scores = scores_sorted[keep]
             selected_boxes = boxes_sorted[keep]
@@ -130,10 +130,13 @@ class PillarFeatureNet(nn.Cell):
 
     def construct(self, features, num_voxels, coors):
         """
-        :param features: shape (60000, 20, 5), float32
-        :param num_voxels: shape (60000,), int32
-        :param coors: shape (60000, 4), int32
+        :param features: shape (N, 20, 5), float32
+        :param num_voxels: shape (N,), int32
+        :param coors: shape (N, 4), int32
         :return:
+
+        N is the padded voxel count of the batch, max_voxel_num or the
+        voxel bucket the loader picked, every N compiles its own graph.
         """
         if self.virtual:
             virtual_point_mask = features[..., -2] == -1
@@ -145,19 +148,12 @@ class PillarFeatureNet(nn.Cell):
         data_type = features.dtype
         # Find distance of x, y, and z from cluster center
         # features = features[:, :, :self.num_input]
-        num_voxels_for_div = num_voxels.copy()
-        num_voxels_for_div = ops.select(
-            num_voxels_for_div > 0,
-            num_voxels_for_div,
-            Tensor(np.ones(num_voxels.shape), dtype=num_voxels_for_div.dtype),
-        )
+        # empty pillars have zero features, their mean stays zero
+        num_voxels_for_div = ops.maximum(num_voxels, 1)
         points_mean = features[:, :, :3].sum(axis=1, keepdims=True) / self.cast(
             num_voxels_for_div, data_type
         ).view((-1, 1, 1))
-        # dynamic shape
         mask = self.cast(num_voxels > 0, mstype.int32)
-        mask_points = mnp.tile(mask.reshape(-1, 1, 1), (1,) + points_mean.shape[1:])
-        points_mean = mnp.where(mask_points, points_mean, ops.ZerosLike()(points_mean))
 
         f_cluster = features[:, :, :3] - points_mean
 
@@ -173,9 +169,6 @@ class PillarFeatureNet(nn.Cell):
         f_center = ops.Concat(axis=2)(
             (f_center_0.expand_dims(-1), f_center_1.expand_dims(-1))
         )
-        # dynamic shape
-        mask_center = mnp.tile(mask.reshape(-1, 1, 1), (1,) + f_center.shape[1:])
-        f_center = mnp.where(mask_center, f_center, ops.ZerosLike()(f_center))
 
         # Combine feature decorations
         features_ls = [features, f_cluster, f_center]
@@ -185,7 +178,7 @@ class PillarFeatureNet(nn.Cell):
         features = self.concat(features_ls)
 
         # The feature decorations were calculated without regard to whether pillar was empty. Need to ensure that
-        # empty pillars remain set to zeros.
+        # empty pillars and padded points remain set to zeros, this also clears the offsets of the padded pillars.
         voxel_count = features.shape[1]
         mask_voxels = get_paddings_indicator(num_voxels, voxel_count, axis=0)  # 0.0009s
         mask_voxels = self.cast(self.expand_dims(mask_voxels, -1), data_type)
@@ -202,26 +195,32 @@ class PillarFeatureNet(nn.Cell):
 @BACKBONES.register_module
 class PointPillarsScatter(nn.Cell):
     def __init__(
-        self, num_input_features=64, norm_cfg=None, name="PointPillarsScatter", **kwargs
+        self,
+        num_input_features=64,
+        norm_cfg=None,
+        name="PointPillarsScatter",
+        output_shape=(512, 512),
+        **kwargs
     ):
         """
         Point Pillar's Scatter.
         Converts learned features from dense tensor to sparse pseudo image. This replaces SECOND's
         second.pytorch.voxelnet.SparseMiddleExtractor.
-        :param output_shape: ([int]: 4). Required output shape of features.
+        :param output_shape: ([int]: 2). ny, nx of the pseudo image, the voxel grid of pc_range / voxel_size.
         :param num_input_features: <int>. Number of input features.
         """
 
         super().__init__()
         self.name = "PointPillarsScatter"
         self.nchannels = num_input_features
+        self.ny, self.nx = output_shape
 
     def construct(self, voxel_features, coords, batch_size, input_shape):
         batch_canvas = ops.transpose(
             ops.ScatterNd()(
                 ops.Stack(-1)([coords[..., 0], coords[..., 2], coords[..., 3]]),
                 voxel_features,
-                (batch_size, 512, 512, self.nchannels),
+                (batch_size, self.ny, self.nx, self.nchannels),
             ),
             (0, 3, 1, 2),
         )
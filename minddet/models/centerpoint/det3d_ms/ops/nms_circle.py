@@ -0,0 +1,85 @@
+import mindspore.numpy as mnp
+import numpy as np
+from mindspore import Tensor, nn, ops
+from mindspore.common import dtype as mstype
+from mindspore.ops import constexpr
+
+
+@constexpr
+def _upper_triangle(num):
+    return Tensor(np.triu(np.ones((num, num), dtype=np.float32), 1))
+
+
+class CircleNMS(nn.Cell):
+    """Graph mode circle NMS on boxes sorted by score, same outputs as NMS.
+
+    A box is kept while no kept box ranked before it lies within the squared
+    center distance thresh, keep is iterated on the mask matrix until it no
+    longer changes, which gives the greedy result without a per box loop.
+    """
+
+    def __init__(self):
+        super(CircleNMS, self).__init__()
+        self.cast = ops.Cast()
+        self.matmul = ops.MatMul()
+        self.topK = ops.TopK()
+        self.ones = ops.Ones()
+
+    def construct(self, boxes, thresh):
+        num = boxes.shape[0]
+        x1 = boxes[:, 0:1]
+        y1 = boxes[:, 1:2]
+        dist = (x1 - x1.T) ** 2 + (y1 - y1.T) ** 2
+        close = self.cast(dist <= thresh, mstype.float32) * _upper_triangle(num)
+
+        keep = self.ones((1, num), mstype.float32)
+        new_keep = self.cast(self.matmul(keep, close) == 0, mstype.float32)
+        while (new_keep != keep).any():
+            keep = new_keep
+            new_keep = self.cast(self.matmul(keep, close) == 0, mstype.float32)
+        keep = keep.reshape(-1)
+
+        # kept boxes first, in score order
+        rank = keep * num - self.cast(mnp.arange(num), mstype.float32)
+        order = self.topK(rank, num)[1]
+        num_out = self.cast(keep.sum(), mstype.int32)
+        return order, num_out
+
+
+class BatchCircleNMS(nn.Cell):
+    """CircleNMS on a batch of box sets, boxes [num_sets, num, >=2] are sorted by
+    score within every set and thresh holds one squared distance per set.
+    Returns order [num_sets, num] and num_out [num_sets].
+    """
+
+    def __init__(self):
+        super(BatchCircleNMS, self).__init__()
+        self.cast = ops.Cast()
+        self.batch_matmul = ops.BatchMatMul()
+        self.transpose = ops.Transpose()
+        self.topK = ops.TopK()
+        self.ones = ops.Ones()
+
+    def construct(self, boxes, thresh):
+        num_sets, num = boxes.shape[0], boxes.shape[1]
+        x1 = boxes[:, :, 0:1]
+        y1 = boxes[:, :, 1:2]
+        dist = (x1 - self.transpose(x1, (0, 2, 1))) ** 2 + (
+            y1 - self.transpose(y1, (0, 2, 1))
+        ) ** 2
+        close = self.cast(
+            dist <= thresh.reshape((-1, 1, 1)), mstype.float32
+        ) * _upper_triangle(num)
+
+        keep = self.ones((num_sets, 1, num), mstype.float32)
+        new_keep = self.cast(self.batch_matmul(keep, close) == 0, mstype.float32)
+        while (new_keep != keep).any():
+            keep = new_keep
+            new_keep = self.cast(self.batch_matmul(keep, close) == 0, mstype.float32)
+        keep = keep.reshape((num_sets, num))
+
+        # kept boxes first, in score order
+        rank = keep * num - self.cast(mnp.arange(num), mstype.float32)
+        order = self.topK(rank, num)[1]
+        num_out = self.cast(keep.sum(-1), mstype.int32)
+        return order, num_out
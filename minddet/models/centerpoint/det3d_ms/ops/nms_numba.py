@@ -0,0 +1,64 @@
+import mindspore
+import mindspore.ops as P
+import numpy as np
+from det3d_ms.core.utils.rotate_nms_jit import rotate_nms, rotate_nms_batch
+from mindspore import nn
+
+
+def _rotate_nms(boxes, thresh, max_keep):
+    keep, num_out = rotate_nms(boxes, float(thresh), int(max_keep))
+    return keep, np.array([num_out], dtype=np.int32)
+
+
+def _rotate_nms_batch(boxes, num_valid, thresh, max_keep):
+    return rotate_nms_batch(boxes, num_valid, thresh.astype(np.float64), int(max_keep))
+
+
+class NMS(nn.Cell):
+    """Rotated BEV NMS compiled with numba, for CPU inference without
+    nms_fast.so. Same outputs as ops.nms_cpu.NMS, the loop stops once max_keep
+    boxes are kept, so num_out is at most max_keep when max_keep > 0.
+    """
+
+    def __init__(self):
+        super(NMS, self).__init__()
+        self.nms = P.Custom(
+            _rotate_nms,
+            out_shape=lambda x, _, __: (
+                [
+                    x[0],
+                ],
+                [
+                    1,
+                ],
+            ),
+            out_dtype=lambda x, _, __: (mindspore.int32, mindspore.int32),
+            func_type="pyfunc",
+        )
+        self.nms.add_prim_attr("primitive_target", "CPU")
+
+    def construct(self, boxes, thresh, max_keep=-1):
+        ret = self.nms(boxes, thresh, max_keep)
+        return ret[0], ret[1][0]
+
+
+class BatchNMS(nn.Cell):
+    """NMS on a batch of box sets in one op call, boxes [num_sets, num, 7] are
+    sorted by score within every set, num_valid [num_sets] counts the boxes
+    that take part and thresh holds one IoU threshold per set. Boxes of
+    different sets never suppress each other. Returns keep [num_sets, num] and
+    num_out [num_sets], as BatchCircleNMS.
+    """
+
+    def __init__(self):
+        super(BatchNMS, self).__init__()
+        self.nms = P.Custom(
+            _rotate_nms_batch,
+            out_shape=lambda x, n, _, __: (x[:2], n),
+            out_dtype=lambda x, n, _, __: (mindspore.int32, mindspore.int32),
+            func_type="pyfunc",
+        )
+        self.nms.add_prim_attr("primitive_target", "CPU")
+
+    def construct(self, boxes, num_valid, thresh, max_keep=-1):
+        return self.nms(boxes, num_valid, thresh, max_keep)
@@ -143,13 +143,314 @@ def points_to_voxel(
         voxelmap_shape = voxelmap_shape[::-1]
     # don't create large array in jit(nopython=True) code.
     num_points_per_voxel = np.zeros(shape=(max_voxels,), dtype=np.int32)
+    coor_to_voxelidx = -np.ones(shape=voxelmap_shape, dtype=np.int32)
     voxels = np.zeros(
         shape=(max_voxels, max_points, points.shape[-1]), dtype=points.dtype
     )
     coors = np.zeros(shape=(max_voxels, 3), dtype=np.int32)
+    if reverse_index:
+        _points_to_voxel_reverse_kernel(
+            points,
+            voxel_size,
+            coors_range,
+            num_points_per_voxel,
+            coor_to_voxelidx,
+            voxels,
+            coors,
+            max_points,
+            max_voxels,
+        )
+    else:
+        _points_to_voxel_kernel(
+            points,
+            voxel_size,
+            coors_range,
+            num_points_per_voxel,
+            coor_to_voxelidx,
+            voxels,
+            coors,
+            max_points,
+            max_voxels,
+        )
     return voxels, coors, num_points_per_voxel
 
 
+@numba.njit(parallel=True)
+def _voxel_keys_kernel(points, voxel_size, coors_range, grid_size, keys):
+    # linearized voxel index, x varies fastest. -1 for points out of range.
+    N = points.shape[0]
+    for i in numba.prange(N):
+        key = 0
+        for j in range(2, -1, -1):
+            c = np.floor((points[i, j] - coors_range[j]) / voxel_size[j])
+            if c < 0 or c >= grid_size[j]:
+                key = -1
+                break
+            key = key * grid_size[j] + np.int64(c)
+        keys[i] = key
+
+
+@numba.jit(nopython=True)
+def _radix_argsort_kernel(keys, order, sorted_keys, num_bits, radix_bits=11):
+    # stable LSD radix sort of the non negative keys. order and sorted_keys
+    # must hold N entries, the number of valid keys is returned.
+    N = keys.shape[0]
+    num_valid = 0
+    for i in range(N):
+        if keys[i] >= 0:
+            order[num_valid] = i
+            sorted_keys[num_valid] = keys[i]
+            num_valid += 1
+    tmp_order = np.empty_like(order)
+    tmp_keys = np.empty_like(sorted_keys)
+    num_buckets = 1 << radix_bits
+    bucket_mask = num_buckets - 1
+    counts = np.empty((num_buckets + 1,), dtype=np.int64)
+    num_passes = 0
+    shift = 0
+    while shift < num_bits:
+        src_order, dst_order = (
+            (order, tmp_order) if num_passes % 2 == 0 else (tmp_order, order)
+        )
+        src_keys, dst_keys = (
+            (sorted_keys, tmp_keys) if num_passes % 2 == 0 else (tmp_keys, sorted_keys)
+        )
+        counts[:] = 0
+        for p in range(num_valid):
+            counts[((src_keys[p] >> shift) & bucket_mask) + 1] += 1
+        for b in range(num_buckets):
+            counts[b + 1] += counts[b]
+        for p in range(num_valid):
+            b = (src_keys[p] >> shift) & bucket_mask
+            q = counts[b]
+            dst_order[q] = src_order[p]
+            dst_keys[q] = src_keys[p]
+            counts[b] = q + 1
+        num_passes += 1
+        shift += radix_bits
+    if num_passes % 2 == 1:
+        order[:num_valid] = tmp_order[:num_valid]
+        sorted_keys[:num_valid] = tmp_keys[:num_valid]
+    return num_valid
+
+
+@numba.njit(parallel=True)
+def _fill_sorted_voxels_kernel(
+    points,
+    order,
+    sorted_keys,
+    run_starts,
+    run_lengths,
+    voxel_runs,
+    grid_size,
+    num_points_per_voxel,
+    voxels,
+    coors,
+    max_points,
+    reverse_index,
+):
+    # voxel_runs[v] is the run of sorted points that forms voxel v, voxels are
+    # independent so they are filled in parallel.
+    for v in numba.prange(voxel_runs.shape[0]):
+        run = voxel_runs[v]
+        start = run_starts[run]
+        num = min(run_lengths[run], max_points)
+        for k in range(num):
+            voxels[v, k] = points[order[start + k]]
+        num_points_per_voxel[v] = num
+        key = sorted_keys[start]
+        x = key % grid_size[0]
+        key //= grid_size[0]
+        y = key % grid_size[1]
+        z = key // grid_size[1]
+        if reverse_index:
+            coors[v, 0] = z
+            coors[v, 1] = y
+            coors[v, 2] = x
+        else:
+            coors[v, 0] = x
+            coors[v, 1] = y
+            coors[v, 2] = z
+
+
+def _sorted_voxel_runs(points, voxel_size, coors_range, max_voxels):
+    # sort points by voxel key, returns the runs of the first max_voxels voxels
+    # in order of their first point.
+    grid_size = (coors_range[3:] - coors_range[:3]) / voxel_size
+    grid_size = np.round(grid_size).astype(np.int64)
+    num_bits = max(int(np.prod(grid_size)) - 1, 1).bit_length()
+
+    N = points.shape[0]
+    keys = np.empty((N,), dtype=np.int64)
+    _voxel_keys_kernel(points, voxel_size, coors_range, grid_size, keys)
+    order = np.empty((N,), dtype=np.int64)
+    sorted_keys = np.empty((N,), dtype=np.int64)
+    num_valid = _radix_argsort_kernel(keys, order, sorted_keys, num_bits)
+    order = order[:num_valid]
+    sorted_keys = sorted_keys[:num_valid]
+
+    run_starts = np.flatnonzero(np.diff(sorted_keys)) + 1
+    run_starts = np.concatenate([[0], run_starts]) if num_valid else run_starts
+    run_lengths = np.diff(np.append(run_starts, num_valid))
+    # number the runs in order of their first point
+    first_run = np.full((N,), -1, dtype=np.int64)
+    first_run[order[run_starts]] = np.arange(run_starts.shape[0])
+    voxel_runs = first_run[first_run >= 0][:max_voxels]
+    return order, sorted_keys, run_starts, run_lengths, voxel_runs, grid_size
+
+
+def points_to_voxel_sorted(
+    points, voxel_size, coors_range, max_points=35, reverse_index=True, max_voxels=20000
+):
+    """sort based version of points_to_voxel with identical output.
+
+    Points are keyed by their linearized voxel index and radix sorted, the
+    runs of equal keys are the voxels. Voxels are numbered by the first point
+    that falls into them and every voxel keeps its first max_points points, as
+    in the dense kernels, so both engines produce the same voxels in the same
+    order. No dense coor_to_voxelidx grid is needed and the voxels are filled
+    in parallel.
+
+    Args:
+        see points_to_voxel.
+
+    Returns:
+        voxels: [max_voxels, max_points, ndim] float tensor, zero padded.
+        coordinates: [max_voxels, 3] int32 tensor.
+        num_points_per_voxel: [max_voxels] int32 tensor.
+    """
+    if not isinstance(voxel_size, np.ndarray):
+        voxel_size = np.array(voxel_size, dtype=points.dtype)
+    if not isinstance(coors_range, np.ndarray):
+        coors_range = np.array(coors_range, dtype=points.dtype)
+
+    num_points_per_voxel = np.zeros(shape=(max_voxels,), dtype=np.int32)
+    voxels = np.zeros(
+        shape=(max_voxels, max_points, points.shape[-1]), dtype=points.dtype
+    )
+    coors = np.zeros(shape=(max_voxels, 3), dtype=np.int32)
+    _fill_sorted_voxels_kernel(
+        points,
+        *_sorted_voxel_runs(points, voxel_size, coors_range, max_voxels),
+        num_points_per_voxel,
+        voxels,
+        coors,
+        max_points,
+        reverse_index,
+    )
+    return voxels, coors, num_points_per_voxel
+
+
+class VoxelWorkspace(object):
+    """Reusable buffers for points_to_voxel and points_to_voxel_sorted.
+
+    The output arrays and the dense coor_to_voxelidx grid are allocated once,
+    sized for the largest max_voxels seen. Before every call only the voxels
+    and grid cells written by the previous call are reset, instead of
+    allocating and filling tens of MB per frame.
+
+    Results are views into the workspace and are overwritten by the next call,
+    pass copy=True to keep them.
+    """
+
+    def __init__(self, voxel_size, coors_range, max_points, reverse_index=True):
+        self.voxel_size = np.array(voxel_size, dtype=np.float32)
+        self.coors_range = np.array(coors_range, dtype=np.float32)
+        self.max_points = max_points
+        self.reverse_index = reverse_index
+        voxelmap_shape = (self.coors_range[3:] - self.coors_range[:3]) / self.voxel_size
+        voxelmap_shape = tuple(np.round(voxelmap_shape).astype(np.int32).tolist())
+        if reverse_index:
+            voxelmap_shape = voxelmap_shape[::-1]
+        self._voxelmap_shape = voxelmap_shape
+        self.coor_to_voxelidx = None
+        self.voxels = None
+        self.coors = None
+        self.num_points_per_voxel = None
+        self._num_used = 0
+
+    def _reserve(self, points, max_voxels):
+        voxel_shape = (self.max_points, points.shape[-1])
+        if (
+            self.voxels is None
+            or self.voxels.shape[0] < max_voxels
+            or self.voxels.shape[1:] != voxel_shape
+            or self.voxels.dtype != points.dtype
+        ):
+            self.voxels = np.zeros((max_voxels,) + voxel_shape, dtype=points.dtype)
+            self.coors = np.zeros(shape=(max_voxels, 3), dtype=np.int32)
+            self.num_points_per_voxel = np.zeros(shape=(max_voxels,), dtype=np.int32)
+            if self.coor_to_voxelidx is not None:
+                self.coor_to_voxelidx.fill(-1)
+            self._num_used = 0
+
+    def reset(self):
+        num_used = self._num_used
+        if num_used == 0:
+            return
+        if self.coor_to_voxelidx is not None:
+            coors = self.coors[:num_used]
+            self.coor_to_voxelidx[coors[:, 0], coors[:, 1], coors[:, 2]] = -1
+        self.voxels[:num_used] = 0
+        self.coors[:num_used] = 0
+        self.num_points_per_voxel[:num_used] = 0
+        self._num_used = 0
+
+    def generate(self, points, max_voxels=20000, engine="dense", copy=False):
+        self._reserve(points, max_voxels)
+        self.reset()
+        if engine == "dense":
+            if self.coor_to_voxelidx is None:
+                self.coor_to_voxelidx = -np.ones(
+                    shape=self._voxelmap_shape, dtype=np.int32
+                )
+            kernel = (
+                _points_to_voxel_reverse_kernel
+                if self.reverse_index
+                else _points_to_voxel_kernel
+            )
+            voxel_num = kernel(
+                points,
+                self.voxel_size,
+                self.coors_range,
+                self.num_points_per_voxel,
+                self.coor_to_voxelidx,
+                self.voxels,
+                self.coors,
+                self.max_points,
+                max_voxels,
+            )
+            self._num_used = voxel_num
+        else:
+            voxel_runs = _sorted_voxel_runs(
+                points, self.voxel_size, self.coors_range, max_voxels
+            )
+            _fill_sorted_voxels_kernel(
+                points,
+                *voxel_runs,
+                self.num_points_per_voxel,
+                self.voxels,
+                self.coors,
+                self.max_points,
+                self.reverse_index,
+            )
+            # no grid cells to reset, only the filled voxels
+            self._num_used = voxel_runs[4].shape[0]
+
+        outputs = (
+            self.voxels[:max_voxels],
+            self.coors[:max_voxels],
+            self.num_points_per_voxel[:max_voxels],
+        )
+        if copy:
+            # only the filled voxels are copied, the padding comes from zeros
+            copies = tuple(np.zeros_like(x) for x in outputs)
+            for src, dst in zip(outputs, copies):
+                dst[: self._num_used] = src[: self._num_used]
+            outputs = copies
+        return outputs
+
+
 @numba.jit(nopython=True)
 def bound_points_jit(points, upper_bound, lower_bound):
     # to use nopython=True, np.bool_ is not supported. so you need
@@ -166,3 +467,102 @@ def bound_points_jit(points, upper_bound, lower_bound):
                 break
         keep_indices[i] = success
     return keep_indices
+
+
+@numba.njit(parallel=True)
+def count_not_close_jit(points, min_distance):
+    # number of points kept by the close-point filter, i.e. the rows
+    # transform_sweep_jit will write.
+    N = points.shape[0]
+    count = 0
+    for i in numba.prange(N):
+        if not (abs(points[i, 0]) < min_distance and abs(points[i, 1]) < min_distance):
+            count += 1
+    return count
+
+
+@numba.njit(parallel=True)
+def transform_sweep_jit(
+    points, rotation, translation, time_lag, min_distance, out, chunk_size=8192
+):
+    """Fused close-point filter, rigid transform and time stamping of a sweep.
+
+    Points are processed in chunks: the kept points of every chunk are counted
+    in parallel, a prefix sum gives each chunk its output offset and the chunks
+    are then written in parallel, so the output keeps the input point order.
+
+    Args:
+        points: [N, C] float32 array, points[:, :3] are xyz in sensor frame.
+        rotation: [3, 3] float32 array.
+        translation: [3] float32 array.
+        time_lag: float. written to out[:, C].
+        min_distance: float. points with |x| and |y| both below it are dropped.
+        out: [M, C + 1] float32 array, M >= count_not_close_jit(points, min_distance).
+
+    Returns:
+        num_out: int. number of rows written to out.
+    """
+    N = points.shape[0]
+    num_feature = points.shape[1]
+    num_chunks = (N + chunk_size - 1) // chunk_size
+    chunk_offsets = np.zeros((num_chunks + 1,), dtype=np.int64)
+    for c in numba.prange(num_chunks):
+        count = 0
+        for i in range(c * chunk_size, min(N, (c + 1) * chunk_size)):
+            if not (
+                abs(points[i, 0]) < min_distance and abs(points[i, 1]) < min_distance
+            ):
+                count += 1
+        chunk_offsets[c + 1] = count
+    for c in range(num_chunks):
+        chunk_offsets[c + 1] += chunk_offsets[c]
+
+    for c in numba.prange(num_chunks):
+        k = chunk_offsets[c]
+        for i in range(c * chunk_size, min(N, (c + 1) * chunk_size)):
+            x = points[i, 0]
+            y = points[i, 1]
+            z = points[i, 2]
+            if abs(x) < min_distance and abs(y) < min_distance:
+                continue
+            for j in range(3):
+                out[k, j] = (
+                    rotation[j, 0] * x
+                    + rotation[j, 1] * y
+                    + rotation[j, 2] * z
+                    + translation[j]
+                )
+            for j in range(3, num_feature):
+                out[k, j] = points[i, j]
+            out[k, num_feature] = time_lag
+            k += 1
+    return chunk_offsets[num_chunks]
+
+
+def transform_sweep(points, transform_matrix, time_lag, min_distance=0.0, out=None):
+    """filter, transform and time stamp a sweep with transform_sweep_jit.
+
+    Args:
+        points: [N, C] float tensor.
+        transform_matrix: [4, 4] homogeneous sensor-to-reference transform, or
+            None for points already in the reference frame.
+        time_lag: float.
+        min_distance: float. radius of the close-point filter, 0 disables it.
+        out: optional [M, C + 1] float32 slice to write into. allocated if None.
+
+    Returns:
+        out: [M, C + 1] float32 tensor, out[:, C] is time_lag.
+    """
+    if transform_matrix is None:
+        rotation = np.eye(3, dtype=np.float32)
+        translation = np.zeros((3,), dtype=np.float32)
+    else:
+        rotation = np.ascontiguousarray(transform_matrix[:3, :3], dtype=np.float32)
+        translation = np.ascontiguousarray(transform_matrix[:3, 3], dtype=np.float32)
+    if out is None:
+        num_out = count_not_close_jit(points, min_distance)
+        out = np.empty((num_out, points.shape[1] + 1), dtype=np.float32)
+    num_out = transform_sweep_jit(
+        points, rotation, translation, time_lag, min_distance, out
+    )
+    return out[:num_out]
@@ -18,3 +18,13 @@ def get_downsample_factor(model_config):
     downsample_factor = int(downsample_factor)
     assert downsample_factor > 0
     return downsample_factor
+
+
+def get_output_shape(voxel_generator_config):
+    """ny, nx of the voxel grid of the voxel generator, the pseudo image size."""
+    pc_range = np.array(voxel_generator_config["range"], dtype=np.float64)
+    voxel_size = np.array(voxel_generator_config["voxel_size"], dtype=np.float64)
+    grid_size = np.round((pc_range[3:5] - pc_range[0:2]) / voxel_size[0:2])
+    nx, ny = [int(size) for size in grid_size]
+    assert nx > 0 and ny > 0
+    return ny, nx
@@ -0,0 +1,310 @@
+"""CPU micro-benchmarks for the data pipeline ops.
+
+Usage:
+    python tools_ms/benchmark.py sweep_transform --num_points=34000
+    python tools_ms/benchmark.py voxelize
+    python tools_ms/benchmark.py circle_nms --num_boxes=1000
+    python tools_ms/benchmark.py points_in_boxes --num_boxes=100
+    python tools_ms/benchmark.py rotate_nms --num_boxes=1000
+    python tools_ms/benchmark.py rotate_nms_batch --num_sets=12
+"""
+import time
+
+import fire
+import numpy as np
+from det3d_ms.core.bbox import box_np_ops
+from det3d_ms.core.utils.circle_nms_jit import circle_nms as circle_nms_jit
+from det3d_ms.core.utils.circle_nms_jit import circle_nms_matrix
+from det3d_ms.core.utils.rotate_nms_jit import rotate_nms as rotate_nms_jit
+from det3d_ms.core.utils.rotate_nms_jit import rotate_nms_batch as rotate_nms_batch_jit
+from det3d_ms.ops.point_cloud.point_cloud_ops import (
+    count_not_close_jit,
+    points_to_voxel,
+    points_to_voxel_sorted,
+    transform_sweep,
+)
+
+
+def _timeit(func, repeat):
+    func()  # warm up, triggers numba compilation
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _random_sweeps(num_sweeps, num_points, seed=0):
+    rng = np.random.default_rng(seed)
+    sweeps = []
+    for i in range(num_sweeps):
+        points = rng.uniform(-60, 60, size=(num_points, 4)).astype(np.float32)
+        angle = rng.uniform(-np.pi, np.pi)
+        transform_matrix = np.eye(4)
+        transform_matrix[:2, :2] = [
+            [np.cos(angle), -np.sin(angle)],
+            [np.sin(angle), np.cos(angle)],
+        ]
+        transform_matrix[:3, 3] = rng.normal(size=3)
+        sweeps.append(
+            dict(
+                points=points,
+                transform_matrix=transform_matrix,
+                time_lag=0.05 * i,
+            )
+        )
+    return sweeps
+
+
+def _aggregate_numpy(sweeps, min_distance=1.0):
+    # the NumPy path of LoadPointCloudFromFile before the fused kernel
+    sweep_points_list = []
+    sweep_times_list = []
+    for sweep in sweeps:
+        points_sweep = sweep["points"].T
+        x_filt = np.abs(points_sweep[0, :]) < min_distance
+        y_filt = np.abs(points_sweep[1, :]) < min_distance
+        points_sweep = points_sweep[:, np.logical_not(np.logical_and(x_filt, y_filt))]
+        nbr_points = points_sweep.shape[1]
+        points_sweep[:3, :] = sweep["transform_matrix"].dot(
+            np.vstack((points_sweep[:3, :], np.ones(nbr_points)))
+        )[:3, :]
+        curr_times = sweep["time_lag"] * np.ones((1, nbr_points))
+        sweep_points_list.append(points_sweep.T)
+        sweep_times_list.append(curr_times.T)
+
+    points = np.concatenate(sweep_points_list, axis=0)
+    times = np.concatenate(sweep_times_list, axis=0).astype(points.dtype)
+    return np.hstack([points, times])
+
+
+def _aggregate_fused(sweeps, min_distance=1.0):
+    num_sweep_points = [
+        count_not_close_jit(sweep["points"], min_distance) for sweep in sweeps
+    ]
+    combined = np.empty((sum(num_sweep_points), 5), dtype=np.float32)
+    start = 0
+    for sweep, num_points in zip(sweeps, num_sweep_points):
+        transform_sweep(
+            sweep["points"],
+            sweep["transform_matrix"],
+            sweep["time_lag"],
+            min_distance,
+            out=combined[start : start + num_points],
+        )
+        start += num_points
+    return combined
+
+
+def sweep_transform(num_points=34000, repeat=20):
+    """Compare NumPy and fused sweep aggregation for 1 and 10 sweeps."""
+    for num_sweeps in [1, 10]:
+        sweeps = _random_sweeps(num_sweeps, num_points)
+        numpy_ms = _timeit(lambda: _aggregate_numpy(sweeps), repeat)
+        fused_ms = _timeit(lambda: _aggregate_fused(sweeps), repeat)
+        max_diff = np.abs(_aggregate_numpy(sweeps) - _aggregate_fused(sweeps)).max()
+        print(
+            "sweeps {:2d}: numpy {:7.2f} ms, fused {:7.2f} ms, "
+            "speedup {:5.2f}x, max abs diff {:.2e}".format(
+                num_sweeps, numpy_ms, fused_ms, numpy_ms / fused_ms, max_diff
+            )
+        )
+
+
+def _random_cloud(num_points, num_features=5, seed=0):
+    # uniform clutter plus dense clusters, roughly like a 10-sweep nuScenes cloud
+    rng = np.random.default_rng(seed)
+    points = np.empty((num_points, num_features), dtype=np.float32)
+    num_uniform = num_points // 2
+    points[:num_uniform, :2] = rng.uniform(-55, 55, size=(num_uniform, 2))
+    points[num_uniform:, :2] = rng.normal(scale=15, size=(num_points - num_uniform, 2))
+    points[:, 2] = rng.uniform(-5, 3, size=num_points)
+    points[:, 3:] = rng.uniform(0, 1, size=(num_points, num_features - 3))
+    return points
+
+
+def voxelize(
+    voxel_size=(0.2, 0.2, 8),
+    pc_range=(-51.2, -51.2, -5.0, 51.2, 51.2, 3.0),
+    max_points=20,
+    max_voxels=60000,
+    repeat=10,
+):
+    """Compare the dense and sort voxelization engines from 30k to 300k points."""
+    for num_points in [30000, 100000, 200000, 300000]:
+        points = _random_cloud(num_points)
+        results = {}
+        timings = {}
+        for name, engine in [
+            ("dense", points_to_voxel),
+            ("sort", points_to_voxel_sorted),
+        ]:
+
+            def run():
+                return engine(
+                    points, voxel_size, pc_range, max_points, True, max_voxels
+                )
+
+            timings[name] = _timeit(run, repeat)
+            results[name] = run()
+        identical = all(
+            np.array_equal(a, b) for a, b in zip(results["dense"], results["sort"])
+        )
+        print(
+            "points {:6d}: voxels {:5d}, dense {:7.2f} ms, sort {:7.2f} ms, "
+            "identical {}".format(
+                num_points,
+                int((results["dense"][2] > 0).sum()),
+                timings["dense"],
+                timings["sort"],
+                identical,
+            )
+        )
+
+
+def _circle_nms_python(dets, thresh):
+    # the per box loop of circle_nms before it was jitted again
+    x1, y1, scores = dets[:, 0], dets[:, 1], dets[:, 2]
+    order = scores.argsort()[::-1]
+    suppressed = np.zeros(len(dets), dtype=np.int32)
+    keep = []
+    for _i in range(len(dets)):
+        i = order[_i]
+        if suppressed[i] == 1:
+            continue
+        keep.append(i)
+        for _j in range(_i + 1, len(dets)):
+            j = order[_j]
+            if suppressed[j] == 1:
+                continue
+            if (x1[i] - x1[j]) ** 2 + (y1[i] - y1[j]) ** 2 <= thresh:
+                suppressed[j] = 1
+    return keep
+
+
+def circle_nms(num_boxes=1000, min_radius=(4, 12, 10, 1, 0.85, 0.175), repeat=20):
+    """Latency of circle NMS on num_boxes pre-NMS boxes for every task radius."""
+    rng = np.random.default_rng(0)
+    dets = np.empty((num_boxes, 3), dtype=np.float32)
+    dets[:, :2] = rng.uniform(-51.2, 51.2, size=(num_boxes, 2))
+    dets[:, 2] = rng.permutation(num_boxes) / num_boxes
+    for thresh in min_radius:
+        keep = np.array(circle_nms_jit(dets, thresh))
+        timings = [
+            _timeit(lambda: func(dets, thresh), repeat)
+            for func in [_circle_nms_python, circle_nms_jit, circle_nms_matrix]
+        ]
+        print(
+            "min_radius {:5.3f}: kept {:4d}, python {:8.2f} ms, numba {:6.2f} ms, "
+            "matrix {:6.2f} ms, identical {}".format(
+                thresh,
+                len(keep),
+                *timings,
+                np.array_equal(keep, circle_nms_matrix(dets, thresh)),
+            )
+        )
+
+
+def points_in_boxes(num_boxes=100, repeat=5):
+    """Compare the dense and BEV binned points in boxes engines from 30k to 300k
+    points, counting for min_points_in_gt and masks for the GT database."""
+    rng = np.random.default_rng(0)
+    boxes = np.empty((num_boxes, 7), dtype=np.float32)
+    boxes[:, :2] = rng.uniform(-50, 50, size=(num_boxes, 2))
+    boxes[:, 2] = rng.uniform(-2, 0, size=num_boxes)
+    boxes[:, 3:6] = rng.uniform([0.5, 0.5, 1.0], [12, 3, 4], size=(num_boxes, 3))
+    boxes[:, 6] = rng.uniform(-np.pi, np.pi, size=num_boxes)
+    for num_points in [30000, 100000, 300000]:
+        points = _random_cloud(num_points)
+        results = {}
+        timings = {}
+        for name in ["count", "in"]:
+            func = getattr(box_np_ops, "points_{}_rbbox".format(name))
+            for engine in ["dense", "bev"]:
+                key = name + "_" + engine
+                timings[key] = _timeit(
+                    lambda: func(points, boxes, engine=engine), repeat
+                )
+                results[key] = func(points, boxes, engine=engine)
+        identical = np.array_equal(
+            results["count_dense"], results["count_bev"]
+        ) and np.array_equal(results["in_dense"], results["in_bev"])
+        print(
+            "points {:6d}: count dense {:8.2f} ms, bev {:6.2f} ms, "
+            "in dense {:8.2f} ms, bev {:6.2f} ms, identical {}".format(
+                num_points,
+                timings["count_dense"],
+                timings["count_bev"],
+                timings["in_dense"],
+                timings["in_bev"],
+                identical,
+            )
+        )
+
+
+def _random_nms_boxes(num_boxes, seed=0):
+    # pre-NMS boxes sorted by score, a third of them near duplicates
+    rng = np.random.default_rng(seed)
+    boxes = np.empty((num_boxes, 7), dtype=np.float32)
+    boxes[:, :2] = rng.uniform(-51.2, 51.2, size=(num_boxes, 2))
+    boxes[:, 2] = rng.uniform(-2, 0, size=num_boxes)
+    boxes[:, 3:6] = rng.uniform([0.5, 0.5, 1.0], [8, 3, 3], size=(num_boxes, 3))
+    boxes[:, 6] = rng.uniform(-np.pi, np.pi, size=num_boxes)
+    num_dup = num_boxes // 3
+    boxes[-num_dup:, :2] = boxes[:num_dup, :2] + rng.normal(
+        scale=0.3, size=(num_dup, 2)
+    )
+    return boxes
+
+
+def rotate_nms(num_boxes=1000, thresh=0.2, max_keep=83, repeat=10):
+    """Latency of the numba rotated NMS on num_boxes pre-NMS boxes, without and
+    with the standup box pruning and the early stop at max_keep."""
+    boxes = _random_nms_boxes(num_boxes)
+    keep, num_out = rotate_nms_jit(boxes, thresh, -1, False)
+    pruned_keep, pruned_num_out = rotate_nms_jit(boxes, thresh, max_keep, True)
+    timings = [
+        _timeit(lambda: rotate_nms_jit(boxes, thresh, -1, False), repeat),
+        _timeit(lambda: rotate_nms_jit(boxes, thresh, -1, True), repeat),
+        _timeit(lambda: rotate_nms_jit(boxes, thresh, max_keep, True), repeat),
+    ]
+    print(
+        "boxes {:5d}: kept {:4d}, all pairs {:8.2f} ms, pruned {:6.2f} ms, "
+        "pruned with max_keep {:6.2f} ms, identical {}".format(
+            num_boxes,
+            num_out,
+            *timings,
+            np.array_equal(keep[:pruned_num_out], pruned_keep[:pruned_num_out]),
+        )
+    )
+
+
+def rotate_nms_batch(num_sets=12, num_boxes=1000, thresh=0.2, max_keep=83, repeat=10):
+    """Latency of the rotated NMS of num_sets box sets (tasks x batch), one call
+    per set against a single batched call."""
+    boxes = np.stack([_random_nms_boxes(num_boxes, seed) for seed in range(num_sets)])
+    num_valid = np.full(num_sets, num_boxes, dtype=np.int32)
+    thresholds = np.full(num_sets, thresh)
+
+    def per_set():
+        return [rotate_nms_jit(set_boxes, thresh, max_keep) for set_boxes in boxes]
+
+    keep, num_out = rotate_nms_batch_jit(boxes, num_valid, thresholds, max_keep)
+    identical = all(
+        set_num_out == num_out[s] and np.array_equal(set_keep, keep[s])
+        for s, (set_keep, set_num_out) in enumerate(per_set())
+    )
+    timings = [
+        _timeit(per_set, repeat),
+        _timeit(
+            lambda: rotate_nms_batch_jit(boxes, num_valid, thresholds, max_keep),
+            repeat,
+        ),
+    ]
+    print(
+        "sets {:3d} x {:5d} boxes: per set {:8.2f} ms, batched {:6.2f} ms, "
+        "identical {}".format(num_sets, num_boxes, *timings, identical)
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire()
@@ -6,7 +6,9 @@ from det3d_ms.datasets.utils.create_gt_database import create_groundtruth_databa
 from det3d_ms.datasets.waymo import waymo_common as waymo_ds
 
 
-def nuscenes_data_prep(root_path, version, nsweeps=10, filter_zero=True, virtual=False):
+def nuscenes_data_prep(
+    root_path, version, nsweeps=10, filter_zero=True, virtual=False, packed=False
+):
     nu_ds.create_nuscenes_infos(
         root_path, version=version, nsweeps=nsweeps, filter_zero=filter_zero
     )
@@ -20,10 +22,11 @@ def nuscenes_data_prep(root_path, version, nsweeps=10, filter_zero=True, virtual
             ),
             nsweeps=nsweeps,
             virtual=virtual,
+            packed=packed,
         )
 
 
-def waymo_data_prep(root_path, split, nsweeps=1):
+def waymo_data_prep(root_path, split, nsweeps=1, packed=False):
     waymo_ds.create_waymo_infos(root_path, split=split, nsweeps=nsweeps)
     if split == "train":
         create_groundtruth_database(
@@ -33,6 +36,7 @@ def waymo_data_prep(root_path, split, nsweeps=1):
             / "infos_train_{:02d}sweeps_filter_zero_gt.pkl".format(nsweeps),
             used_classes=["VEHICLE", "CYCLIST", "PEDESTRIAN"],
             nsweeps=nsweeps,
+            packed=packed,
         )
 
 
@@ -0,0 +1,244 @@
+"""Convert a nuScenes split to the MindRecord shards read by build_dataloader.
+
+Every shard is written by its own worker process running the dataset pipeline.
+manifest.json in the output directory records the shards and a hash of the data
+config, rerunning the same command only regenerates the shards that are missing,
+unfinished or were produced with a different config.
+
+Usage:
+    python tools_ms/create_mindrecord.py train --out_dir=/data/train --num_shards=32
+    python tools_ms/create_mindrecord.py val --out_dir=/data/test --num_workers=16
+
+Point train_mindrecord_dir / test_mindrecord_dir of the config to out_dir.
+
+With --compact the voxels, coordinates and num_points are stored at their filled
+length instead of padded to max_voxel_num, and the voxels as raw voxel_dtype
+bytes, the layout is recorded in manifest.json for build_dataloader:
+    python tools_ms/create_mindrecord.py train --out_dir=/data/train --compact
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fire
+import numpy as np
+from det3d_ms.datasets import build_dataset
+from det3d_ms.datasets.loader.build_loader import (
+    TEST_COLUMNS,
+    TRAIN_COLUMNS,
+    VOXEL_COLUMNS,
+    to_column,
+)
+from det3d_ms.torchie import Config
+from mindspore.mindrecord import FileWriter
+
+DEFAULT_CONFIG = "configs_ms/nusc/pp/nusc_centerpoint_pp_02voxel_two_pfn_10sweep.py"
+
+_dataset = None
+
+
+def _init_worker(config, split):
+    global _dataset
+    cfg = Config.fromfile(config)
+    _dataset = build_dataset(cfg.data[split])
+
+
+def _schema(row, variable=()):
+    schema = {}
+    for name, value in row.items():
+        if isinstance(value, bytes):
+            schema[name] = {"type": "bytes"}
+        else:
+            shape = list(value.shape)
+            if name in variable:
+                shape[0] = -1
+            schema[name] = {"type": value.dtype.name, "shape": shape}
+    return schema
+
+
+def _compact(row, layout):
+    # voxels are filled from the front, the padding has no points
+    num_filled = np.count_nonzero(row["num_points"])
+    row["voxels"] = row["voxels"][:num_filled].astype(layout["voxel_dtype"]).tobytes()
+    row["coordinates"] = row["coordinates"][:num_filled]
+    row["num_points"] = row["num_points"][:num_filled]
+    return row
+
+
+def _remove_shard(path):
+    for name in [path, path + ".db"]:
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def _write_shard(path, start, stop, seed, layout=None, batch_size=16):
+    # one independent MindRecord file per shard, so shards never share a writer
+    columns = TEST_COLUMNS if _dataset.test_mode else TRAIN_COLUMNS
+    np.random.seed(seed)
+    _remove_shard(path)
+    writer = None
+    rows = []
+    start_time = time.time()
+    for idx in range(start, stop):
+        # hm/anno_box/ind/mask/cat are per task lists, stacked by to_column
+        row = {name: to_column(value) for name, value in zip(columns, _dataset[idx])}
+        # rows are buffered, the voxel columns may be views of the voxel
+        # generator workspace that the next sample overwrites
+        for name in VOXEL_COLUMNS:
+            row[name] = np.array(row[name])
+        # fixed width byte arrays, e.g. the token, read back as uint8 arrays
+        for name, value in row.items():
+            if value.dtype == np.uint8:
+                row[name] = value.tobytes()
+        if layout is not None:
+            row = _compact(row, layout)
+        if writer is None:
+            writer = FileWriter(path, 1)
+            variable = VOXEL_COLUMNS if layout is not None else ()
+            writer.add_schema(_schema(row, variable), "centerpoint")
+        rows.append(row)
+        if len(rows) == batch_size:
+            writer.write_raw_data(rows)
+            rows = []
+    if rows:
+        writer.write_raw_data(rows)
+    if writer is not None:
+        writer.commit()
+    return path, time.time() - start_time
+
+
+def _config_hash(cfg, split, layout=None):
+    data_cfg = json.dumps([cfg.data[split], layout], sort_keys=True, default=str)
+    return hashlib.md5(data_cfg.encode()).hexdigest()
+
+
+def _save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _load_manifest(out_dir):
+    path = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(
+    split="train",
+    out_dir=None,
+    config=DEFAULT_CONFIG,
+    num_shards=16,
+    num_workers=8,
+    prefix="ptcloud.mindrecord",
+    seed=0,
+    resume=True,
+    compact=False,
+    voxel_dtype="float16",
+):
+    """Write split ("train" or "val") of config to num_shards MindRecord files."""
+    assert out_dir is not None, "out_dir is required"
+    cfg = Config.fromfile(config)
+    num_samples = len(build_dataset(cfg.data[split]))
+    layout = None
+    if compact:
+        voxel_generator = cfg.voxel_generator
+        layout = dict(
+            voxel_dtype=voxel_dtype,
+            voxel_shape=[
+                voxel_generator.max_points_in_voxel,
+                cfg.model.reader.num_input_features,
+            ],
+        )
+    config_hash = _config_hash(cfg, split, layout)
+    num_shards = max(1, min(num_shards, num_samples))
+    os.makedirs(out_dir, exist_ok=True)
+
+    bounds = np.linspace(0, num_samples, num_shards + 1).astype(np.int64)
+    shards = [
+        dict(
+            file="{}{:02d}".format(prefix, i),
+            start=int(bounds[i]),
+            stop=int(bounds[i + 1]),
+            seed=seed + i,
+            complete=False,
+        )
+        for i in range(num_shards)
+    ]
+    old = _load_manifest(out_dir) if resume else None
+    if old is not None and old["config_hash"] == config_hash:
+        done = {
+            (s["file"], s["start"], s["stop"], s["seed"])
+            for s in old["shards"]
+            if s["complete"]
+        }
+        for shard in shards:
+            key = (shard["file"], shard["start"], shard["stop"], shard["seed"])
+            if key in done and os.path.exists(os.path.join(out_dir, shard["file"])):
+                shard["complete"] = True
+    if old is not None:
+        # drop shards of an older layout which are not part of this one
+        names = {shard["file"] for shard in shards}
+        for shard in old["shards"]:
+            if shard["file"] not in names:
+                _remove_shard(os.path.join(out_dir, shard["file"]))
+
+    manifest = dict(
+        config=config,
+        config_hash=config_hash,
+        split=split,
+        num_samples=num_samples,
+        layout=layout,
+        shards=shards,
+    )
+    _save_manifest(out_dir, manifest)
+
+    todo = [shard for shard in shards if not shard["complete"]]
+    print(
+        "{} samples, {} shards, {} to write".format(num_samples, num_shards, len(todo)),
+        flush=True,
+    )
+    if not todo:
+        return
+
+    start_time = time.time()
+    with ProcessPoolExecutor(
+        max_workers=num_workers, initializer=_init_worker, initargs=(config, split)
+    ) as pool:
+        futures = {
+            pool.submit(
+                _write_shard,
+                os.path.join(out_dir, shard["file"]),
+                shard["start"],
+                shard["stop"],
+                shard["seed"],
+                layout,
+            ): shard
+            for shard in todo
+        }
+        for i, future in enumerate(as_completed(futures)):
+            shard = futures[future]
+            _, seconds = future.result()
+            shard["complete"] = True
+            shard["seconds"] = round(seconds, 1)
+            _save_manifest(out_dir, manifest)
+            print(
+                "[{}/{}] {}: {} samples in {:.1f}s".format(
+                    i + 1,
+                    len(todo),
+                    shard["file"],
+                    shard["stop"] - shard["start"],
+                    seconds,
+                ),
+                flush=True,
+            )
+    print("done in {:.1f}s".format(time.time() - start_time), flush=True)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -56,6 +56,11 @@ def parse_args():
         help="job launcher",
     )
     parser.add_argument("--local_rank", type=int, default=0)
+    parser.add_argument(
+        "--voxel_cache",
+        default=None,
+        help="directory caching the voxelized samples between evaluations",
+    )
     parser.add_argument(
         "--autoscale-lr",
         action="store_true",
@@ -87,27 +92,42 @@ class MAPMetric(Metric):
         num_samples = len(rets[0])
 
         for i in range(num_samples):
-            ret = {}
-            size = [
-                (rets[j][i][1].asnumpy()[: rets[j][i][3].asnumpy()] > 0).sum()
-                for j in range(len(rets))
-            ]
-            ret["box3d_lidar"] = np.concatenate(
-                [rets[j][i][0].asnumpy()[: size[j]] for j in range(len(rets))], axis=0
-            )
-            ret["scores"] = np.concatenate(
-                [rets[j][i][1].asnumpy()[: size[j]] for j in range(len(rets))], axis=0
-            )
-            ret["metadata"] = {
-                "token": "".join([chr(x) for x in token[i]])
-            }  # token[i]}
+            boxes, scores, labels = [], [], []
             flag = 0
-            data = []
             for j, num_class in enumerate(self.num_classes):
-                data.append(rets[j][i][2].asnumpy()[: size[j]] + flag)
+                # every output is fetched from the device once
+                box, score, label, num = [x.asnumpy() for x in rets[j][i]]
+                size = (score[:num] > 0).sum()
+                boxes.append(box[:size])
+                scores.append(score[:size])
+                labels.append(label[:size] + flag)
                 flag += num_class
-            ret["label_preds"] = np.concatenate(data, axis=0)
-            ret_list.append(ret)
+            ret_list.append(
+                {
+                    "box3d_lidar": np.concatenate(boxes, axis=0),
+                    "scores": np.concatenate(scores, axis=0),
+                    "label_preds": np.concatenate(labels, axis=0),
+                    "metadata": {"token": token[i]},
+                }
+            )
+        return ret_list
+
+    def unpack(self, dets, counts, token):
+        """post_processing of the packed outputs of CenterHead.pack_predictions,
+        dets [B, tasks * block, box_dim + 2] and counts [B, tasks] are numpy."""
+        block = dets.shape[1] // counts.shape[1]
+        valid = (np.arange(block) < counts[:, :, None]).reshape(len(dets), -1)
+        ret_list = []
+        for i in range(len(dets)):
+            rows = dets[i][valid[i]]
+            ret_list.append(
+                {
+                    "box3d_lidar": rows[:, :-2],
+                    "scores": rows[:, -2],
+                    "label_preds": rows[:, -1].astype(np.int32),
+                    "metadata": {"token": token[i]},
+                }
+            )
         return ret_list
 
     def clear(self):
@@ -117,7 +137,16 @@ class MAPMetric(Metric):
         self.predictions = {}
 
     def update(self, *inputs):
-        outputs = self.post_processing(inputs[0], inputs[1].asnumpy())
+        # tokens are zero padded bytes of a fixed width, older MindRecord
+        # hold them as int64 character codes
+        token = inputs[-1].asnumpy()
+        token = token.astype(np.uint8).view("S{}".format(token.shape[1]))[:, 0]
+        token = [t.decode() for t in token]
+        if len(inputs) == 3:
+            # packed_output, one transfer for all the detections of the batch
+            outputs = self.unpack(inputs[0].asnumpy(), inputs[1].asnumpy(), token)
+        else:
+            outputs = self.post_processing(inputs[0], token)
         for output in outputs:
             token = output["metadata"]["token"]
             self.predictions.update({token: output})
@@ -169,6 +198,11 @@ def main():
     logger.info(f"load_checkpoint from {args.checkpoint}")
     load_param_into_net(net, param_dict)
     net.set_train(False)
+    if args.voxel_cache is not None:
+        for transform in cfg.data.val.pipeline:
+            if transform["type"] == "LoadPointCloudFromFile":
+                transform["deterministic"] = True
+        cfg.data.val.voxel_cache = dict(cache_dir=args.voxel_cache)
     dataset_generator = build_dataset(cfg.data.val)  # NuScenesDataset
     logger.info(f"test dataset length: {len(dataset_generator)}")
     dataset = build_dataloader(
@@ -177,9 +211,16 @@ def main():
         min(os.cpu_count(), cfg.data.workers_per_gpu),
         dist=False,
         mindrecord_dir=cfg.test_mindrecord_dir,
+        # the cache replaces the mindrecord of the test set
+        streaming=args.voxel_cache is not None,
+        voxel_buckets=cfg.data.get("voxel_buckets", None),
+        voxel_dtype=cfg.data.get("voxel_dtype", None),
     )
     logger.info("Dataset built")  # todo
     sink_mode = False if context.get_context("mode") == context.PYNATIVE_MODE else True
+    if cfg.data.get("voxel_buckets", None):
+        # the voxel count of a batch changes with its bucket, which sink mode does not allow
+        sink_mode = False
     logger.info(f"sink_mode is {sink_mode}")
     callbacks = [TimeMonitorEval(6019)]  # TODO 确定一下怎么把dataset的长度传进callbacks里
     model = Model(
@@ -9,9 +9,10 @@ from det3d_ms.datasets import build_dataloader, build_dataset
 from det3d_ms.models import build_detector
 from det3d_ms.torchie import Config
 from mindspore import context, load_checkpoint, load_param_into_net, nn
-from mindspore.nn.metrics import Metric
 from mindspore.train.model import Model
 
+from .eval import MAPMetric
+from .mindir import MindIRRuntime
 from .utils.utils import TimeMonitorEval
 
 # ModelCheckpoint, TimeMonitor)
@@ -46,6 +47,12 @@ def parse_args():
     parser.add_argument(
         "--ir_graph", default="./centerpoint_mindir_bs_4.mindir", help="IRGraph"
     )
+    parser.add_argument(
+        "--model_dir",
+        default=None,
+        help="directory of the graphs exported by tools_ms.mindir, replaces --ir_graph",
+    )
+    parser.add_argument("--batch_size", type=int, default=4, help="test batch size")
     args = parser.parse_args()
     if "LOCAL_RANK" not in os.environ:
         os.environ["LOCAL_RANK"] = str(args.local_rank)
@@ -53,76 +60,14 @@ def parse_args():
     return args
 
 
-class MAPMetric(Metric):
-    """AUC metric for AutoDis model."""
-
-    def __init__(self, dataset, num_classes, work_dir):
-        super(MAPMetric, self).__init__()
-        self.pred_probs = []
-        self.true_labels = []
-        self.predictions = {}
-        self.num_classes = num_classes
-        self.dataset = dataset
-        self.device = context.get_context("device_target")
-        self.work_dir = work_dir
-
-    def post_processing(self, rets, token):
-        # Merge branches results
-        ret_list = []
-        num_samples = len(rets[0])
-
-        for i in range(num_samples):
-            ret = {}
-            size = [
-                (rets[j][i][1].asnumpy()[: rets[j][i][3].asnumpy()] > 0).sum()
-                for j in range(len(rets))
-            ]
-            ret["box3d_lidar"] = np.concatenate(
-                [rets[j][i][0].asnumpy()[: size[j]] for j in range(len(rets))], axis=0
-            )
-            ret["scores"] = np.concatenate(
-                [rets[j][i][1].asnumpy()[: size[j]] for j in range(len(rets))], axis=0
-            )
-            ret["metadata"] = {
-                "token": "".join([chr(x) for x in token[i]])
-            }  # token[i]}
-            flag = 0
-            data = []
-            for j, num_class in enumerate(self.num_classes):
-                data.append(rets[j][i][2].asnumpy()[: size[j]] + flag)
-                flag += num_class
-            ret["label_preds"] = np.concatenate(data, axis=0)
-            ret_list.append(ret)
-        return ret_list
-
-    def clear(self):
-        """Clear the internal evaluation result."""
-        self.pred_probs = []
-        self.true_labels = []
-        self.predictions = {}
-
-    def update(self, *inputs):
-        outputs = self.post_processing(inputs[0], inputs[1].asnumpy())
-        for output in outputs:
-            token = output["metadata"]["token"]
-            self.predictions.update({token: output})
-        logger.info(f"{len(self.predictions)}")
-
-    def eval(self):
-        if len(self.true_labels) != len(self.pred_probs):
-            raise RuntimeError("true_labels.size() is not equal to pred_probs.size()")
-        map = self.dataset.evaluation(self.predictions, self.work_dir, False)
-        return map
-
-
 def main():
     args = parse_args()
     args.config = "configs_ms/nusc/pp/nusc_centerpoint_pp_02voxel_two_pfn_10sweep.py"
     cfg = Config.fromfile(args.config)
-    device_idd = 6
-    logger.info(f"DEVICE ID is {device_idd}")
+    device_id = int(os.getenv("DEVICE_ID", "0"))
+    logger.info(f"DEVICE ID is {device_id}")
     context.set_context(
-        mode=context.GRAPH_MODE, device_id=device_idd, device_target="Ascend"
+        mode=context.GRAPH_MODE, device_id=device_id, device_target="Ascend"
     )
     # update configs according to CLI args
     distributed = False
@@ -156,7 +101,7 @@ def main():
     logger.info(f"workers_per_gpu: {workers_per_gpu}")
     dataset = build_dataloader(
         dataset_generator,
-        4,
+        args.batch_size,
         workers_per_gpu,
         dist=False,
         mindrecord_dir=cfg.mindrecord_dir,
@@ -165,6 +110,17 @@ def main():
     sink_mode = False if context.get_context("mode") == context.PYNATIVE_MODE else True
     logger.info(f"sink_mode is {sink_mode}")
 
+    if args.model_dir is not None:
+        # every batch runs on the smallest exported graph that holds it
+        runtime = MindIRRuntime(args.model_dir, warmup=True)
+        metric = MAPMetric(dataset_generator, [1, 2, 2, 1, 2, 2], cfg.work_dir)
+        metric.clear()
+        logger.info("start evaluating")
+        for data in dataset.create_tuple_iterator(output_numpy=True):
+            metric.update(*runtime(*data))
+        logger.info(f"{metric.eval()}")
+        return
+
     graph = mindspore.load(args.ir_graph)
     logger.info(f"load IR graph from {args.ir_graph}")
 
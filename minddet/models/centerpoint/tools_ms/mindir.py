@@ -1,36 +1,226 @@
+"""Export CenterPoint to a family of MindIR graphs, one per batch size and voxel
+bucket, and run them.
+
+Usage:
+    python -m tools_ms.mindir --checkpoint CKPT --out_dir work_dirs/mindir \
+        --batch_sizes 1 4 --voxel_buckets 16000 32000 60000
+
+out_dir/manifest.json lists the graphs with the shapes and dtypes of their
+inputs. MindIRRuntime loads them lazily and runs every batch on the smallest
+graph it fits, so a single frame with 20k pillars no longer pays for a batch of
+4 padded to 60000 voxels.
+"""
+import argparse
+import json
+import logging as logger
+import os
+import time
+
 import numpy as np
+from det3d_ms.datasets.nuscenes.nuscenes import TOKEN_LENGTH
 from det3d_ms.models import build_detector
 from det3d_ms.torchie import Config
-from mindspore import Tensor, context, export, load_checkpoint
+from mindspore import Tensor, context, export, load, load_checkpoint, nn
+
+logger.basicConfig(
+    level=logger.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+INPUT_NAMES = ["voxels", "coordinates", "num_points", "num_voxels", "shape", "token"]
+# inputs with a voxel axis after the sample axis
+VOXEL_INPUTS = ["voxels", "coordinates", "num_points"]
+
+
+def input_spec(batch_size, num_voxels, max_points_in_voxel, num_point_features):
+    """Shapes and dtypes of the network inputs, in INPUT_NAMES order."""
+    return [
+        dict(
+            name="voxels",
+            shape=[batch_size, num_voxels, max_points_in_voxel, num_point_features],
+            dtype="float32",
+        ),
+        dict(name="coordinates", shape=[batch_size, num_voxels, 4], dtype="int32"),
+        dict(name="num_points", shape=[batch_size, num_voxels], dtype="int32"),
+        dict(name="num_voxels", shape=[batch_size, 1], dtype="int64"),
+        dict(name="shape", shape=[batch_size, 3], dtype="int64"),
+        dict(name="token", shape=[batch_size, TOKEN_LENGTH], dtype="uint8"),
+    ]
+
+
+def export_graphs(
+    net, out_dir, batch_sizes, voxel_buckets, max_points_in_voxel, num_point_features
+):
+    """Export net once per batch size and voxel bucket and write the manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+    graphs = []
+    for batch_size in sorted(batch_sizes):
+        for num_voxels in sorted(voxel_buckets):
+            name = "centerpoint_bs{}_v{}".format(batch_size, num_voxels)
+            spec = input_spec(
+                batch_size, num_voxels, max_points_in_voxel, num_point_features
+            )
+            inputs = [Tensor(np.zeros(i["shape"], dtype=i["dtype"])) for i in spec]
+            start = time.time()
+            export(
+                net,
+                *inputs,
+                file_name=os.path.join(out_dir, name),
+                file_format="MINDIR",
+            )
+            logger.info(f"exported {name} in {time.time() - start:.1f}s")
+            graphs.append(
+                dict(
+                    file=name + ".mindir",
+                    batch_size=batch_size,
+                    num_voxels=num_voxels,
+                    inputs=spec,
+                )
+            )
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(dict(graphs=graphs), f, indent=2)
+    return graphs
+
+
+class MindIRRuntime(object):
+    """Runs batches on the graphs exported by export_graphs.
+
+    A batch goes to the graph with the least batch_size * num_voxels that
+    holds its samples and its most filled sample, the batch is padded with
+    empty samples and its voxels are padded or cut to the graph's voxel count
+    (voxels are filled from the front). Graphs are loaded on first use, or all
+    at once and run on an empty batch with warmup=True.
+    """
+
+    def __init__(self, model_dir, warmup=False):
+        self.model_dir = model_dir
+        with open(os.path.join(model_dir, "manifest.json")) as f:
+            self.graphs = sorted(
+                json.load(f)["graphs"],
+                key=lambda g: (g["batch_size"] * g["num_voxels"], g["batch_size"]),
+            )
+        self._cells = {}
+        if warmup:
+            self.warmup()
+
+    def _cell(self, graph):
+        if graph["file"] not in self._cells:
+            start = time.time()
+            cell = nn.GraphCell(load(os.path.join(self.model_dir, graph["file"])))
+            self._cells[graph["file"]] = cell
+            logger.info(f"loaded {graph['file']} in {time.time() - start:.1f}s")
+        return self._cells[graph["file"]]
+
+    def select(self, batch_size, num_filled):
+        """The smallest graph for batch_size samples of up to num_filled voxels."""
+        for graph in self.graphs:
+            if graph["batch_size"] >= batch_size and graph["num_voxels"] >= num_filled:
+                return graph
+        raise ValueError(
+            "no exported graph holds {} samples of {} voxels".format(
+                batch_size, num_filled
+            )
+        )
+
+    def warmup(self):
+        for graph in self.graphs:
+            start = time.time()
+            self._cell(graph)(
+                *[
+                    Tensor(np.zeros(i["shape"], dtype=i["dtype"]))
+                    for i in graph["inputs"]
+                ]
+            )
+            logger.info(f"warmed up {graph['file']} in {time.time() - start:.1f}s")
+
+    def __call__(self, voxels, coordinates, num_points, num_voxels, shape, token):
+        """Inputs are the numpy arrays of a test batch, returns the outputs of
+        the network, (rets, token) or (dets, counts, token), for the samples of
+        the batch only."""
+        data = dict(
+            zip(
+                INPUT_NAMES, [voxels, coordinates, num_points, num_voxels, shape, token]
+            )
+        )
+        batch_size = voxels.shape[0]
+        num_filled = int(np.count_nonzero(num_points, axis=1).max())
+        graph = self.select(batch_size, num_filled)
+        inputs = []
+        for i in graph["inputs"]:
+            value = np.zeros(i["shape"], dtype=i["dtype"])
+            if i["name"] == "num_voxels":
+                value[:] = graph["num_voxels"]
+            elif i["name"] in VOXEL_INPUTS:
+                num = min(data[i["name"]].shape[1], graph["num_voxels"])
+                value[:batch_size, :num] = data[i["name"]][:, :num]
+            else:
+                value[:batch_size] = data[i["name"]]
+            inputs.append(Tensor(value))
+        outputs = self._cell(graph)(*inputs)
+        if len(outputs) == 3:
+            # exported with test_cfg.packed_output, (dets, counts, token)
+            return tuple(output[:batch_size] for output in outputs)
+        rets, out_token = outputs
+        return [task_rets[:batch_size] for task_rets in rets], out_token[:batch_size]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export MindIR graphs")
+    parser.add_argument(
+        "--config",
+        default="configs_ms/nusc/pp/nusc_centerpoint_pp_02voxel_two_pfn_10sweep.py",
+        help="model config file path",
+    )
+    parser.add_argument(
+        "--checkpoint", default="./centerpoint_ms.ckpt", help="checkpoint"
+    )
+    parser.add_argument(
+        "--out_dir", default="work_dirs/mindir", help="output directory"
+    )
+    parser.add_argument(
+        "--batch_sizes",
+        type=int,
+        nargs="+",
+        default=[1, 4],
+        help="batch sizes to export",
+    )
+    parser.add_argument(
+        "--voxel_buckets",
+        type=int,
+        nargs="+",
+        default=None,
+        help="voxel counts to export, cfg.data.voxel_buckets or max_voxel_num by default",
+    )
+    return parser.parse_args()
 
 
 def main():
-    config_path = "configs_ms/nusc/pp/nusc_centerpoint_pp_02voxel_two_pfn_10sweep.py"
-    cfg = Config.fromfile(config_path)
-    context.set_context(mode=context.GRAPH_MODE, device_id=6, device_target="Ascend")
+    args = parse_args()
+    cfg = Config.fromfile(args.config)
+    device_id = int(os.getenv("DEVICE_ID", "0"))
+    logger.info(f"DEVICE ID is {device_id}")
+    context.set_context(
+        mode=context.GRAPH_MODE, device_id=device_id, device_target="Ascend"
+    )
 
     center_point = build_detector(
         cfg.model, train_cfg=cfg.train_cfg, test_cfg=cfg.test_cfg
     )
-    load_checkpoint("./centerpoint_ms.ckpt", net=center_point)
-
-    voxel = np.random.uniform(0.0, 1.0, size=[4, 60000, 20, 5]).astype(np.float32)
-    coordinates = np.random.uniform(0.0, 1.0, size=[4, 60000, 4]).astype(np.int32)
-    num_points = np.random.uniform(0.0, 1.0, size=[4, 60000]).astype(np.int32)
-    num_voxels = np.random.uniform(0.0, 1.0, size=[4, 1]).astype(np.int64)
-    shape = np.random.uniform(0.0, 1.0, size=[4, 3]).astype(np.int64)
-    hm_or_token = np.random.uniform(0.0, 1.0, size=[4, 32]).astype(np.int64)
+    load_checkpoint(args.checkpoint, net=center_point)
+    center_point.set_train(False)
 
-    export(
+    max_voxel_num = cfg.voxel_generator.max_voxel_num
+    if isinstance(max_voxel_num, (list, tuple)):
+        max_voxel_num = max_voxel_num[1]
+    voxel_buckets = (
+        args.voxel_buckets or cfg.data.get("voxel_buckets", None) or [max_voxel_num]
+    )
+    export_graphs(
         center_point,
-        Tensor(voxel),
-        Tensor(coordinates),
-        Tensor(num_points),
-        Tensor(num_voxels),
-        Tensor(shape),
-        Tensor(hm_or_token),
-        file_name="centerpoint_mindir_bs_4",
-        file_format="MINDIR",
+        args.out_dir,
+        args.batch_sizes,
+        voxel_buckets,
+        cfg.voxel_generator.max_points_in_voxel,
+        cfg.model.reader.num_input_features,
     )
 
 
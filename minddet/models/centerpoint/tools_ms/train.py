@@ -17,7 +17,11 @@ from mindspore.train.callback import CheckpointConfig, LossMonitor, ModelCheckpo
 from mindspore.train.loss_scale_manager import DynamicLossScaleManager
 from mindspore.train.model import Model
 from tools_ms.optim_zy import AdamW
-from tools_ms.utils.utils import TimeMonitor, TrainOneStepCellWrapper
+from tools_ms.utils.utils import (
+    PipelineProfileMonitor,
+    TimeMonitor,
+    TrainOneStepCellWrapper,
+)
 
 logger.basicConfig(level=logger.INFO)
 cur_path = os.path.split(os.path.realpath(__file__))[0] + "/../"
@@ -61,6 +65,16 @@ def parse_args():
         action="store_true",
         help="is_dump",
     )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="run the data pipeline online instead of reading mindrecord",
+    )
+    parser.add_argument(
+        "--profile_pipeline",
+        default=None,
+        help="directory for the per stage latency of the pipeline, with --streaming",
+    )
     parser.add_argument("--epochs", type=int, default=20, help="total epochs")
     parser.add_argument("--weight_decay", type=float, default=0.01, help="weight_decay")
     parser.add_argument(
@@ -202,6 +216,8 @@ def main():
     logger.info(f"args: {args}")
     logger.info(f"os.environ: {os.environ}")
 
+    if args.profile_pipeline:
+        cfg.data.train.profile = dict(out_dir=args.profile_pipeline)
     dataset_generator = build_dataset(cfg.data.train)
     dataset = build_dataloader(
         dataset_generator,
@@ -211,6 +227,9 @@ def main():
         rank_id=rank_id,
         dist=distributed,
         mindrecord_dir=cfg.train_mindrecord_dir,
+        streaming=args.streaming,
+        voxel_buckets=cfg.data.get("voxel_buckets", None),
+        voxel_dtype=cfg.data.get("voxel_dtype", None),
     )
 
     total_step = dataset.get_dataset_size() * cfg.total_epochs
@@ -260,6 +279,8 @@ def main():
         model = Model(net, optimizer=opt)
 
     callbacks = [LossMonitor(1), TimeMonitor(dataset.get_dataset_size())]
+    if args.profile_pipeline:
+        callbacks += [PipelineProfileMonitor(args.profile_pipeline)]
     logger.info("define callbacks")  # TODO
     if rank_id == 0:
         logger.info("rank_id == 0")  # TODO
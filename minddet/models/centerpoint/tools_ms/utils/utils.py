@@ -4,6 +4,11 @@ import time
 
 import mindspore.nn as nn
 import mindspore.ops as ops
+from det3d_ms.datasets.pipelines.profiler import (
+    format_table,
+    load_profiles,
+    reset_profiles,
+)
 from mindspore.train.callback import Callback
 
 
@@ -105,6 +110,26 @@ class TimeMonitor(Callback):
         print(train_log, flush=True)
 
 
+class PipelineProfileMonitor(Callback):
+    """
+    Print the per stage latency of the data pipeline workers at the end of epoch.
+
+    Args:
+        out_dir (str): profile out_dir of the dataset config.
+    """
+
+    def __init__(self, out_dir):
+        super(PipelineProfileMonitor, self).__init__()
+        self.out_dir = out_dir
+
+    def epoch_end(self, run_context):
+        profiles = load_profiles(self.out_dir)
+        if profiles:
+            print(format_table(profiles), flush=True)
+        # the next table covers the next epoch only
+        reset_profiles(self.out_dir)
+
+
 class TimeMonitorEval(Callback):
     """
     Monitor the time in train or eval process.
@@ -12,5 +12,7 @@ def build(voxel_cfg, use_self_train=True):
         voxel_size=list(voxel_cfg["voxel_size"]),
         point_cloud_range=list(voxel_cfg["point_cloud_range"]),
         max_num_points=voxel_cfg["max_number_of_points_per_voxel"],
+        engine=voxel_cfg.get("engine", "dense"),
+        workspace=voxel_cfg.get("workspace", False),
     )
     return voxel_generator
@@ -114,6 +114,276 @@ def points_to_voxel(points, voxel_size, coors_range, max_points=35, max_voxels=2
     return voxels, coors, num_points_per_voxel, voxel_num
 
 
+@numba.njit(parallel=True)
+def _voxel_keys_kernel(points, voxel_size, coors_range, grid_size, keys):
+    """linearized voxel index of every point, x varies fastest, -1 if out of range"""
+    n = points.shape[0]
+    for i in numba.prange(n):
+        key = 0
+        for j in range(2, -1, -1):
+            c = np.floor((points[i, j] - coors_range[j]) / voxel_size[j])
+            if c < 0 or c >= grid_size[j]:
+                key = -1
+                break
+            key = key * grid_size[j] + np.int64(c)
+        keys[i] = key
+
+
+@numba.jit(nopython=True)
+def _radix_argsort_kernel(keys, order, sorted_keys, num_bits, radix_bits=11):
+    """stable LSD radix sort of the non negative keys, returns their number"""
+    n = keys.shape[0]
+    num_valid = 0
+    for i in range(n):
+        if keys[i] >= 0:
+            order[num_valid] = i
+            sorted_keys[num_valid] = keys[i]
+            num_valid += 1
+    tmp_order = np.empty_like(order)
+    tmp_keys = np.empty_like(sorted_keys)
+    num_buckets = 1 << radix_bits
+    bucket_mask = num_buckets - 1
+    counts = np.empty((num_buckets + 1,), dtype=np.int64)
+    num_passes = 0
+    shift = 0
+    while shift < num_bits:
+        src_order, dst_order = (
+            (order, tmp_order) if num_passes % 2 == 0 else (tmp_order, order)
+        )
+        src_keys, dst_keys = (
+            (sorted_keys, tmp_keys) if num_passes % 2 == 0 else (tmp_keys, sorted_keys)
+        )
+        counts[:] = 0
+        for p in range(num_valid):
+            counts[((src_keys[p] >> shift) & bucket_mask) + 1] += 1
+        for b in range(num_buckets):
+            counts[b + 1] += counts[b]
+        for p in range(num_valid):
+            b = (src_keys[p] >> shift) & bucket_mask
+            q = counts[b]
+            dst_order[q] = src_order[p]
+            dst_keys[q] = src_keys[p]
+            counts[b] = q + 1
+        num_passes += 1
+        shift += radix_bits
+    if num_passes % 2 == 1:
+        order[:num_valid] = tmp_order[:num_valid]
+        sorted_keys[:num_valid] = tmp_keys[:num_valid]
+    return num_valid
+
+
+@numba.njit(parallel=True)
+def _fill_sorted_voxels_kernel(
+    points,
+    order,
+    sorted_keys,
+    run_starts,
+    run_lengths,
+    voxel_runs,
+    grid_size,
+    num_points_per_voxel,
+    voxels,
+    coors,
+    max_points,
+    stop_index,
+):
+    """fill every voxel from its run of sorted points, in parallel over voxels"""
+    for v in numba.prange(voxel_runs.shape[0]):
+        run = voxel_runs[v]
+        start = run_starts[run]
+        num = 0
+        for k in range(run_lengths[run]):
+            i = order[start + k]
+            # points are sorted by index inside a run
+            if num >= max_points or i >= stop_index:
+                break
+            voxels[v, num] = points[i]
+            num += 1
+        num_points_per_voxel[v] = num
+        key = sorted_keys[start]
+        coors[v, 2] = key % grid_size[0]
+        key //= grid_size[0]
+        coors[v, 1] = key % grid_size[1]
+        coors[v, 0] = key // grid_size[1]
+        coors[v, 3] = 1
+
+
+def _sorted_voxel_runs(points, voxel_size, coors_range, max_voxels):
+    """sort points by voxel key, runs of the first max_voxels voxels in order of their first point"""
+    grid_size = (coors_range[3:] - coors_range[:3]) / voxel_size
+    grid_size = np.round(grid_size).astype(np.int64)
+    num_bits = max(int(np.prod(grid_size)) - 1, 1).bit_length()
+
+    n = points.shape[0]
+    keys = np.empty((n,), dtype=np.int64)
+    _voxel_keys_kernel(points, voxel_size, coors_range, grid_size, keys)
+    order = np.empty((n,), dtype=np.int64)
+    sorted_keys = np.empty((n,), dtype=np.int64)
+    num_valid = _radix_argsort_kernel(keys, order, sorted_keys, num_bits)
+    order = order[:num_valid]
+    sorted_keys = sorted_keys[:num_valid]
+
+    run_starts = np.flatnonzero(np.diff(sorted_keys)) + 1
+    run_starts = np.concatenate([[0], run_starts]) if num_valid else run_starts
+    run_lengths = np.diff(np.append(run_starts, num_valid))
+    # number the runs in order of their first point
+    first_run = np.full((n,), -1, dtype=np.int64)
+    first_run[order[run_starts]] = np.arange(run_starts.shape[0])
+    first_index = np.flatnonzero(first_run >= 0)
+    stop_index = first_index[max_voxels] if first_index.shape[0] > max_voxels else n
+    voxel_runs = first_run[first_index[:max_voxels]]
+    return (
+        order,
+        sorted_keys,
+        run_starts,
+        run_lengths,
+        voxel_runs,
+        grid_size,
+        stop_index,
+    )
+
+
+def points_to_voxel_sorted(
+    points, voxel_size, coors_range, max_points=35, max_voxels=20000
+):
+    """sort based version of points_to_voxel with identical output.
+
+    Points are keyed by their linearized voxel index and radix sorted, the runs
+    of equal keys are the voxels. Voxels are numbered by their first point and
+    points from the one that would open voxel max_voxels + 1 on are dropped, as
+    in _points_to_voxel_reverse_kernel. No dense coor_to_voxelidx grid is needed
+    and the voxels are filled in parallel.
+
+    Args:
+        see points_to_voxel, points are [N, 4] xyzr.
+
+    Returns:
+        see points_to_voxel.
+    """
+    if not isinstance(voxel_size, np.ndarray):
+        voxel_size = np.array(voxel_size, dtype=points.dtype)
+    if not isinstance(coors_range, np.ndarray):
+        coors_range = np.array(coors_range, dtype=points.dtype)
+
+    voxel_runs = _sorted_voxel_runs(points, voxel_size, coors_range, max_voxels)
+    num_points_per_voxel = np.zeros(shape=(max_voxels,), dtype=np.int32)
+    voxels = np.zeros(
+        shape=(max_voxels, max_points, points.shape[-1]), dtype=points.dtype
+    )
+    coors = np.zeros(shape=(max_voxels, 4), dtype=np.int32)
+    _fill_sorted_voxels_kernel(
+        points,
+        *voxel_runs[:-1],
+        num_points_per_voxel,
+        voxels,
+        coors,
+        max_points,
+        voxel_runs[-1],
+    )
+    return voxels, coors, num_points_per_voxel, voxel_runs[4].shape[0]
+
+
+class VoxelWorkspace:
+    """Reusable buffers for points_to_voxel and points_to_voxel_sorted.
+
+    The outputs and the dense coor_to_voxelidx grid are allocated once, sized
+    for the largest max_voxels seen, and only the voxels and grid cells written
+    by the previous call are reset. Results are views that the next call
+    overwrites, pass copy=True to keep them.
+    """
+
+    def __init__(self, voxel_size, coors_range, max_points):
+        self.voxel_size = np.array(voxel_size, dtype=np.float32)
+        self.coors_range = np.array(coors_range, dtype=np.float32)
+        self.max_points = max_points
+        voxelmap_shape = (self.coors_range[3:] - self.coors_range[:3]) / self.voxel_size
+        voxelmap_shape = tuple(np.round(voxelmap_shape).astype(np.int32).tolist())
+        self._voxelmap_shape = voxelmap_shape[::-1]
+        self.coor_to_voxelidx = None
+        self.voxels = None
+        self.coors = None
+        self.num_points_per_voxel = None
+        self._num_used = 0
+
+    def _reserve(self, points, max_voxels):
+        """(re)allocate the outputs if they can't hold max_voxels voxels of points"""
+        voxel_shape = (self.max_points, points.shape[-1])
+        if (
+            self.voxels is None
+            or self.voxels.shape[0] < max_voxels
+            or self.voxels.shape[1:] != voxel_shape
+            or self.voxels.dtype != points.dtype
+        ):
+            self.voxels = np.zeros((max_voxels,) + voxel_shape, dtype=points.dtype)
+            self.coors = np.zeros(shape=(max_voxels, 4), dtype=np.int32)
+            self.num_points_per_voxel = np.zeros(shape=(max_voxels,), dtype=np.int32)
+            if self.coor_to_voxelidx is not None:
+                self.coor_to_voxelidx.fill(-1)
+            self._num_used = 0
+
+    def reset(self):
+        """reset the voxels and grid cells written by the previous call"""
+        num_used = self._num_used
+        if num_used == 0:
+            return
+        if self.coor_to_voxelidx is not None:
+            coors = self.coors[:num_used]
+            self.coor_to_voxelidx[coors[:, 0], coors[:, 1], coors[:, 2]] = -1
+        self.voxels[:num_used] = 0
+        self.coors[:num_used] = 0
+        self.num_points_per_voxel[:num_used] = 0
+        self._num_used = 0
+
+    def generate(self, points, max_voxels=20000, engine="dense", copy=False):
+        """voxelize points into the workspace"""
+        self._reserve(points, max_voxels)
+        self.reset()
+        if engine == "dense":
+            if self.coor_to_voxelidx is None:
+                self.coor_to_voxelidx = -np.ones(
+                    shape=self._voxelmap_shape, dtype=np.int32
+                )
+            voxel_num = _points_to_voxel_reverse_kernel(
+                points,
+                self.voxel_size,
+                self.coors_range,
+                self.num_points_per_voxel,
+                self.coor_to_voxelidx,
+                self.voxels,
+                self.coors,
+                self.max_points,
+                max_voxels,
+            )
+        else:
+            voxel_runs = _sorted_voxel_runs(
+                points, self.voxel_size, self.coors_range, max_voxels
+            )
+            _fill_sorted_voxels_kernel(
+                points,
+                *voxel_runs[:-1],
+                self.num_points_per_voxel,
+                self.voxels,
+                self.coors,
+                self.max_points,
+                voxel_runs[-1],
+            )
+            voxel_num = voxel_runs[4].shape[0]
+        self._num_used = voxel_num
+
+        outputs = (
+            self.voxels[:max_voxels],
+            self.coors[:max_voxels],
+            self.num_points_per_voxel[:max_voxels],
+        )
+        if copy:
+            # only the filled voxels are copied, the padding comes from zeros
+            copies = tuple(np.zeros_like(x) for x in outputs)
+            for src, dst in zip(outputs, copies):
+                dst[:voxel_num] = src[:voxel_num]
+            outputs = copies
+        return outputs + (voxel_num,)
+
+
 @numba.jit(nopython=True)
 def bound_points_jit(points, upper_bound, lower_bound):
     """bounds points jit"""
@@ -92,12 +92,29 @@ class DataBaseSampler:
             if np.abs(global_rot_range[0] - global_rot_range[1]) >= 1e-3:
                 self._enable_global_rot = True
         self._global_rot_range = global_rot_range
+        # memory maps of the packed gt databases, opened on first use
+        self._packed_points = {}
 
     @property
     def use_group_sampling(self):
         """use group sampling"""
         return self._use_group_sampling
 
+    def load_points(self, root_path, info, num_point_features):
+        """load the points of a sampled object"""
+        path = str(pathlib.Path(root_path) / info["path"])
+        if "offset" not in info:
+            s_points = np.fromfile(path, dtype=np.float32)
+            return s_points.reshape([-1, num_point_features])
+        if path not in self._packed_points:
+            self._packed_points[path] = np.memmap(
+                path, dtype=np.float32, mode="r"
+            ).reshape([-1, num_point_features])
+        start = info["offset"]
+        return np.array(
+            self._packed_points[path][start : start + info["num_points_in_gt"]]
+        )
+
     def sample_all(
         self,
         root_path,
@@ -183,10 +200,7 @@ class DataBaseSampler:
             num_sampled = len(sampled)
             s_points_list = []
             for info in sampled:
-                s_points = np.fromfile(
-                    str(pathlib.Path(root_path) / info["path"]), dtype=np.float32
-                )
-                s_points = s_points.reshape([-1, num_point_features])
+                s_points = self.load_points(root_path, info, num_point_features)
                 if "rot_transform" in info:
                     rot = info["rot_transform"]
                     s_points[:, :3] = box_np_ops.rotation_points_single_angle(
@@ -1,12 +1,30 @@
 """voxel generator"""
 import numpy as np
-from src.core.point_cloud.point_cloud_ops import points_to_voxel
+from src.core.point_cloud.point_cloud_ops import (
+    VoxelWorkspace,
+    points_to_voxel,
+    points_to_voxel_sorted,
+)
+
+VOXEL_ENGINES = {
+    "dense": points_to_voxel,
+    "sort": points_to_voxel_sorted,
+}
 
 
 class VoxelGenerator:
     """voxel generator"""
 
-    def __init__(self, voxel_size, point_cloud_range, max_num_points):
+    def __init__(
+        self,
+        voxel_size,
+        point_cloud_range,
+        max_num_points,
+        engine="dense",
+        workspace=False,
+    ):
+        if engine not in VOXEL_ENGINES:
+            raise ValueError(f"unknown voxel engine {engine}")
         point_cloud_range = np.array(point_cloud_range, dtype=np.float32)
         voxel_size = np.array(voxel_size, dtype=np.float32)
         grid_size = (point_cloud_range[3:] - point_cloud_range[:3]) / voxel_size
@@ -16,10 +34,21 @@ class VoxelGenerator:
         self._point_cloud_range = point_cloud_range
         self._max_num_points = max_num_points
         self._grid_size = grid_size
+        self._engine = engine
+        # reuse the output buffers and the voxel grid across calls
+        self._workspace = (
+            VoxelWorkspace(voxel_size, point_cloud_range, max_num_points)
+            if workspace
+            else None
+        )
 
-    def generate(self, points, max_voxels):
-        """generate"""
-        return points_to_voxel(
+    def generate(self, points, max_voxels, engine=None, copy=False):
+        """generate, with a workspace the results are views unless copy is True"""
+        if engine is None:
+            engine = self._engine
+        if self._workspace is not None:
+            return self._workspace.generate(points, max_voxels, engine, copy=copy)
+        return VOXEL_ENGINES[engine](
             points,
             self._voxel_size,
             self._point_cloud_range,
@@ -194,8 +194,9 @@ def create_groundtruth_database(
     lidar_only=False,
     bev_only=False,
     coors_range=None,
+    packed=False,
 ):
-    """create ground truth database"""
+    """create ground truth database, packed appends the objects of a class to one file"""
     root_path = pathlib.Path(data_path)
     if info_path is None:
         info_path = root_path / "kitti_infos_train.pkl"
@@ -215,6 +216,8 @@ def create_groundtruth_database(
     for name in used_classes:
         all_db_infos[name] = []
     group_counter = 0
+    packed_files = {}
+    packed_sizes = {}
     for info in prog_bar(kitti_infos):
         velodyne_path = info["velodyne_path"]
         if relative_path:
@@ -255,13 +258,25 @@ def create_groundtruth_database(
             group_ids = np.arange(bboxes.shape[0], dtype=np.int64)
         point_indices = box_ops.points_in_rbbox(points, rbbox_lidar)
         for i in range(num_obj):
-            filename = f"{image_idx}_{names[i]}_{gt_idxes[i]}.bin"
-            filepath = database_save_path / filename
             gt_points = points[point_indices[:, i]]
 
             gt_points[:, :3] -= rbbox_lidar[i, :3]
-            with open(filepath, "w") as f:
-                gt_points.tofile(f)
+            if packed:
+                if names[i] not in used_classes:
+                    continue
+                filename = f"{names[i]}.bin"
+                filepath = database_save_path / filename
+                if names[i] not in packed_files:
+                    packed_files[names[i]] = open(filepath, "wb")
+                    packed_sizes[names[i]] = 0
+                offset = packed_sizes[names[i]]
+                gt_points.tofile(packed_files[names[i]])
+                packed_sizes[names[i]] += gt_points.shape[0]
+            else:
+                filename = f"{image_idx}_{names[i]}_{gt_idxes[i]}.bin"
+                filepath = database_save_path / filename
+                with open(filepath, "w") as f:
+                    gt_points.tofile(f)
             if names[i] in used_classes:
                 if relative_path:
                     db_path = str(database_save_path.stem + "/" + filename)
@@ -282,9 +297,13 @@ def create_groundtruth_database(
                     group_dict[local_group_id] = group_counter
                     group_counter += 1
                 db_info["group_id"] = group_dict[local_group_id]
+                if packed:
+                    db_info["offset"] = offset
                 if "score" in annos:
                     db_info["score"] = annos["score"][i]
                 all_db_infos[names[i]].append(db_info)
+    for f in packed_files.values():
+        f.close()
     for k, v in all_db_infos.items():
         print(f"load {len(v)} {k} database infos")
 